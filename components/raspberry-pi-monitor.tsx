@@ -271,6 +271,8 @@ if __name__ == "__main__":
 
   const consoleEndRef = useRef<HTMLDivElement>(null)
   const pollingIntervalRef = useRef<NodeJS.Timeout | null>(null)
+  const eventSourceRef = useRef<EventSource | null>(null)
+  const statusEtagRef = useRef<string | null>(null)
 
   // Function to check connection to Raspberry Pi
   const checkConnection = async () => {
@@ -307,14 +309,23 @@ if __name__ == "__main__":
   // Function to get status from Raspberry Pi
   const getStatus = async () => {
     try {
+      // Send the last ETag so an unchanged status costs a bodyless 304
+      const headers: Record<string, string> = { "Content-Type": "application/json" }
+      if (statusEtagRef.current) {
+        headers["If-None-Match"] = statusEtagRef.current
+      }
+
       const response = await fetch(`${raspberryPiUrl}/status`, {
         method: "GET",
-        headers: {
-          "Content-Type": "application/json",
-        },
+        headers,
       })
 
+      if (response.status === 304) {
+        return null
+      }
+
       if (response.ok) {
+        statusEtagRef.current = response.headers.get("ETag")
         const data = await response.json()
         setJsonData(data)
         if (data.lastUpdate) {
@@ -397,13 +408,12 @@ if __name__ == "__main__":
     setConsoleOutput([])
   }
 
-  // Function to start polling
-  const startPolling = () => {
+  // Function to start interval polling (fallback when the status stream is unavailable)
+  const startIntervalPolling = () => {
     if (pollingIntervalRef.current) {
       clearInterval(pollingIntervalRef.current)
     }
 
-    setIsPolling(true)
     addToConsole(`Started polling at ${pollingInterval}ms intervals`)
 
     // Initial check
@@ -414,6 +424,55 @@ if __name__ == "__main__":
     }, pollingInterval)
   }
 
+  // Function to start monitoring: subscribe to the pushed status stream, or poll
+  const startPolling = () => {
+    setIsPolling(true)
+
+    if (typeof window === "undefined" || !("EventSource" in window)) {
+      startIntervalPolling()
+      return
+    }
+
+    if (eventSourceRef.current) {
+      eventSourceRef.current.close()
+    }
+
+    const eventSource = new EventSource(`${raspberryPiUrl}/events`)
+    eventSourceRef.current = eventSource
+    let opened = false
+
+    eventSource.onopen = () => {
+      opened = true
+      setConnectionStatus("connected")
+      addToConsole(`Subscribed to status stream at ${raspberryPiUrl}/events`)
+    }
+
+    eventSource.addEventListener("status", (event) => {
+      const data = JSON.parse((event as MessageEvent).data)
+      setJsonData(data)
+      if (data.lastUpdate) {
+        setLastUpdate(new Date(data.lastUpdate).toLocaleString())
+      }
+      addToConsole(`Received status update from ${raspberryPiUrl}`)
+    })
+
+    eventSource.addEventListener("frame", (event) => {
+      const frame = JSON.parse((event as MessageEvent).data)
+      addToConsole(`Lamp frame: ${frame.mode}${frame.route ? ` route ${frame.route}` : ""}`)
+    })
+
+    eventSource.onerror = () => {
+      // EventSource reconnects by itself once it has been connected; a stream
+      // that never opened means the receiver does not support it
+      if (!opened) {
+        eventSource.close()
+        eventSourceRef.current = null
+        addToConsole("Status stream unavailable, falling back to polling")
+        startIntervalPolling()
+      }
+    }
+  }
+
   // Function to stop polling
   const stopPolling = () => {
     if (pollingIntervalRef.current) {
@@ -421,6 +480,11 @@ if __name__ == "__main__":
       pollingIntervalRef.current = null
     }
 
+    if (eventSourceRef.current) {
+      eventSourceRef.current.close()
+      eventSourceRef.current = null
+    }
+
     setIsPolling(false)
     addToConsole("Stopped polling")
   }
@@ -456,6 +520,9 @@ if __name__ == "__main__":
       if (pollingIntervalRef.current) {
         clearInterval(pollingIntervalRef.current)
       }
+      if (eventSourceRef.current) {
+        eventSourceRef.current.close()
+      }
     }
   }, [])
 
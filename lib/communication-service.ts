@@ -13,6 +13,7 @@ export interface CommunicationConfig {
   mqttTopic?: string
   websocketPath?: string
   apiEndpoint?: string
+  batchEndpoint?: string
   username?: string
   password?: string
   useAuth: boolean
@@ -26,6 +27,7 @@ export const defaultConfig: CommunicationConfig = {
   mqttTopic: "traffic/commands",
   websocketPath: "/ws",
   apiEndpoint: "/api/command",
+  batchEndpoint: "/commands/batch",
   useAuth: false,
 }
 
@@ -235,13 +237,18 @@ export class CommunicationService {
 
   // Send command via HTTP
   private async sendHttpCommand(command: Command): Promise<any> {
-    const url = `${this.config.baseUrl}${this.config.apiEndpoint || "/api/command"}`
+    return this.postJson(this.config.apiEndpoint || "/api/command", command)
+  }
+
+  // POST a JSON body to an endpoint on the configured device
+  private async postJson(endpoint: string, payload: any): Promise<any> {
+    const url = `${this.config.baseUrl}${endpoint}`
     const options: RequestInit = {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
       },
-      body: JSON.stringify(command),
+      body: JSON.stringify(payload),
     }
 
     // Add authentication if configured
@@ -264,6 +271,11 @@ export class CommunicationService {
 
   // Send command via WebSocket
   private sendWebSocketCommand(command: Command): Promise<any> {
+    return this.sendWebSocketMessage(command)
+  }
+
+  // Send a message via WebSocket and wait for the response carrying its ID
+  private sendWebSocketMessage(payload: any): Promise<any> {
     return new Promise((resolve, reject) => {
       if (!this.websocket || this.websocket.readyState !== WebSocket.OPEN) {
         reject(new Error("WebSocket is not connected"))
@@ -272,7 +284,7 @@ export class CommunicationService {
 
       // Generate a unique ID for this command to track the response
       const commandId = `cmd_${Date.now()}_${Math.random().toString(36).substr(2, 9)}`
-      const commandWithId = { ...command, id: commandId }
+      const commandWithId = { ...payload, id: commandId }
 
       // Set up a one-time message handler to catch the response
       const messageHandler = (event: MessageEvent) => {
@@ -302,6 +314,11 @@ export class CommunicationService {
 
   // Send command via MQTT
   private sendMqttCommand(command: Command): Promise<any> {
+    return this.sendMqttMessage(command)
+  }
+
+  // Publish a message to the MQTT command topic
+  private sendMqttMessage(payload: any): Promise<any> {
     return new Promise((resolve, reject) => {
       if (!this.mqttClient || !this.mqttClient.connected) {
         reject(new Error("MQTT client is not connected"))
@@ -315,7 +332,7 @@ export class CommunicationService {
 
       // Generate a unique ID for this command
       const commandId = `cmd_${Date.now()}_${Math.random().toString(36).substr(2, 9)}`
-      const commandWithId = { ...command, id: commandId }
+      const commandWithId = { ...payload, id: commandId }
 
       // Publish the command to the MQTT topic
       this.mqttClient.publish(
@@ -335,24 +352,39 @@ export class CommunicationService {
     })
   }
 
-  // Send a batch of commands
+  // Send a batch of commands as one transaction. The Raspberry Pi validates
+  // every command first, changes the lamps in a single update and saves once,
+  // so either all commands succeed or none are applied.
   public async sendBatchCommands(commands: Command[]): Promise<any[]> {
-    const results = []
-
-    for (const command of commands) {
-      try {
-        const result = await this.sendCommand(command)
-        results.push({ command, result, success: true })
-      } catch (error) {
-        results.push({
-          command,
-          error: error instanceof Error ? error.message : "Unknown error",
-          success: false,
-        })
+    const batch = commands.map((command) => ({
+      ...command,
+      timestamp: command.timestamp || Date.now(),
+    }))
+
+    try {
+      let result: any
+      switch (this.config.protocol) {
+        case "http":
+          result = await this.postJson(this.config.batchEndpoint || "/commands/batch", { commands: batch })
+          break
+        case "websocket":
+          result = await this.sendWebSocketMessage({ commands: batch })
+          break
+        case "mqtt":
+          result = await this.sendMqttMessage({ commands: batch })
+          break
+        default:
+          throw new Error(`Unsupported protocol: ${this.config.protocol}`)
       }
+      return batch.map((command) => ({ command, result, success: true }))
+    } catch (error) {
+      console.error(`Error sending command batch via ${this.config.protocol}:`, error)
+      return batch.map((command) => ({
+        command,
+        error: error instanceof Error ? error.message : "Unknown error",
+        success: false,
+      }))
     }
-
-    return results
   }
 
   // Helper method to create a simple command
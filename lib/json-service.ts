@@ -67,6 +67,48 @@ export interface ControlModeSettings {
   }
 }
 
+export interface LampInterval {
+  startMs: number
+  endMs: number
+  blinking?: boolean
+}
+
+export interface TimelineConflict {
+  type: "red_green" | "dark" | "no_clearance" | "invalid_route" | "incomplete_route" | "no_sequence"
+  route: number | null
+  pole: string | null
+  startMs: number
+  message: string
+}
+
+// Lamp timeline compiled by the Raspberry Pi for a proposed configuration (POST /timeline)
+export interface LampTimeline {
+  zone: number
+  controlMode: "auto" | "manual" | "semi"
+  blink: boolean
+  cycleMs: number
+  routes: { route: number; startMs: number; endMs: number }[]
+  phases: Record<string, Record<string, LampInterval[]>>
+  conflicts: TimelineConflict[]
+  compileMs: number
+}
+
+// Per-stage latency of recent requests, in ms since the Raspberry Pi received them (GET /traces)
+export interface LatencyTrace {
+  correlationId: string
+  kind: "config" | "command" | "preempt"
+  receivedAt: number
+  stagesMs: Record<string, number>
+}
+
+export interface LatencyTraces {
+  traces: LatencyTrace[]
+  summary: Record<string, Record<string, { count: number; p50: number; p90: number; p99: number; max: number }>>
+}
+
+// Header carrying a request's correlation ID through the Raspberry Pi to the lamp change
+const CORRELATION_HEADER = "X-Correlation-Id"
+
 class JsonService {
   private static instance: JsonService
   private lastCommand: TrafficCommand | null = null
@@ -283,7 +325,9 @@ class JsonService {
 
         const url = targetIp ? `http://${targetIp}${endpoint}` : `${this.controllerBaseUrl}${endpoint}`
 
-        console.log(`Sending command to: ${url}`)
+        // Traced on the Raspberry Pi from this request to the lamp change (GET /traces)
+        const correlationId = this.generateRequestId()
+        console.log(`Sending command to: ${url} (trace ${correlationId})`)
 
         // Use a timeout to prevent hanging requests
         const controller = new AbortController()
@@ -291,7 +335,7 @@ class JsonService {
 
         const response = await fetch(url, {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
+          headers: { "Content-Type": "application/json", [CORRELATION_HEADER]: correlationId },
           body: jsonData,
           signal: controller.signal,
         })
@@ -299,7 +343,7 @@ class JsonService {
         clearTimeout(timeoutId)
 
         if (response.ok) {
-          console.log(`Command sent successfully to ${url}`)
+          console.log(`Command sent successfully to ${url} (trace ${correlationId})`)
           success = true
           this.setConnectionStatus("connected")
         } else {
@@ -700,8 +744,8 @@ class JsonService {
         lastState: this.lastState,
       }
 
-      // Create JSON string
-      const jsonData = JSON.stringify(data, null, 2)
+      // Create JSON string (no indentation: the Raspberry Pi never reads it by eye)
+      const jsonData = JSON.stringify(data)
 
       // Log the JSON data
       console.log("Sending JSON configuration to Raspberry Pi:", jsonData)
@@ -712,6 +756,12 @@ class JsonService {
         return true
       }
 
+      // One idempotency key per push, so the Raspberry Pi can acknowledge the
+      // network fallback or a retry of the same payload without reapplying it
+      const idempotencyKey = this.generateRequestId()
+      // The fallback carries the same correlation ID, so a trace shows the push that got through
+      const correlationId = this.generateRequestId()
+
       // Try Ethernet connection first (direct IP)
       let success = false
       let ethernetError = null
@@ -733,6 +783,8 @@ class JsonService {
           headers: {
             "Content-Type": "application/json",
             "X-Signature": signature,
+            "Idempotency-Key": idempotencyKey,
+            [CORRELATION_HEADER]: correlationId,
           },
           body: jsonData,
           signal: controller.signal,
@@ -741,7 +793,7 @@ class JsonService {
         clearTimeout(timeoutId)
 
         if (response.ok) {
-          console.log(`JSON configuration sent successfully via Ethernet`)
+          console.log(`JSON configuration sent successfully via Ethernet (trace ${correlationId})`)
           success = true
           this.setConnectionStatus("connected")
           return true
@@ -775,6 +827,8 @@ class JsonService {
             headers: {
               "Content-Type": "application/json",
               "X-Signature": signature,
+              "Idempotency-Key": idempotencyKey,
+              [CORRELATION_HEADER]: correlationId,
             },
             body: jsonData,
             signal: controller.signal,
@@ -783,7 +837,7 @@ class JsonService {
           clearTimeout(timeoutId)
 
           if (response.ok) {
-            console.log(`JSON configuration sent successfully via network`)
+            console.log(`JSON configuration sent successfully via network (trace ${correlationId})`)
             success = true
             this.setConnectionStatus("connected")
             return true
@@ -826,6 +880,74 @@ class JsonService {
     }
   }
 
+  /**
+   * Ask the Raspberry Pi for the lamp timeline a configuration would produce,
+   * without applying it. Returns null if the Pi cannot be reached.
+   */
+  public async previewTimeline(config: Record<string, unknown>, zone?: number): Promise<LampTimeline | null> {
+    if (this.isPreviewMode) {
+      return null
+    }
+    const query = zone ? `?zone=${zone}` : ""
+    const url = `http://${this.ipAddresses.RaspberryPi || "192.168.1.100"}:8080/timeline${query}`
+    const controller = new AbortController()
+    const timeoutId = setTimeout(() => controller.abort(), 5000)
+    try {
+      const response = await fetch(url, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(config),
+        signal: controller.signal,
+      })
+      if (!response.ok) {
+        console.warn(`Error compiling timeline: ${response.status} ${response.statusText}`)
+        return null
+      }
+      return (await response.json()) as LampTimeline
+    } catch (error) {
+      console.warn("Network error compiling timeline:", error)
+      return null
+    } finally {
+      clearTimeout(timeoutId)
+    }
+  }
+
+  /**
+   * Fetch the Raspberry Pi's recent request traces and per-stage latency
+   * percentiles. Returns null if the Pi cannot be reached.
+   */
+  public async getLatencyTraces(limit = 20): Promise<LatencyTraces | null> {
+    if (this.isPreviewMode) {
+      return null
+    }
+    const url = `http://${this.ipAddresses.RaspberryPi || "192.168.1.100"}:8080/traces?limit=${limit}`
+    const controller = new AbortController()
+    const timeoutId = setTimeout(() => controller.abort(), 5000)
+    try {
+      const response = await fetch(url, { signal: controller.signal })
+      if (!response.ok) {
+        console.warn(`Error fetching latency traces: ${response.status} ${response.statusText}`)
+        return null
+      }
+      return (await response.json()) as LatencyTraces
+    } catch (error) {
+      console.warn("Network error fetching latency traces:", error)
+      return null
+    } finally {
+      clearTimeout(timeoutId)
+    }
+  }
+
+  /**
+   * Generate a unique ID for one delivery of a payload, or one request's trace
+   */
+  private generateRequestId(): string {
+    if (typeof window !== "undefined" && window.crypto && "randomUUID" in window.crypto) {
+      return window.crypto.randomUUID()
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`
+  }
+
   /**
    * Create a signature for authenticating with the Raspberry Pi
    */
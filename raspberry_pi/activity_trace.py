@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Binary Activity Trace for Traffic Junction Incidents
+
+Records what reached the controller and what the lamps did, compactly enough
+to leave running, so an incident can be replayed later (see trace_replay.py):
+
+    header   magic "TJTR", version, start time (wall clock), UTC offset
+    records  kind (1 byte), milliseconds since the previous record (4 bytes),
+             payload length (4 bytes), payload
+
+    SNAPSHOT  variables the trace starts from (deflated JSON)
+    CONFIG    a configuration payload as an 8 byte hash of the whole payload
+              plus the keys that changed since the previous one (deflated JSON)
+    RELOAD    reload announced to the controller (8 bytes of the body digest)
+    MANUAL    manual control variables sent to the controller (deflated JSON)
+    FRAME     lamp frame: mode, route and 2 bits per lamp (15 bytes)
+
+The file is bounded: past max_bytes it is moved to <path>.1 and a new file is
+started with the state needed to replay it on its own (the last configuration
+and the manual changes made since).
+
+Usage:
+    recorder = TraceRecorder("/home/pi/traffic_junction/traces/activity.trace")
+    recorder.config(config, digest)
+    python3 activity_trace.py show <trace file>
+"""
+
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+TRACE_MAGIC = b"TJTR"
+TRACE_VERSION = 1
+TRACE_MAX_BYTES = 4 * 1024 * 1024
+HEADER = struct.Struct("<4sBdi")  # magic, version, start time, UTC offset (seconds)
+RECORD = struct.Struct("<BII")  # kind, milliseconds since the previous record, payload length
+FRAME = struct.Struct("<BH")  # mode, route (0 for none), followed by the packed lamps
+
+SNAPSHOT, CONFIG, RELOAD, MANUAL, FRAME_KIND = range(1, 6)
+KIND_NAMES = {SNAPSHOT: "snapshot", CONFIG: "config", RELOAD: "reload", MANUAL: "manual", FRAME_KIND: "frame"}
+
+# Frame modes published by traffic_controller.py; any other mode is stored by name
+FRAME_MODES = ["route", "manual", "blink", "fail_safe", "preempt", "clearance"]
+POLES = ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]
+LIGHTS = ["red", "yellow", "greenLeft", "greenStraight", "greenRight"]
+LAMP_BYTES = (len(POLES) * len(LIGHTS) * 2 + 7) // 8
+
+_MISSING = object()
+
+
+def _pack_json(data):
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode())
+
+
+def _unpack_json(payload):
+    return json.loads(zlib.decompress(payload).decode())
+
+
+def config_hash(config):
+    """Short hash identifying a whole configuration payload"""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, separators=(",", ":")).encode()).digest()[:8]
+
+
+def _changed(old, new):
+    # True == 1 in Python, but the payload must come back exactly as sent
+    return old is _MISSING or old != new or type(old) is not type(new)
+
+
+def config_delta(previous, config):
+    """Keys set or removed going from one configuration to the next"""
+    delta = {"set": {key: value for key, value in config.items() if _changed(previous.get(key, _MISSING), value)}}
+    removed = [key for key in previous if key not in config]
+    if removed:
+        delta["unset"] = removed
+    return delta
+
+
+def encode_frame(frame):
+    """Pack a lamp frame ({"mode", "route", "lights"}) into bytes"""
+    mode = frame.get("mode")
+    code = FRAME_MODES.index(mode) + 1 if mode in FRAME_MODES else 0
+    lamps = 0
+    lights = frame.get("lights") or {}
+    index = 0
+    for pole in POLES:
+        for light in LIGHTS:
+            lamps |= (int(lights.get(pole, {}).get(light, 0)) & 3) << index
+            index += 2
+    payload = FRAME.pack(code, frame.get("route") or 0) + lamps.to_bytes(LAMP_BYTES, "little")
+    if code == 0:
+        payload += str(mode).encode()
+    return payload
+
+
+def decode_frame(payload):
+    """Unpack a lamp frame written by encode_frame"""
+    code, route = FRAME.unpack_from(payload)
+    lamps = int.from_bytes(payload[FRAME.size:FRAME.size + LAMP_BYTES], "little")
+    mode = FRAME_MODES[code - 1] if code else payload[FRAME.size + LAMP_BYTES:].decode()
+    lights = {}
+    index = 0
+    for pole in POLES:
+        lights[pole] = {}
+        for light in LIGHTS:
+            lights[pole][light] = (lamps >> index) & 3
+            index += 2
+    return {"mode": mode, "route": route or None, "lights": lights}
+
+
+class TraceRecorder:
+    """Class to append timestamped ingest and lamp activity to a bounded binary trace"""
+
+    def __init__(self, path, max_bytes=TRACE_MAX_BYTES, clock=time.time):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._lock = threading.Lock()
+        # State a new file starts from: ("snapshot", variables) or ("config", config)
+        self._base = None
+        self._manual = {}
+        self._config = {}
+        self._file = None
+
+        self.records = 0
+        self.bytes_written = 0
+        self.rotations = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            # Keep the previous run's trace, which is usually the interesting one
+            os.replace(path, path + ".1")
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, "wb")
+        self._start = self.clock()
+        self._last_ms = 0
+        self._size = HEADER.size
+        self._config = {}
+        self._file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, self._start, time.localtime().tm_gmtoff))
+        self._file.flush()
+
+    def _write(self, kind, payload):
+        """Append one record; the caller holds the lock"""
+        ms = max(int(round((self.clock() - self._start) * 1000)), self._last_ms)
+        delta = min(ms - self._last_ms, 0xFFFFFFFF)
+        self._last_ms = ms
+        record = RECORD.pack(kind, delta, len(payload)) + payload
+        self._file.write(record)
+        self._file.flush()
+        self._size += len(record)
+        self.records += 1
+        self.bytes_written += len(record)
+        if self._size > self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """Start a new file that can be replayed without the old one"""
+        self._file.close()
+        os.replace(self.path, self.path + ".1")
+        self.rotations += 1
+        self._open()
+        if self._base is not None:
+            kind, state = self._base
+            if kind == "snapshot":
+                self._write(SNAPSHOT, _pack_json(state))
+            else:
+                self._write_config(state)
+        if self._manual:
+            self._write(MANUAL, _pack_json(self._manual))
+
+    def _write_config(self, config):
+        payload = config_hash(config) + _pack_json(config_delta(self._config, config))
+        self._config = config
+        self._write(CONFIG, payload)
+
+    def snapshot(self, variables):
+        """Record the variables the controller is running with"""
+        with self._lock:
+            self._base = ("snapshot", dict(variables))
+            self._manual = {}
+            self._write(SNAPSHOT, _pack_json(variables))
+
+    def config(self, config):
+        """Record a configuration payload"""
+        with self._lock:
+            self._base = ("config", config)
+            self._manual = {}
+            self._write_config(config)
+
+    def reload(self, digest):
+        """Record a reload announced to the controller"""
+        with self._lock:
+            self._write(RELOAD, bytes.fromhex(digest)[:8])
+
+    def manual(self, changes):
+        """Record manual control variables sent to the controller"""
+        with self._lock:
+            self._manual.update(changes)
+            self._write(MANUAL, _pack_json(changes))
+
+    def frame(self, frame):
+        """Record a lamp frame published by the controller"""
+        with self._lock:
+            self._write(FRAME_KIND, encode_frame(frame))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def stats(self):
+        return {
+            "records": self.records,
+            "bytesWritten": self.bytes_written,
+            "rotations": self.rotations,
+        }
+
+
+def read_trace(path):
+    """
+    Read a trace file into (header, records).
+
+    Records are (time, kind, value) tuples, where value is the variables,
+    the whole configuration, the digest prefix, the manual changes or the
+    frame. A record cut short by a crash ends the trace.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not a trace file")
+    magic, version, start, utc_offset = HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError(f"{path} is not a version {TRACE_VERSION} trace file")
+
+    records = []
+    config = {}
+    offset = HEADER.size
+    ms = 0
+    while offset + RECORD.size <= len(data):
+        kind, delta, length = RECORD.unpack_from(data, offset)
+        payload = data[offset + RECORD.size:offset + RECORD.size + length]
+        if len(payload) < length:
+            break
+        offset += RECORD.size + length
+        ms += delta
+        when = start + ms / 1000
+
+        if kind == SNAPSHOT or kind == MANUAL:
+            value = _unpack_json(payload)
+        elif kind == CONFIG:
+            delta_record = _unpack_json(payload[8:])
+            config = dict(config)
+            config.update(delta_record["set"])
+            for key in delta_record.get("unset", []):
+                config.pop(key, None)
+            if config_hash(config) != payload[:8]:
+                raise ValueError(f"Configuration at {when:.3f} does not match its recorded hash")
+            value = config
+        elif kind == RELOAD:
+            value = payload.hex()
+        elif kind == FRAME_KIND:
+            value = decode_frame(payload)
+        else:
+            raise ValueError(f"Unknown trace record kind {kind}")
+        records.append((when, KIND_NAMES[kind], value))
+
+    header = {"start": start, "utcOffset": utc_offset, "bytes": len(data)}
+    return header, records
+
+
+def main():
+    """Print the records of a trace file"""
+    if len(sys.argv) < 3 or sys.argv[1] != "show":
+        print(__doc__)
+        return
+    header, records = read_trace(sys.argv[2])
+    print(f"Trace started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['start']))}, "
+          f"{len(records)} records, {header['bytes']} bytes")
+    for when, kind, value in records:
+        stamp = time.strftime('%H:%M:%S', time.localtime(when)) + f".{int(when * 1000) % 1000:03d}"
+        if kind == "frame":
+            lit = [f"{pole}:{light}" for pole, lights in value["lights"].items()
+                   for light, state in lights.items() if state]
+            detail = f"{value['mode']} route={value['route']} {' '.join(lit)}"
+        elif kind == "reload":
+            detail = value
+        else:
+            detail = f"{len(value)} keys"
+        print(f"{stamp}  {kind:<8} {detail}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Admission Control for Traffic Junction Webhook Receivers
+
+A misbehaving dashboard or a retry storm can send far more requests than a
+single-core Pi can parse and write to disk without starving the traffic
+controller. Requests are admitted in two steps, both before the body of a
+bulk request is read:
+
+    1. Token buckets per client address and per endpoint. A request finding
+       its bucket empty is answered 429 with Retry-After at once.
+    2. A bounded pool of work slots for the requests that do work (POSTs).
+       A request waits a short while in a bounded queue for a slot, and is
+       answered 429 if the queue is full or the wait runs out.
+
+Requests travel in lanes. The safety lane (all-red, flash and preemption
+requests) skips the buckets of the other lanes, has a slot reserved for it and
+is handed the next free slot ahead of everything else, so a flood of config
+uploads cannot hold back the command that makes the junction safe. It has
+generous buckets of its own so that it cannot be used to flood either.
+
+Usage:
+    admission = AdmissionControl({"/webhook": (2, 10)})
+    retry_after = admission.check(client, "/webhook", "bulk")
+    with admission.work("bulk") as admitted:
+        ...
+"""
+
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+LANES = ["safety", "command", "bulk", "read"]  # The safety lane is served first
+CLIENT_RATE = 10  # Requests per second each client address may sustain
+CLIENT_BURST = 30
+SAFETY_RATE = 20  # Per client, for the safety lane only
+SAFETY_BURST = 40
+DEFAULT_ENDPOINT_LIMIT = (20, 40)  # (requests per second, burst) for endpoints without a limit of their own
+WORK_SLOTS = 2  # Requests doing work at once; the Pi has one core, so more only interleave
+RESERVED_SLOTS = 1  # Of WORK_SLOTS, kept for the safety lane
+MAX_WAITING = 8  # Requests that may queue for a slot before the rest are turned away
+WAIT_TIMEOUT = 0.5  # seconds a queued request waits for a slot
+MAX_CLIENTS = 1024  # Client buckets kept, least recently seen dropped first
+
+
+class TokenBucket:
+    """Class to allow a sustained rate of events with bursts up to a limit"""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def take(self):
+        """Take a token; returns 0 if there was one, else the seconds until there will be"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionControl:
+    """Class to rate limit requests per client and endpoint and bound the work in progress"""
+
+    def __init__(self, endpoint_limits, client_rate=CLIENT_RATE, client_burst=CLIENT_BURST,
+                 safety_rate=SAFETY_RATE, safety_burst=SAFETY_BURST, slots=WORK_SLOTS,
+                 reserved=RESERVED_SLOTS, max_waiting=MAX_WAITING, wait_timeout=WAIT_TIMEOUT,
+                 clock=time.monotonic):
+        """endpoint_limits: {path: (requests per second, burst)} shared by all clients; other paths share DEFAULT_ENDPOINT_LIMIT"""
+        self.endpoint_limits = endpoint_limits
+        self.client_limit = (client_rate, client_burst)
+        self.safety_limit = (safety_rate, safety_burst)
+        self.slots = slots
+        self.reserved = reserved
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._clients = OrderedDict()  # (client, safety lane?) -> TokenBucket
+        self._endpoints = {}  # path, or None for every path without a limit of its own -> TokenBucket
+        self.active = 0
+        self.waiting = {lane: 0 for lane in LANES}
+        self.admitted = {lane: 0 for lane in LANES}
+        self.limited = {lane: 0 for lane in LANES}
+        self.busy = {lane: 0 for lane in LANES}
+
+    def check(self, client, endpoint, lane):
+        """Take a token for the request; returns None if admitted, else the seconds to retry after"""
+        with self._lock:
+            if lane == "safety":
+                buckets = [self._client_bucket(client, True)]
+            else:
+                buckets = [self._client_bucket(client, False), self._endpoint_bucket(endpoint)]
+            # Both buckets must have a token; neither is charged for a rejected request
+            for bucket in buckets:
+                retry_after = bucket.take()
+                if retry_after:
+                    for taken in buckets[:buckets.index(bucket)]:
+                        taken.tokens += 1
+                    self.limited[lane] += 1
+                    return retry_after
+            self.admitted[lane] += 1
+            return None
+
+    @contextmanager
+    def work(self, lane):
+        """Hold a work slot while the block runs; yields False if none came free in time"""
+        acquired = self._acquire(lane)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with self._lock:
+                    self.active -= 1
+                    self._slot_freed.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "activeSlots": self.active,
+                "slots": self.slots,
+                "reservedSlots": self.reserved,
+                "waiting": dict(self.waiting),
+                "admitted": dict(self.admitted),
+                "rateLimited": dict(self.limited),
+                "busy": dict(self.busy),
+                "clients": len(self._clients),
+            }
+
+    def _acquire(self, lane):
+        deadline = self.clock() + self.wait_timeout
+        with self._lock:
+            if not self._slot_available(lane):
+                if sum(self.waiting.values()) >= self.max_waiting and lane != "safety":
+                    self.busy[lane] += 1
+                    return False
+                self.waiting[lane] += 1
+                try:
+                    while not self._slot_available(lane):
+                        remaining = deadline - self.clock()
+                        if remaining <= 0:
+                            self.busy[lane] += 1
+                            return False
+                        self._slot_freed.wait(remaining)
+                finally:
+                    self.waiting[lane] -= 1
+            self.active += 1
+            return True
+
+    def _slot_available(self, lane):
+        if lane == "safety":
+            return self.active < self.slots
+        # Other lanes leave the reserved slots free and give way to waiting safety requests
+        return self.active < self.slots - self.reserved and not self.waiting["safety"]
+
+    def _client_bucket(self, client, safety):
+        key = (client, safety)
+        bucket = self._clients.get(key)
+        if bucket is None:
+            rate, burst = self.safety_limit if safety else self.client_limit
+            bucket = self._clients[key] = TokenBucket(rate, burst, self.clock)
+            if len(self._clients) > MAX_CLIENTS:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(key)
+        return bucket
+
+    def _endpoint_bucket(self, endpoint):
+        # Paths without a limit share one bucket, so requests to made-up URLs cannot grow the dict
+        key = endpoint if endpoint in self.endpoint_limits else None
+        bucket = self._endpoints.get(key)
+        if bucket is None:
+            rate, burst = self.endpoint_limits.get(key, DEFAULT_ENDPOINT_LIMIT)
+            bucket = self._endpoints[key] = TokenBucket(rate, burst, self.clock)
+        return bucket
+
+
+def reject(handler, retry_after, reason):
+    """
+    Answer 429 from an http.server request handler without reading the body;
+    the connection is closed so an unread body cannot be taken for a request.
+    """
+    body = json.dumps({"status": "error", "error": reason, "retryAfter": round(retry_after, 3)}).encode()
+    handler.close_connection = True
+    handler.send_response(429)
+    handler.send_header('Content-Type', 'application/json')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.send_header('Retry-After', str(max(1, math.ceil(retry_after))))
+    handler.send_header('Access-Control-Allow-Origin', '*')
+    handler.send_header('Connection', 'close')
+    handler.end_headers()
+    handler.wfile.write(body)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Non-blocking Logging for Traffic Junction Scripts
+
+Log calls only put the record on an in-memory queue; a background
+QueueListener formats it and writes it to disk. A slow SD card therefore never
+adds latency to the control loop or to webhook responses.
+
+    - Records are formatted on the listener thread. LazyJson defers json.dumps
+      of a payload until then, and is skipped entirely for filtered records.
+    - RateLimitFilter allows a burst of records per call site per interval and
+      reports how many were suppressed once the interval is over, so an error
+      inside a loop cannot flood the log.
+    - The log file rotates by size and rotated files are gzip-compressed.
+    - If the queue is full, records are dropped and counted rather than blocking.
+
+Usage:
+    from async_logging import setup_logging, LazyJson
+    setup_logging("/home/pi/traffic_junction/ingest_service.log")
+    logging.info("Received configuration: %s", LazyJson(config))
+
+Arguments passed to a log call are formatted later, so they must not be
+modified after the call.
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_QUEUE_SIZE = 10000  # Records buffered before new ones are dropped
+LOG_MAX_BYTES = 1024 * 1024  # Rotate the log file at this size
+LOG_BACKUP_COUNT = 5  # Compressed rotated files kept
+RATE_LIMIT_INTERVAL = 10  # seconds
+RATE_LIMIT_BURST = 10  # Records allowed per call site per interval
+
+_listener = None
+_queue_handler = None
+
+
+class LazyJson:
+    """Class to defer serializing a payload until the log record is written"""
+
+    def __init__(self, data, **kwargs):
+        self.data = data
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return json.dumps(self.data, **self.kwargs)
+
+
+class RateLimitFilter(logging.Filter):
+    """Class to limit how many records each call site can log per interval"""
+
+    def __init__(self, interval=RATE_LIMIT_INTERVAL, burst=RATE_LIMIT_BURST):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._lock = threading.Lock()
+        # (pathname, lineno) -> [window start, records allowed, records suppressed]
+        self._windows = {}
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or record.created - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [record.created, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} [{suppressed} similar messages suppressed]"
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Class to enqueue records without formatting them or waiting for space"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener runs in this process, so the record is passed as-is and
+        # formatted there instead of on the calling thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def rotating_file_handler(log_file, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """Create a size-rotated file handler whose old files are gzip-compressed"""
+    handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    return handler
+
+
+def setup_logging(log_file=None, level=logging.INFO, format=LOG_FORMAT, console=False, stream=None,
+                  rate_limit=True):
+    """
+    Route the root logger through a queue to a background writer.
+
+    Replaces any handlers configured earlier (including by an imported script).
+    Returns the queue handler, whose dropped attribute counts lost records.
+    """
+    global _listener, _queue_handler
+
+    handlers = []
+    if log_file:
+        handlers.append(rotating_file_handler(log_file))
+    if console:
+        handlers.append(logging.StreamHandler(stream))
+    formatter = logging.Formatter(format)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    stop_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    if rate_limit:
+        _queue_handler.addFilter(RateLimitFilter())
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _queue_handler
+
+
+def stop_logging():
+    """Write out queued records and close the log files"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+def dropped_records():
+    """Number of records dropped because the queue was full"""
+    return _queue_handler.dropped if _queue_handler else 0
+
+
+atexit.register(stop_logging)
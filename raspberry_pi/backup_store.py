@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Configuration Backup Store for Traffic Junction Control System
+
+Content-addressed store for configuration snapshots. Every snapshot is keyed by
+the SHA-256 of its canonical JSON form and written once as a zlib-compressed blob,
+so repeated or reverted configurations cost nothing on the SD card. A compact
+append-only index records when each snapshot became active, which allows a fast
+"configuration as of time T" lookup.
+
+Layout:
+    <backup_dir>/index.log          one "<unix_time> <sha256> <size>" line per change
+    <backup_dir>/objects/<sha256>.z zlib-compressed canonical JSON
+
+Usage:
+    python3 backup_store.py <backup_dir> list
+    python3 backup_store.py <backup_dir> show <unix_time>
+    python3 backup_store.py <backup_dir> compact [max_age_days] [max_snapshots]
+"""
+
+import bisect
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = "index.log"
+OBJECTS_DIR_NAME = "objects"
+COMPRESSION_LEVEL = 9
+
+
+def canonical_json(data):
+    """Serialize data to its canonical (sorted, compact) JSON bytes"""
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
+
+
+def content_hash(data):
+    """Return the content hash used to key a configuration snapshot"""
+    return hashlib.sha256(canonical_json(data)).hexdigest()
+
+
+def _fsync_directory(path):
+    """Make a file created or renamed in a directory survive a power cut"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BackupStore:
+    """Class to store configuration snapshots keyed by content hash"""
+
+    def __init__(self, backup_dir):
+        self.backup_dir = backup_dir
+        self.objects_dir = os.path.join(backup_dir, OBJECTS_DIR_NAME)
+        self.index_path = os.path.join(backup_dir, INDEX_FILE_NAME)
+        self._lock = threading.Lock()
+        # Parallel lists sorted by time: snapshot timestamps and their hashes
+        self._times = []
+        self._hashes = []
+        self._sizes = []
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """Read the append-only index into memory"""
+        if not os.path.exists(self.index_path):
+            return
+        self._truncate_torn_line()
+
+        with open(self.index_path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 3:
+                    continue
+                try:
+                    timestamp = float(parts[0])
+                    size = int(parts[2])
+                except ValueError:
+                    continue
+                self._append_entry(timestamp, parts[1], size)
+
+        logger.info(f"Loaded {len(self._times)} backup index entries from {self.index_path}")
+
+    def _truncate_torn_line(self):
+        """Drop a partial last line left by a power cut, so the next entry starts on a fresh line"""
+        with open(self.index_path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+                logger.warning(f"Discarded {len(data) - end} bytes of a partial backup index line")
+
+    def _append_entry(self, timestamp, digest, size):
+        """Insert an index entry, keeping the in-memory index sorted by time"""
+        if self._times and timestamp < self._times[-1]:
+            position = bisect.bisect_right(self._times, timestamp)
+            self._times.insert(position, timestamp)
+            self._hashes.insert(position, digest)
+            self._sizes.insert(position, size)
+        else:
+            self._times.append(timestamp)
+            self._hashes.append(digest)
+            self._sizes.append(size)
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, f"{digest}.z")
+
+    def save(self, config, timestamp=None):
+        """
+        Record a configuration snapshot.
+
+        Returns the snapshot hash, or None when the configuration is identical to
+        the latest snapshot and nothing was written.
+        """
+        payload = canonical_json(config)
+        digest = hashlib.sha256(payload).hexdigest()
+        timestamp = time.time() if timestamp is None else timestamp
+
+        with self._lock:
+            if self._hashes and self._hashes[-1] == digest:
+                return None
+
+            # The blob is on disk before the index line that refers to it
+            object_path = self._object_path(digest)
+            if not os.path.exists(object_path):
+                temp_path = f"{object_path}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(zlib.compress(payload, COMPRESSION_LEVEL))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, object_path)
+                _fsync_directory(self.objects_dir)
+
+            created = not os.path.exists(self.index_path)
+            with open(self.index_path, "a") as f:
+                f.write(f"{timestamp:.3f} {digest} {len(payload)}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if created:
+                _fsync_directory(self.backup_dir)
+
+            self._append_entry(timestamp, digest, len(payload))
+
+        logger.info(f"Stored configuration snapshot {digest[:12]}")
+        return digest
+
+    def load(self, digest):
+        """Load a snapshot by its hash"""
+        with open(self._object_path(digest), "rb") as f:
+            return json.loads(zlib.decompress(f.read()).decode())
+
+    def latest(self):
+        """Return the most recent snapshot, or None if the store is empty"""
+        with self._lock:
+            if not self._hashes:
+                return None
+            digest = self._hashes[-1]
+        return self.load(digest)
+
+    def config_at(self, timestamp):
+        """Return the configuration that was active at the given unix time"""
+        with self._lock:
+            position = bisect.bisect_right(self._times, timestamp)
+            if position == 0:
+                return None
+            digest = self._hashes[position - 1]
+        return self.load(digest)
+
+    def entries(self):
+        """Return the index as a list of (timestamp, hash, size) tuples"""
+        with self._lock:
+            return list(zip(self._times, self._hashes, self._sizes))
+
+    def apply_retention(self, max_age_days=None, max_snapshots=None, now=None):
+        """
+        Drop index entries older than max_age_days and beyond the newest
+        max_snapshots, then compact the store. The latest snapshot is always kept.
+        """
+        now = time.time() if now is None else now
+
+        with self._lock:
+            keep_from = 0
+            if max_age_days is not None:
+                cutoff = now - max_age_days * 86400
+                # Keep the entry that was active at the cutoff so config_at stays answerable
+                keep_from = max(bisect.bisect_right(self._times, cutoff) - 1, 0)
+            if max_snapshots is not None and max_snapshots > 0:
+                keep_from = max(keep_from, len(self._times) - max_snapshots)
+            keep_from = min(keep_from, max(len(self._times) - 1, 0))
+
+            removed = keep_from
+            self._times = self._times[keep_from:]
+            self._hashes = self._hashes[keep_from:]
+            self._sizes = self._sizes[keep_from:]
+
+        self.compact()
+        logger.info(f"Retention removed {removed} backup index entries")
+        return removed
+
+    def compact(self):
+        """Rewrite the index and delete blobs no longer referenced by it"""
+        with self._lock:
+            temp_path = f"{self.index_path}.tmp"
+            with open(temp_path, "w") as f:
+                for timestamp, digest, size in zip(self._times, self._hashes, self._sizes):
+                    f.write(f"{timestamp:.3f} {digest} {size}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.index_path)
+            _fsync_directory(self.backup_dir)
+
+            referenced = set(self._hashes)
+            deleted = 0
+            for name in os.listdir(self.objects_dir):
+                digest = name.split(".", 1)[0]
+                if digest not in referenced:
+                    os.remove(os.path.join(self.objects_dir, name))
+                    deleted += 1
+
+        if deleted:
+            logger.info(f"Compaction deleted {deleted} unreferenced backup objects")
+        return deleted
+
+
+def main():
+    """Command line access to a backup store"""
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+
+    store = BackupStore(sys.argv[1])
+    command = sys.argv[2]
+
+    if command == "list":
+        for timestamp, digest, size in store.entries():
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}  {digest[:12]}  {size} bytes")
+    elif command == "show":
+        target = float(sys.argv[3]) if len(sys.argv) > 3 else time.time()
+        print(json.dumps(store.config_at(target), indent=2))
+    elif command == "compact":
+        max_age_days = float(sys.argv[3]) if len(sys.argv) > 3 else None
+        max_snapshots = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        store.apply_retention(max_age_days, max_snapshots)
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Append-only State Journal for Traffic Junction Configuration
+
+Keeps the controller variables as a snapshot file plus an append-only journal
+of deltas, instead of rewriting the whole variables file for every update:
+
+    snapshot.json   {"seq": N, "state": {...}}, replaced atomically on compaction
+    journal.log     one JSON line per change after the snapshot:
+                    {"seq": N, "time": t, "kind": "config", "set": {...}, "unset": [...]}
+
+Writers append deltas to an in-memory buffer. A background thread group-commits
+the buffer with one write and one fsync per interval, and compacts the journal
+into a new snapshot once it grows past COMPACT_BYTES. commit() writes at once
+for changes that other processes are told about immediately.
+
+Readers (traffic_controller.py) call read_state(), which replays the journal
+over the snapshot and retries if a compaction happened while it was reading.
+
+Usage:
+    python3 config_journal.py show [journal_dir]
+    python3 config_journal.py stats [journal_dir]
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR = "/home/pi/traffic_junction/journal"
+SNAPSHOT_FILE = "snapshot.json"
+JOURNAL_FILE = "journal.log"
+COMMIT_INTERVAL = 1.0  # seconds between group commits
+COMPACT_BYTES = 256 * 1024  # Journal size that triggers a background compaction
+READ_RETRIES = 5
+
+_MISSING = object()
+
+
+def _paths(journal_dir):
+    return os.path.join(journal_dir, SNAPSHOT_FILE), os.path.join(journal_dir, JOURNAL_FILE)
+
+
+def _file_id(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+def _read_snapshot(snapshot_path):
+    try:
+        with open(snapshot_path, "rb") as f:
+            snapshot = json.loads(f.read().decode())
+        return snapshot["seq"], snapshot["state"]
+    except FileNotFoundError:
+        return 0, {}
+
+
+def _read_records(journal_path):
+    """Return the complete records in a journal file, ignoring a torn last line"""
+    try:
+        with open(journal_path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    records = []
+    for line in data.split(b"\n")[:-1]:
+        try:
+            records.append(json.loads(line.decode()))
+        except ValueError:
+            break
+    return records
+
+
+def _apply(state, record):
+    state.update(record.get("set", {}))
+    for key in record.get("unset", []):
+        state.pop(key, None)
+
+
+def read_state_with_seq(journal_dir):
+    """Return (seq, state) from the snapshot and journal in a directory"""
+    snapshot_path, journal_path = _paths(journal_dir)
+    for _ in range(READ_RETRIES):
+        snapshot_id = _file_id(snapshot_path)
+        seq, state = _read_snapshot(snapshot_path)
+        records = _read_records(journal_path)
+        if _file_id(snapshot_path) != snapshot_id:
+            continue  # Compacted while reading
+
+        expected = seq + 1
+        contiguous = True
+        for record in records:
+            if record["seq"] < expected:
+                continue  # Already in the snapshot
+            if record["seq"] != expected:
+                contiguous = False
+                break
+            _apply(state, record)
+            expected += 1
+        if contiguous:
+            return expected - 1, state
+    raise IOError(f"Journal in {journal_dir} kept changing while it was read")
+
+
+def read_state(journal_dir=JOURNAL_DIR):
+    """Return the current state recorded in a journal directory"""
+    return read_state_with_seq(journal_dir)[1]
+
+
+def journal_exists(journal_dir=JOURNAL_DIR):
+    return any(os.path.exists(path) for path in _paths(journal_dir))
+
+
+def journal_signature(journal_dir=JOURNAL_DIR):
+    """Value that changes whenever the snapshot or journal is written"""
+    return tuple(_file_id(path) for path in _paths(journal_dir))
+
+
+class ConfigJournal:
+    """Class to record state changes in a group-committed append-only journal"""
+
+    def __init__(self, journal_dir=JOURNAL_DIR, commit_interval=COMMIT_INTERVAL, compact_bytes=COMPACT_BYTES):
+        self.journal_dir = journal_dir
+        self.commit_interval = commit_interval
+        self.compact_bytes = compact_bytes
+        self.snapshot_path, self.journal_path = _paths(journal_dir)
+        os.makedirs(journal_dir, exist_ok=True)
+
+        self._truncate_torn_record()
+        self._seq, self._state = read_state_with_seq(journal_dir)
+        self._pending = []
+        # Held while writing files, so commits and compactions never interleave
+        self._io_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._journal = open(self.journal_path, "ab")
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.started_at = time.time()
+        self.records = 0
+        self.bytes_written = 0
+        self.fsyncs = 0
+        self.compactions = 0
+
+    def _truncate_torn_record(self):
+        """Drop a partial last line left by a crash, so new records start on a fresh line"""
+        try:
+            with open(self.journal_path, "rb+") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                if end != len(data):
+                    f.truncate(end)
+                    logger.warning(f"Discarded {len(data) - end} bytes of a partial journal record")
+        except FileNotFoundError:
+            pass
+
+    @property
+    def seq(self):
+        with self._lock:
+            return self._seq
+
+    def state(self):
+        """Return a copy of the current state, including uncommitted changes"""
+        with self._lock:
+            return dict(self._state)
+
+    def replace(self, state, kind="config"):
+        """Record a complete new state; returns the sequence number, or None if nothing changed"""
+        with self._lock:
+            changes = {key: value for key, value in state.items() if self._state.get(key, _MISSING) != value}
+            removed = [key for key in self._state if key not in state]
+            return self._append(kind, changes, removed)
+
+    def update(self, changes, kind="command"):
+        """Record changes to some keys; returns the sequence number, or None if nothing changed"""
+        with self._lock:
+            changes = {key: value for key, value in changes.items() if self._state.get(key, _MISSING) != value}
+            return self._append(kind, changes, [])
+
+    def _append(self, kind, changes, removed):
+        """Buffer one record; the caller holds the lock"""
+        if not changes and not removed:
+            return None
+        self._seq += 1
+        record = {"seq": self._seq, "time": time.time(), "kind": kind, "set": changes}
+        if removed:
+            record["unset"] = removed
+        self._pending.append(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+        _apply(self._state, record)
+        self.records += 1
+        return self._seq
+
+    def commit(self):
+        """Write and fsync every buffered record now"""
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            data = b"".join(pending)
+            self._journal.write(data)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self.bytes_written += len(data)
+            self.fsyncs += 1
+
+    def compact(self):
+        """Fold the journal into a new snapshot and start an empty journal"""
+        with self._io_lock:
+            with self._lock:
+                # Buffered records are covered by the snapshot and never written
+                self._pending = []
+                seq = self._seq
+                body = json.dumps({"seq": seq, "state": self._state}, separators=(",", ":")).encode()
+
+            temp_path = f"{self.snapshot_path}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.snapshot_path)
+
+            temp_path = f"{self.journal_path}.tmp"
+            open(temp_path, "wb").close()
+            os.replace(temp_path, self.journal_path)
+            self._journal.close()
+            self._journal = open(self.journal_path, "ab")
+
+            self._fsync_directory()
+            self.bytes_written += len(body)
+            self.fsyncs += 2
+            self.compactions += 1
+        logger.info(f"Compacted journal into snapshot at sequence {seq}")
+
+    def _fsync_directory(self):
+        try:
+            fd = os.open(self.journal_dir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def start(self):
+        """Start group commits and compaction in the background"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.commit_interval):
+            try:
+                self.commit()
+                if os.path.getsize(self.journal_path) > self.compact_bytes:
+                    self.compact()
+            except Exception as e:
+                logger.error(f"Error writing journal: {e}")
+
+    def close(self):
+        """Stop the background thread and commit what is buffered"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.commit()
+        self._journal.close()
+
+    def stats(self):
+        elapsed = max(time.time() - self.started_at, 1.0)
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "seq": self.seq,
+            "records": self.records,
+            "pending": pending,
+            "bytesWritten": self.bytes_written,
+            "bytesPerDay": int(self.bytes_written * 86400 / elapsed),
+            "fsyncs": self.fsyncs,
+            "compactions": self.compactions,
+        }
+
+
+def main():
+    """Inspect a journal directory from the command line"""
+    if len(sys.argv) < 2 or sys.argv[1] not in ("show", "stats"):
+        print(__doc__)
+        return
+    journal_dir = sys.argv[2] if len(sys.argv) > 2 else JOURNAL_DIR
+    seq, state = read_state_with_seq(journal_dir)
+    if sys.argv[1] == "show":
+        print(json.dumps(state, indent=2, sort_keys=True))
+    else:
+        snapshot_path, journal_path = _paths(journal_dir)
+        print(f"Sequence:        {seq}")
+        print(f"Keys:            {len(state)}")
+        print(f"Snapshot bytes:  {os.path.getsize(snapshot_path) if os.path.exists(snapshot_path) else 0}")
+        print(f"Journal bytes:   {os.path.getsize(journal_path) if os.path.exists(journal_path) else 0}")
+        print(f"Journal records: {len(_read_records(journal_path))}")
+
+
+if __name__ == "__main__":
+    main()
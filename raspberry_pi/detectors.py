@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Vehicle and Pedestrian Detector Inputs for Semi-actuated Control
+
+Detectors (loops, radar heads or push buttons with a switching output) are read
+through edge interrupts rather than polled: every edge calls back into
+DetectorInputs, which notes when a pole's vehicle detector last fired and
+latches a call (demand) on the pole until a green serves it. The controller's
+semi mode (TrafficController._handle_semi_control) reads them on every tick to
+skip routes nobody is waiting for, hold a green while vehicles keep coming
+(min/max green, gap-out) and end it as soon as they stop.
+
+Backends:
+    GPIOBackend  RPi.GPIO inputs with a pull-up and add_event_detect() on the
+                 falling edge (a detector pulls its input low), debounced
+    MockBackend  no hardware; inject() fires the same callbacks, for
+                 development and tests. A running controller started with
+                 --mock-detectors also takes events on its notify port:
+                 {"event": "detector", "pole": "2A", "kind": "vehicle"}
+
+Usage:
+    detectors = DetectorInputs({"1A": {"vehicle": 5, "pedestrian": 6}}, GPIOBackend(GPIO))
+    detectors.start()
+    python3 detectors.py --bench [vehicles per hour per approach]
+"""
+
+import bisect
+import logging
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+KINDS = ["vehicle", "pedestrian"]
+POLES = ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]
+BOUNCE_MS = 50  # Edges closer together than this are contact bounce
+MOCK_FIRST_PIN = 100  # Virtual pins used by mock_mapping()
+
+
+class GPIOBackend:
+    """Class to watch detector inputs with RPi.GPIO edge interrupts"""
+
+    def __init__(self, gpio, bounce_ms=BOUNCE_MS):
+        self.gpio = gpio
+        self.bounce_ms = bounce_ms
+        self.pins = []
+
+    def watch(self, pin, callback):
+        self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        # RPi.GPIO runs the callback on its own thread with the pin number
+        self.gpio.add_event_detect(pin, self.gpio.FALLING, callback=callback, bouncetime=self.bounce_ms)
+        self.pins.append(pin)
+
+    def close(self):
+        for pin in self.pins:
+            self.gpio.remove_event_detect(pin)
+        self.pins = []
+
+
+class MockBackend:
+    """Class to stand in for detector hardware; inject() fires the edge callbacks"""
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def watch(self, pin, callback):
+        self.callbacks[pin] = callback
+
+    def inject(self, pin):
+        self.callbacks[pin](pin)
+
+    def close(self):
+        self.callbacks = {}
+
+
+def mock_mapping():
+    """Virtual pins for a vehicle and a pedestrian detector on every pole"""
+    return {pole: {kind: MOCK_FIRST_PIN + index * len(KINDS) + offset for offset, kind in enumerate(KINDS)}
+            for index, pole in enumerate(POLES)}
+
+
+class DetectorInputs:
+    """Class to latch detector calls per pole from edge callbacks"""
+
+    def __init__(self, mapping, backend, clock=time.monotonic):
+        """mapping: {pole: {"vehicle": pin, "pedestrian": pin}}; either kind may be left out"""
+        self.mapping = mapping
+        self.backend = backend
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.last_seen = {}  # pole -> clock() of the last vehicle edge
+        self.calls = {}  # pole -> kinds waiting for a green
+        self.counts = {pole: {kind: 0 for kind in inputs} for pole, inputs in mapping.items()}
+
+    def start(self):
+        for pole, inputs in self.mapping.items():
+            for kind, pin in inputs.items():
+                self.backend.watch(pin, lambda pin, pole=pole, kind=kind: self.actuate(pole, kind))
+        logger.info(f"Watching {sum(len(inputs) for inputs in self.mapping.values())} detector inputs")
+
+    def actuate(self, pole, kind="vehicle"):
+        """Record a detection; called from the backend's callback thread"""
+        if pole not in self.mapping or kind not in KINDS:
+            raise ValueError(f"No {kind} detector on pole {pole}")
+        with self._lock:
+            if kind == "vehicle":
+                self.last_seen[pole] = self.clock()
+            self.calls.setdefault(pole, set()).add(kind)
+            self.counts[pole][kind] = self.counts[pole].get(kind, 0) + 1
+
+    def has_call(self, poles, kind=None):
+        """Whether any of the poles has a call waiting (of one kind, or of any)"""
+        with self._lock:
+            return any(self.calls.get(pole) and (kind is None or kind in self.calls[pole]) for pole in poles)
+
+    def last_actuation(self, poles):
+        """clock() of the latest vehicle edge on any of the poles, or None"""
+        with self._lock:
+            times = [self.last_seen[pole] for pole in poles if pole in self.last_seen]
+        return max(times) if times else None
+
+    def serve(self, poles):
+        """Clear the calls of poles that have had their green"""
+        with self._lock:
+            for pole in poles:
+                self.calls.pop(pole, None)
+
+    def close(self):
+        self.backend.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "counts": {pole: dict(counts) for pole, counts in self.counts.items()},
+                "calls": sorted(pole for pole, kinds in self.calls.items() if kinds),
+            }
+
+
+class _BenchRun:
+    """Class to hold the variables and collect the frames of one virtual controller run"""
+
+    def __init__(self, variables):
+        self.variables = variables
+        self.frames = []
+
+    def add_frame(self, frame):
+        self.frames.append(frame)
+
+
+def _run_controller(variables, start, seconds, arrivals=None):
+    """Run the controller under a virtual clock; with arrivals, detectors fire for each vehicle"""
+    from trace_replay import ReplayController, ReplayGPIO, VirtualClock, virtual_controller_module
+
+    run = _BenchRun(variables)
+    clock = VirtualClock(start)
+    with virtual_controller_module(clock, 0, ReplayGPIO()):
+        controller = ReplayController(run)
+        controller.load_variables()
+        if arrivals is not None:
+            backend = MockBackend()
+            mapping = mock_mapping()
+            controller.detectors = DetectorInputs(mapping, backend, clock=clock.monotonic)
+            controller.detectors.start()
+            clock.schedule([(when, lambda pin=mapping[pole]["vehicle"]: backend.inject(pin))
+                            for when, pole in arrivals])
+        clock.end = start + seconds
+
+        def stop():
+            controller.running = False
+
+        clock.on_end = stop
+        controller.running = True
+        controller.control_thread = threading.current_thread()
+        controller._control_loop()
+    return run.frames
+
+
+def _delays(frames, arrivals):
+    """Seconds each vehicle waits for its pole's green to come on (0 if it arrives on green)"""
+    times = [frame["time"] for frame in frames]
+    green = {pole: [any(frame["lights"].get(pole, {}).get(light) for light in ("greenLeft", "greenStraight", "greenRight"))
+                    for frame in frames] for pole in POLES}
+    delays = []
+    for when, pole in arrivals:
+        index = bisect.bisect_right(times, when) - 1
+        if index >= 0 and green[pole][index]:
+            delays.append(0)
+            continue
+        comes_on = next((times[later] for later in range(index + 1, len(times)) if green[pole][later]), None)
+        if comes_on is not None:
+            delays.append(comes_on - when)
+    return delays
+
+
+def benchmark(rate=120, hours=1):
+    """Compare vehicle waits under the fixed-time sequence and semi-actuated control at low volume"""
+    from timing_optimizer import route_row
+    from traffic_json_receiver import process_json_data
+    from wire_format import sample_config
+
+    config = sample_config()
+    config["use_time_zone"] = False
+    config["route_matrix"] = []
+    for arm in ["1", "2", "3", "4"]:
+        poles = [arm + "A", arm + "B"]
+        config["route_matrix"] += [route_row(green_poles=poles), route_row(yellow_poles=poles)]
+    config["route_sequence_1"] = [1] * 6 + [2] + [3] * 6 + [4] + [5] * 6 + [6] + [7] * 6 + [8]
+    config["pole_1A_red_time_time_zone_1"] = 5
+    fixed = process_json_data(config)
+    actuated = dict(fixed, autocontrol_mode=False, semicontrol_mode=True)
+
+    start = 1_700_000_000.0
+    seconds = hours * 3600
+    rng = random.Random(11)
+    arrivals = []
+    for pole in ["1A", "2A", "3A", "4A"]:
+        when = start
+        while True:
+            when += rng.expovariate(rate / 3600)
+            if when >= start + seconds - 300:
+                break
+            arrivals.append((when, pole))
+    arrivals.sort()
+
+    print(f"{len(arrivals)} vehicles over {hours} h, {rate} vehicles/h on each of four approaches")
+    for name, variables, detected in [("fixed time", fixed, None), ("semi-actuated", actuated, arrivals)]:
+        started = time.perf_counter()
+        frames = _run_controller(variables, start, seconds, detected)
+        elapsed = time.perf_counter() - started
+        delays = sorted(_delays(frames, arrivals))
+        greens = sum(1 for index, frame in enumerate(frames) if frame["mode"] == "route" and
+                     (index == 0 or frames[index - 1].get("route") != frame.get("route")))
+        print(f"{name:<14} mean wait {sum(delays) / len(delays):5.1f} s, "
+              f"95th percentile {delays[int(len(delays) * 0.95)]:5.1f} s, "
+              f"{greens} route changes ({elapsed:.2f} s to run)")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 120)
+        return
+    print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
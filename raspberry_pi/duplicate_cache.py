@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Duplicate Delivery Cache for Traffic Junction Webhook Receivers
+
+The web interface retries failed pushes and tries both the Ethernet and the
+network address, so the same payload often arrives more than once. This module
+keeps a small LRU cache of recent Idempotency-Key header values, each with a
+time-to-live, and the digest of the last payload stored, together with the
+response that was sent for them. Exact duplicates can then be acknowledged with
+the original response without parsing, writing or backing anything up again.
+
+A body is only a duplicate of the payload in force: after A, B, A the second A
+is applied again. Receivers call forget_body() when the state changes some
+other way (manual commands), so the next payload is applied even if it repeats
+the last one.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 300  # seconds
+
+
+def body_digest(body):
+    """Return the digest used to recognise an identical request body"""
+    return "sha256:" + hashlib.sha256(body).hexdigest()
+
+
+class DuplicateCache:
+    """Class to remember recently handled requests and their responses"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # "key:<Idempotency-Key>" -> (expires_at, response)
+        # (digest, response) of the last body stored
+        self._last_body = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, body, idempotency_key=None):
+        """
+        Return the cached (status_code, response_body) for a duplicate request,
+        or None if its idempotency key has not been seen within the TTL and its
+        body is not the last one stored.
+        """
+        now = time.monotonic()
+        with self._lock:
+            key = f"key:{idempotency_key}" if idempotency_key else None
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, response = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+            if self._last_body is not None and self._last_body[0] == body_digest(body):
+                self.hits += 1
+                return self._last_body[1]
+            self.misses += 1
+            return None
+
+    def store(self, body, idempotency_key, status_code, response_body):
+        """Remember the response sent for a request"""
+        response = (status_code, response_body)
+        with self._lock:
+            if idempotency_key:
+                key = f"key:{idempotency_key}"
+                self._entries[key] = (time.monotonic() + self.ttl, response)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            self._last_body = (body_digest(body), response)
+
+    def forget_body(self):
+        """Stop treating the last body as a duplicate, once the state has changed some other way"""
+        with self._lock:
+            self._last_body = None
+
+    def stats(self):
+        """Return hit/miss counters for health and status endpoints"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self._entries) + (self._last_body is not None),
+            }
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Green-wave Offsets for Coordinated Junctions Along an Arterial
+
+A TrafficController normally starts its cycle whenever it boots, so along a
+corridor the platoons from one junction reach the next at random points of
+its cycle. With coordination_enabled set, a controller instead anchors each
+cycle to CYCLE_EPOCH plus cycle_offset_time_zone_<zone>, and holds it. This
+module chooses those offsets.
+
+Each junction's cycle is compiled from its configuration for the corridor's
+time zone (queue_simulator.compile_plan, coordinated), and its arterial green
+is taken from the pole facing the traffic in each direction. A solution is
+scored both ways along the corridor by sending a vehicle off the first
+junction's green every second and following it through the others:
+
+    bandwidth  seconds of each cycle a vehicle can travel the whole corridor
+               without stopping (the green band), and its share of the cycle
+    stops      predicted stops per vehicle downstream of the first junction
+
+Offsets are searched by coordinate descent from random starting offsets, one
+start per process pool task; the distinct solutions are reported best first,
+together with offsets all 0 and the average of random offsets (uncoordinated).
+Junctions with different cycles are scored over their common period.
+
+Corridor file (junctions in outbound order; distance or travelTime is the link
+to the next junction, inboundTravelTime defaults to travelTime):
+
+    {
+      "zone": 2, "speedKmh": 50, "inboundWeight": 1.0,
+      "junctions": [
+        {"name": "Main & 1st", "config": "main-1st.json", "outboundPole": "1A", "inboundPole": "3A",
+         "distance": 420},
+        {"name": "Main & 2nd", "config": "main-2nd.json", "outboundPole": "1A", "inboundPole": "3A"}
+      ]
+    }
+
+Usage:
+    solutions = Corridor.from_file("corridor.json").optimize()
+    python3 green_wave.py <corridor.json> [--json]
+    python3 green_wave.py --bench
+"""
+
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from queue_simulator import APPROACHES, compile_plan
+from traffic_json_receiver import process_json_data
+
+DEFAULT_SPEED_KMH = 50
+SEARCH_STARTS = 16  # Random starting points of the offset search
+SEARCH_WORKERS = 4  # One per Pi 4 core
+MAX_SWEEPS = 20  # Coordinate descent passes per start
+MAX_PERIOD = 3600  # Longest scoring period when the cycles differ (seconds)
+UNCOORDINATED_SAMPLES = 100  # Random offset sets averaged for the uncoordinated figure
+
+
+class Corridor:
+    """Class to score and search cycle offsets for the junctions of one arterial"""
+
+    def __init__(self, junctions, zone=1, speed_kmh=DEFAULT_SPEED_KMH, inbound_weight=1.0):
+        """
+        junctions: outbound order, each with name, variables (or config),
+        outboundPole, inboundPole and distance or travelTime to the next one.
+        """
+        if len(junctions) < 2:
+            raise ValueError("A corridor needs at least two junctions")
+        self.zone = zone
+        self.inbound_weight = inbound_weight
+        self.names = []
+        self.cycles = []
+        self.outbound_green = []
+        self.inbound_green = []
+        self.outbound_links = []
+        self.inbound_links = []
+
+        for index, junction in enumerate(junctions):
+            name = junction.get("name", f"junction {index + 1}")
+            variables = junction.get("variables")
+            if variables is None:
+                variables = process_json_data(junction["config"])
+                if variables is None:
+                    raise ValueError(f"{name}: configuration could not be converted to variables")
+            plan = compile_plan(variables, zone, coordinated=True)
+            cycle = int(round(plan["cycle"]))
+            if cycle <= 0:
+                raise ValueError(f"{name}: time zone {zone} has no route to run")
+
+            self.names.append(name)
+            self.cycles.append(cycle)
+            self.outbound_green.append(self._green_mask(plan, junction["outboundPole"], cycle, name))
+            self.inbound_green.append(self._green_mask(plan, junction["inboundPole"], cycle, name))
+            if index < len(junctions) - 1:
+                travel = junction.get("travelTime")
+                if travel is None:
+                    if "distance" not in junction:
+                        raise ValueError(f"{name}: distance or travelTime to the next junction is missing")
+                    travel = junction["distance"] / (speed_kmh / 3.6)
+                self.outbound_links.append(int(round(travel)))
+                self.inbound_links.append(int(round(junction.get("inboundTravelTime", travel))))
+
+        self.period = min(math.lcm(*self.cycles), MAX_PERIOD)
+        self.outbound_wait = [self._waits(mask) for mask in self.outbound_green]
+        self.inbound_wait = [self._waits(mask) for mask in self.inbound_green]
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a corridor file; junction configurations are read relative to it"""
+        with open(path) as f:
+            spec = json.load(f)
+        junctions = []
+        for junction in spec["junctions"]:
+            junction = dict(junction)
+            if isinstance(junction.get("config"), str):
+                with open(os.path.join(os.path.dirname(os.path.abspath(path)), junction["config"])) as f:
+                    junction["config"] = json.load(f)
+            junctions.append(junction)
+        return cls(junctions, spec.get("zone", 1), spec.get("speedKmh", DEFAULT_SPEED_KMH),
+                   spec.get("inboundWeight", 1.0))
+
+    @staticmethod
+    def _green_mask(plan, pole, cycle, name):
+        """Whether the pole shows green in each second of the cycle"""
+        if pole not in APPROACHES:
+            raise ValueError(f"{name}: unknown pole {pole}")
+        index = APPROACHES.index(pole)
+        mask = []
+        for seconds, greens in plan["phases"]:
+            mask += [greens[index]] * int(round(seconds))
+        mask = (mask + [False] * cycle)[:cycle]
+        if not any(mask):
+            raise ValueError(f"{name}: pole {pole} never shows green")
+        return mask
+
+    @staticmethod
+    def _waits(mask):
+        """Seconds from each second of the cycle until the next green"""
+        waits = [0] * len(mask)
+        wait = len(mask)
+        for position in range(2 * len(mask) - 1, -1, -1):
+            wait = 0 if mask[position % len(mask)] else wait + 1
+            waits[position % len(mask)] = wait
+        return waits
+
+    def _direction(self, offsets, order, links, waits):
+        """(bandwidth in seconds per cycle, stops per vehicle) in one direction"""
+        first = order[0]
+        through = 0
+        stops = 0
+        vehicles = 0
+        for departure in range(self.period):
+            if waits[first][(departure - offsets[first]) % self.cycles[first]]:
+                continue
+            vehicles += 1
+            arrival = departure
+            stopped = 0
+            for link, junction in zip(links, order[1:]):
+                arrival += link
+                wait = waits[junction][(arrival - offsets[junction]) % self.cycles[junction]]
+                if wait:
+                    stopped += 1
+                    arrival += wait
+            stops += stopped
+            through += not stopped
+        return through * self.cycles[first] / self.period, stops / max(vehicles, 1)
+
+    def evaluate(self, offsets):
+        """Score a set of offsets (seconds from the epoch, one per junction)"""
+        junctions = list(range(len(self.names)))
+        outbound = self._direction(offsets, junctions, self.outbound_links, self.outbound_wait)
+        inbound = self._direction(offsets, junctions[::-1], self.inbound_links[::-1], self.inbound_wait)
+        return {
+            "offsets": dict(zip(self.names, offsets)),
+            "outboundBandwidth": round(outbound[0], 1),
+            "outboundShare": round(outbound[0] / self.cycles[0], 3),
+            "outboundStops": round(outbound[1], 3),
+            "inboundBandwidth": round(inbound[0], 1),
+            "inboundShare": round(inbound[0] / self.cycles[-1], 3),
+            "inboundStops": round(inbound[1], 3),
+        }
+
+    def _objective(self, offsets):
+        score = self.evaluate(offsets)
+        weight = self.inbound_weight
+        return (score["outboundBandwidth"] + weight * score["inboundBandwidth"],
+                -(score["outboundStops"] + weight * score["inboundStops"]))
+
+    def search(self, seed):
+        """Coordinate descent from random offsets; the first junction stays at 0"""
+        rng = random.Random(seed)
+        offsets = [0] + [rng.randrange(cycle) for cycle in self.cycles[1:]]
+        best = self._objective(offsets)
+        for _ in range(MAX_SWEEPS):
+            improved = False
+            for junction in range(1, len(offsets)):
+                for offset in range(self.cycles[junction]):
+                    candidate = offsets[:junction] + [offset] + offsets[junction + 1:]
+                    value = self._objective(candidate)
+                    if value > best:
+                        best, offsets, improved = value, candidate, True
+            if not improved:
+                break
+        return offsets
+
+    def uncoordinated(self, samples=UNCOORDINATED_SAMPLES, seed=0):
+        """Average score of random offsets: junctions cycling from whenever they booted"""
+        rng = random.Random(seed)
+        scores = [self.evaluate([rng.randrange(cycle) for cycle in self.cycles]) for _ in range(samples)]
+        keys = [key for key in scores[0] if key != "offsets"]
+        return {key: round(sum(score[key] for score in scores) / samples, 3) for key in keys}
+
+    def optimize(self, starts=SEARCH_STARTS, workers=SEARCH_WORKERS):
+        """Search in a process pool; returns the distinct solutions, best first"""
+        seeds = list(range(starts))
+        if workers and workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                found = list(pool.map(self.search, seeds))
+        else:
+            found = [self.search(seed) for seed in seeds]
+
+        solutions = []
+        for offsets in found:
+            if offsets not in solutions:
+                solutions.append(offsets)
+        solutions.sort(key=self._objective, reverse=True)
+        return [self.evaluate(offsets) for offsets in solutions]
+
+    def assignments(self, solution):
+        """Configuration keys that put each junction on a solution"""
+        return {name: {"coordination_enabled": True, f"cycle_offset_time_zone_{self.zone}": offset}
+                for name, offset in solution["offsets"].items()}
+
+
+def print_solutions(corridor, solutions, count=5):
+    print(f"Time zone {corridor.zone}, cycles {corridor.cycles} s, "
+          f"links {corridor.outbound_links} s out / {corridor.inbound_links} s in")
+    print(f"{'':<16}{'out band':>10}{'stops':>8}{'in band':>10}{'stops':>8}  offsets")
+    rows = [("uncoordinated", corridor.uncoordinated(), None),
+            ("offsets 0", corridor.evaluate([0] * len(corridor.cycles)), None)]
+    rows += [(f"solution {rank}", solution, solution["offsets"])
+             for rank, solution in enumerate(solutions[:count], 1)]
+    for label, score, offsets in rows:
+        print(f"{label:<16}{score['outboundBandwidth']:>7.1f} s{score['outboundStops']:>8.2f}"
+              f"{score['inboundBandwidth']:>7.1f} s{score['inboundStops']:>8.2f}  "
+              f"{' '.join(str(offset) for offset in offsets.values()) if offsets else ''}")
+
+
+def sample_corridor(junctions=5):
+    """An arterial of four-phase junctions (arterial both ways, then the side road) 300-600 m apart"""
+    from timing_optimizer import route_row
+    from wire_format import sample_config
+
+    rng = random.Random(5)
+    corridor = []
+    for index in range(junctions):
+        config = sample_config()
+        config["route_matrix"] = [
+            route_row(green_poles=["1A", "1B", "3A", "3B"]),
+            route_row(yellow_poles=["1A", "1B", "3A", "3B"]),
+            route_row(green_poles=["2A", "2B", "4A", "4B"]),
+            route_row(yellow_poles=["2A", "2B", "4A", "4B"]),
+        ]
+        arterial = rng.choice([7, 8, 9])
+        config["route_sequence_2"] = [1] * arterial + [2] + [3] * (11 - arterial) + [4]
+        config["pole_1A_red_time_time_zone_2"] = 5
+        corridor.append({"name": f"junction {index + 1}", "variables": process_json_data(config),
+                         "outboundPole": "1A", "inboundPole": "3A", "distance": rng.randint(300, 600)})
+    return corridor
+
+
+def benchmark():
+    """Search offsets for a five junction sample corridor"""
+    corridor = Corridor(sample_corridor(), zone=2)
+    start = time.perf_counter()
+    solutions = corridor.optimize()
+    elapsed = time.perf_counter() - start
+    print_solutions(corridor, solutions)
+    print(f"{SEARCH_STARTS} starts in {elapsed:.2f} s ({SEARCH_WORKERS} processes)")
+
+
+def main():
+    import logging
+    from async_logging import setup_logging
+
+    setup_logging(level=logging.WARNING, console=True)
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark()
+        return
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+    corridor = Corridor.from_file(sys.argv[1])
+    solutions = corridor.optimize()
+    if "--json" in sys.argv[2:]:
+        print(json.dumps({"solutions": solutions, "assignments": corridor.assignments(solutions[0])}, indent=2))
+    else:
+        print_solutions(corridor, solutions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1172 @@
+#!/usr/bin/env python3
+"""
+Traffic Junction Ingest Service
+
+Single webhook service for the Raspberry Pi, replacing the three overlapping
+receivers (json_webhook_receiver.py, traffic_json_monitor.py and
+traffic_json_receiver.py) that each parsed, saved and backed up every payload on
+their own. Each payload is verified and parsed once and then fanned out to a list
+of sinks:
+
+    - BackupSink:          content-addressed backup store (skips unchanged configs)
+    - JournalSink:         append-only journal of variable changes read by the controller
+    - VariablesFileSink:   the traffic variables .py file, for controllers without the journal
+    - ControllerNotifySink: UDP reload announcement to traffic_controller.py
+    - StateMonitorSink:    the ConfigState shown on /status and streamed on /events
+    - TraceSink:           bounded binary trace of payloads, reloads and manual
+                           changes, together with the controller's lamp frames,
+                           for replay with trace_replay.py
+
+Manual control commands ({"target": "P1A", "action": "red_on"}) are accepted on
+POST /command and over a persistent WebSocket on /ws. They are sent straight to
+the controller, which applies them immediately and reports when the lamps
+changed, and are then persisted through the same sinks. POST /commands/batch
+(or a WebSocket message with a "commands" list) applies an ordered list of
+commands as one transaction: all are validated, the lamps change in a single
+frame and the result is persisted once.
+
+POST /preempt ({"kind": "emergency", "route": 3, "hold": 20}) asks the
+controller to clear the junction and hold a route for an emergency vehicle, a
+manual override or transit (see preemption.py); it answers once the clearance
+has started, or with 202 while the request is queued behind a higher-priority
+one. POST /preempt/release ({"id": ...}) ends the hold early.
+
+Every request passes admission control first (see admission.py): token
+buckets per client address and per endpoint answer a flood with 429 before
+its body is read, and a bounded pool of work slots keeps bulk uploads from
+using more of the Pi's single core than the controller can spare. Preemptions
+and all-red or flash commands travel in a safety lane with a reserved slot.
+
+POST /timeline?zone=N compiles the lamp timeline a proposed configuration would
+produce, without applying it (see timeline.py), for the sequence editor.
+
+Configuration pushes, commands and preemptions are traced by their
+X-Correlation-Id from arrival to the lamp frame the controller publishes
+(see latency_trace.py); GET /traces?limit=N lists recent traces with
+per-stage latency percentiles.
+
+When MQTT_ENABLED is set, the same service also subscribes to the command and
+configuration topics on the MQTT broker (see mqtt_bridge.py), so updates sent
+while the Pi is offline are delivered once it reconnects.
+
+Usage:
+    python3 ingest_service.py
+    python3 ingest_service.py --bench [count]
+    python3 ingest_service.py --bench-commands [count]
+    python3 ingest_service.py --bench-journal
+    python3 ingest_service.py --bench-flood [seconds]
+
+Configuration:
+    - Set the SERVER_PORT to the port the web interface pushes to
+    - Set the VARIABLES_FILE_PATH to the variables file read by traffic_controller.py
+    - Set the SECRET_KEY to the key used for the X-Signature header
+"""
+
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+
+from activity_trace import TraceRecorder
+from admission import AdmissionControl, reject
+from async_logging import dropped_records, setup_logging
+from backup_store import BackupStore, canonical_json
+from config_journal import ConfigJournal
+from duplicate_cache import DuplicateCache, IDEMPOTENCY_HEADER
+from latency_trace import CORRELATION_HEADER, TraceBuffer
+from manual_commands import CommandError, commands_to_variables, is_safety_command, parse_batch
+from preemption import send_event
+from profiling import Profiler, install_signal_handler, serve_profile_request
+from status_stream import StatusBroadcaster, serve_cached_status, serve_event_stream, start_frame_listener
+from traffic_json_receiver import process_json_data, save_variables_to_file
+from traffic_json_monitor import ConfigState
+from websocket_channel import accept, connect, is_websocket_request
+from wire_format import decode_body
+
+# Configuration
+SERVER_PORT = 8080
+VARIABLES_FILE_PATH = "/home/pi/traffic_junction/traffic_start_variables.py"
+WRITE_VARIABLES_FILE = False  # Also rewrite VARIABLES_FILE_PATH, for controllers that do not read the journal
+JOURNAL_DIR = "/home/pi/traffic_junction/journal"
+BACKUP_DIR = "/home/pi/traffic_junction/backups"
+BACKUP_MAX_SNAPSHOTS = 500  # Retention applied to the backup store at startup
+CONTROLLER_NOTIFY_ADDRESS = ("127.0.0.1", 8091)  # Matches NOTIFY_PORT in traffic_controller.py
+MANUAL_ACK_TIMEOUT = 0.5  # seconds to wait for the controller to confirm a manual command
+PREEMPT_ACK_TIMEOUT = 1.0  # seconds to wait for a preemption's clearance to start before answering 202
+SECRET_KEY = "your-secret-key-here"  # Change this to a secure key
+LOG_FILE = "/home/pi/traffic_junction/ingest_service.log"
+MQTT_ENABLED = False  # Also ingest from the MQTT broker configured in mqtt_bridge.py
+JUNCTION_ID = "junction-1"  # Identifies this Pi in MQTT client ids and responses
+TRACE_ENABLED = True  # Record activity for incident replay (see trace_replay.py)
+TRACE_FILE = "/home/pi/traffic_junction/traces/activity.trace"
+TRACE_MAX_BYTES = 4 * 1024 * 1024  # The trace moves to TRACE_FILE.1 past this size
+ADMISSION_ENABLED = True  # Rate limit clients and endpoints and bound the work in progress (see admission.py)
+ENDPOINT_LIMITS = {  # path -> (requests per second, burst), shared by all clients
+    "/webhook": (2, 10),
+    "/timeline": (1, 3),
+    "/profile": (1, 2),
+    "/command": (20, 40),
+    "/commands/batch": (10, 20),
+    "/ws": (20, 40),
+}
+MAX_COMMAND_BYTES = 64 * 1024  # Command bodies up to this size are read to sort them into lanes
+LISTEN_BACKLOG = 128  # Connections the kernel queues; a full backlog delays new clients by a SYN retry (1 s)
+LATENCY_TRACED = {  # path -> kind of request, for the per-stage latency traces on /traces (see latency_trace.py)
+    "/webhook": "config",
+    "/command": "command",
+    "/commands/batch": "command",
+    "/preempt": "preempt",
+}
+LATENCY_TRACES_SHOWN = 20  # Traces /traces lists unless ?limit= says
+
+# The imported receivers configure logging on import; this service owns the log
+setup_logging(LOG_FILE)
+logger = logging.getLogger(__name__)
+
+
+class IngestEvent:
+    """Class to hold one verified payload as it passes through the sinks"""
+
+    def __init__(self, body, config, variables=None, commands=None, correlation_id=None):
+        self.body = body
+        self.config = config
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.received_at = time.time()
+        # Manual control commands this event was built from, if any
+        self.commands = commands
+        # Carried to the controller so its lamp frame can be matched to the request
+        self.correlation_id = correlation_id
+        # Set by the backup sink when the payload matches the latest snapshot
+        self.unchanged = False
+        self._variables = variables
+
+    @property
+    def variables(self):
+        """Variables derived from the payload, converted once for all sinks"""
+        if self._variables is None:
+            self._variables = process_json_data(self.config)
+        return self._variables
+
+
+class Sink:
+    """Base class for ingest sinks"""
+
+    name = "sink"
+
+    def handle(self, event):
+        raise NotImplementedError
+
+
+class BackupSink(Sink):
+    """Sink that records the payload in the backup store"""
+
+    name = "backup"
+
+    def __init__(self, store):
+        self.store = store
+
+    def handle(self, event):
+        if event.commands:
+            return  # Manual changes are recorded by the journal
+        if self.store.save(event.config, event.received_at) is None:
+            event.unchanged = True
+
+
+class VariablesFileSink(Sink):
+    """Sink that writes the variables file read by the traffic controller"""
+
+    name = "variables_file"
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def handle(self, event):
+        if event.unchanged and os.path.exists(self.file_path):
+            return
+        if event.variables is None:
+            raise ValueError("Payload could not be converted to variables")
+        if not save_variables_to_file(event.variables, self.file_path):
+            raise IOError(f"Could not write {self.file_path}")
+
+
+class JournalSink(Sink):
+    """Sink that appends the changed variables to the state journal"""
+
+    name = "journal"
+
+    def __init__(self, journal):
+        self.journal = journal
+
+    def handle(self, event):
+        if event.unchanged and self.journal.seq:
+            return
+        if event.variables is None:
+            raise ValueError("Payload could not be converted to variables")
+        if event.commands:
+            # Normally recorded by apply_commands already; written by the next group commit
+            self.journal.replace(event.variables, kind="command")
+        elif self.journal.replace(event.variables, kind="config") is not None:
+            # The controller reloads as soon as it is notified, so this is written now
+            self.journal.commit()
+
+    def stats(self):
+        return self.journal.stats()
+
+
+class ControllerNotifySink(Sink):
+    """Sink that tells the traffic controller to reload its variables now"""
+
+    name = "controller_notify"
+
+    def __init__(self, address):
+        self.address = address
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def handle(self, event):
+        if event.unchanged or event.commands:
+            return  # Manual commands reach the controller over UDP; a reload could load the journal without them
+        message = json.dumps({"event": "reload", "digest": event.digest, "correlationId": event.correlation_id}).encode()
+        self.sock.sendto(message, self.address)
+
+    def apply_manual(self, changes, command_id, timeout=MANUAL_ACK_TIMEOUT, correlation_id=None, seq=None):
+        """
+        Send manual control changes for immediate application and wait for the
+        controller's acknowledgement, on a socket of its own so commands in
+        flight at once each get their own reply. seq is the changes' journal
+        sequence number, so the controller does not load older journal state
+        over them. Returns the time the lamps changed, or None if the
+        controller did not apply them within the timeout.
+        """
+        message = {"event": "manual", "id": command_id, "set": changes, "correlationId": correlation_id, "seq": seq}
+        reply = send_event(message, self.address, timeout)
+        return reply.get("appliedAt") if reply else None
+
+    def preempt(self, message, timeout=PREEMPT_ACK_TIMEOUT):
+        """
+        Send a preempt or release event and wait for the controller's reply, on
+        a socket of its own so manual commands are not held up meanwhile.
+        Returns the reply, or None if there was none within the timeout.
+        """
+        return send_event(message, self.address, timeout)
+
+
+class StateMonitorSink(Sink):
+    """Sink that keeps the monitored ConfigState up to date and streams it"""
+
+    name = "state_monitor"
+
+    def __init__(self, config_state, broadcaster=None):
+        self.config_state = config_state
+        self.broadcaster = broadcaster
+
+    def handle(self, event):
+        if event.commands:
+            self.config_state.update_from_json({"command": event.commands[-1].get("action")})
+        else:
+            self.config_state.update_from_json(event.config)
+        if self.broadcaster:
+            self.broadcaster.set_status(status_data(self.config_state, datetime.fromtimestamp(event.received_at)))
+
+
+class TraceSink(Sink):
+    """Sink that records payloads, reloads and manual changes in the activity trace"""
+
+    name = "trace"
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def handle(self, event):
+        if event.commands:
+            self.recorder.manual(commands_to_variables(event.commands))
+            return
+        self.recorder.config(event.config)
+        if not event.unchanged:
+            self.recorder.reload(event.digest)
+
+    def stats(self):
+        return self.recorder.stats()
+
+
+class IngestService:
+    """Class to verify payloads once and fan them out to the sinks"""
+
+    def __init__(self, sinks, secret_key=SECRET_KEY):
+        self.sinks = sinks
+        self.secret_key = secret_key
+        self.duplicate_cache = DuplicateCache()
+        self.last_update_time = None
+        self.last_digest = None
+        self.received = 0
+        self.commands_applied = 0
+        # Current variables, the base that manual commands are applied to
+        self.variables = None
+        self.controller = next((sink for sink in sinks if isinstance(sink, ControllerNotifySink)), None)
+        self.journal = next((sink.journal for sink in sinks if isinstance(sink, JournalSink)), None)
+        self._command_id = 0
+        # Per-sink call counts and cumulative time, for /health and benchmarking
+        self.sink_stats = {sink.name: {"calls": 0, "errors": 0, "seconds": 0.0} for sink in sinks}
+        # Per-stage timestamps of recent requests, served on /traces
+        self.traces = TraceBuffer()
+        self._lock = threading.Lock()
+
+    def verify_signature(self, body, signature):
+        """Check an X-Signature header against the body"""
+        computed_signature = hmac.new(self.secret_key.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, computed_signature)
+
+    def ingest(self, body, signature=None, idempotency_key=None, content_encoding=None, correlation_id=None):
+        """
+        Verify, parse and fan out one payload.
+
+        The body may use the compact wire format and a deflate or gzip
+        Content-Encoding; the signature covers the body as sent. A correlation
+        ID from TraceBuffer.begin() has the payload's stages traced.
+
+        Returns (status_code, response_dict).
+        """
+        if signature is not None and not self.verify_signature(body, signature):
+            logger.warning("Invalid signature received")
+            return 403, {"error": "Invalid signature"}
+
+        cached = self.duplicate_cache.lookup(body, idempotency_key)
+        if cached:
+            return cached
+
+        try:
+            config = decode_body(body, content_encoding)
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.error(f"Invalid JSON received: {e}")
+            return 400, {"error": "Invalid JSON"}
+
+        event = IngestEvent(body, config, correlation_id=correlation_id)
+        self.traces.mark(correlation_id, "parsed")
+
+        # Sinks run in order under one lock so files and state change together
+        with self._lock:
+            results = self._fan_out(event)
+            self.received += 1
+            if event.variables is not None:
+                self.variables = event.variables
+
+            failed = [name for name, result in results.items() if result != "ok"]
+            response = {
+                "status": "error" if failed else "success",
+                "digest": event.digest,
+                "unchanged": event.unchanged,
+                "sinks": results,
+            }
+            status_code = 500 if failed else 200
+            # Stored in the order payloads are applied, so only the payload in force counts as a duplicate
+            if failed:
+                self.duplicate_cache.forget_body()
+            else:
+                self.duplicate_cache.store(body, idempotency_key, status_code, response)
+        self.traces.mark(correlation_id, "persisted")
+
+        if not failed:
+            logger.info(f"Ingested configuration {event.digest[:12]}{' (unchanged)' if event.unchanged else ''}")
+
+        return status_code, response
+
+    def _fan_out(self, event):
+        """Pass an event to every sink; the caller holds the lock"""
+        results = {}
+        for sink in self.sinks:
+            start = time.perf_counter()
+            try:
+                sink.handle(event)
+                results[sink.name] = "ok"
+                if sink is self.controller:
+                    self.traces.mark(event.correlation_id, "notified")
+            except Exception as e:
+                logger.error(f"Error in {sink.name} sink: {e}")
+                results[sink.name] = f"error: {e}"
+                self.sink_stats[sink.name]["errors"] += 1
+            self.sink_stats[sink.name]["calls"] += 1
+            self.sink_stats[sink.name]["seconds"] += time.perf_counter() - start
+
+        self.last_update_time = datetime.now()
+        self.last_digest = event.digest
+        return results
+
+    def apply_commands(self, commands, correlation_id=None):
+        """
+        Apply manual control commands as one change.
+
+        The controller is told first so the lamps change without waiting for a
+        file write; the new variables are then persisted through the sinks.
+        The lock is not held while waiting for the controller's acknowledgement,
+        so other requests carry on meanwhile. Returns (status_code, response_dict).
+        """
+        received_at = time.time()
+        try:
+            changes = commands_to_variables(commands)
+        except CommandError as e:
+            logger.warning(f"Rejected manual command: {e}")
+            return 400, {"status": "error", "error": str(e)}
+        self.traces.mark(correlation_id, "parsed")
+
+        with self._lock:
+            variables = dict(self.variables if self.variables is not None else process_json_data({}))
+            variables.update(changes)
+            # Later commands build on this one even if they are persisted first
+            self.variables = variables
+            # Resending the last configuration now has to undo this change
+            self.duplicate_cache.forget_body()
+            self._command_id += 1
+            command_id = self._command_id
+            # Recorded before the controller hears of it, so it can tell journal state older than this change
+            journal_seq = self.journal.replace(variables, kind="command") if self.journal else None
+
+        applied_at = None
+        if self.controller:
+            try:
+                applied_at = self.controller.apply_manual(changes, command_id, correlation_id=correlation_id,
+                                                          seq=journal_seq)
+            except OSError as e:
+                logger.error(f"Error sending manual command to controller: {e}")
+        if applied_at is not None:
+            self.traces.mark(correlation_id, "lampsWritten", applied_at)
+
+        with self._lock:
+            # The latest variables are persisted, so a command finishing out of order cannot undo another
+            variables = self.variables
+            # The lamps have changed already, so no reload is announced for this event
+            event = IngestEvent(canonical_json(variables), variables, variables=variables, commands=commands)
+            results = self._fan_out(event)
+            self.commands_applied += len(commands)
+        self.traces.mark(correlation_id, "persisted")
+
+        failed = [name for name, result in results.items() if result != "ok"]
+        return (500 if failed else 200), {
+            "status": "error" if failed else "success",
+            "receivedAt": received_at,
+            "appliedAt": applied_at,
+            "persistedAt": time.time(),
+            "commandCount": len(commands),
+            "sinks": results,
+        }
+
+    def preempt(self, request, correlation_id=None):
+        """
+        Relay a preemption request to the controller. Returns (status_code,
+        response_dict): 200 once its clearance has started, 202 while it is
+        queued behind a higher-priority request (or the controller is silent).
+        """
+        if not isinstance(request, dict):
+            return 400, {"status": "error", "error": "Preemption must be a JSON object"}
+        if not self.controller:
+            return 503, {"status": "error", "error": "No controller to preempt"}
+        with self._lock:
+            self._command_id += 1
+            request_id = request.get("id") or f"preempt-{self._command_id}"
+        message = {"event": "preempt", "id": request_id, "kind": request.get("kind", "emergency"),
+                   "route": request.get("route")}
+        if "hold" in request:
+            message["hold"] = request["hold"]
+
+        received_at = time.time()
+        try:
+            reply = self.controller.preempt(message)
+        except OSError as e:
+            logger.error(f"Error sending preemption to controller: {e}")
+            return 500, {"status": "error", "id": request_id, "error": str(e)}
+        if reply is None:
+            return 202, {"status": "queued", "id": request_id, "receivedAt": received_at}
+        if "error" in reply:
+            return 400, {"status": "error", "id": request_id, "error": reply["error"]}
+        self.traces.mark(correlation_id, "clearanceStarted", reply.get("clearanceStartedAt"))
+        return 200, {
+            "status": "success",
+            "id": request_id,
+            "receivedAt": received_at,
+            "clearanceStartedAt": reply.get("clearanceStartedAt"),
+            "latencyMs": reply.get("latencyMs"),
+        }
+
+    def trace_frame(self, frame):
+        """Stamp the controller stages of the request a lamp frame carries the correlation ID of"""
+        correlation_id = frame.get("correlationId")
+        if correlation_id is None:
+            return
+        if "loadedAt" in frame:
+            self.traces.mark(correlation_id, "controllerLoaded", frame["loadedAt"])
+        self.traces.mark(correlation_id, "lampsWritten", frame.get("time"))
+
+    def release_preemption(self, request_id):
+        """End a preemption's hold, or drop it from the controller's queue"""
+        if not self.controller:
+            return 503, {"status": "error", "error": "No controller to preempt"}
+        try:
+            reply = self.controller.preempt({"event": "release", "id": request_id})
+        except OSError as e:
+            logger.error(f"Error sending preemption release to controller: {e}")
+            return 500, {"status": "error", "id": request_id, "error": str(e)}
+        if reply is None:
+            return 504, {"status": "error", "id": request_id, "error": "The controller did not answer"}
+        if not reply.get("released"):
+            return 404, {"status": "error", "id": request_id, "error": f"No preemption {request_id}"}
+        return 200, {"status": "success", "id": request_id}
+
+    def health(self):
+        """Return service health and throughput counters"""
+        with self._lock:
+            sinks = {
+                name: {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "meanMs": round(stats["seconds"] * 1000 / stats["calls"], 3) if stats["calls"] else 0.0,
+                }
+                for name, stats in self.sink_stats.items()
+            }
+            return {
+                "status": "healthy",
+                "received": self.received,
+                "commandsApplied": self.commands_applied,
+                "lastUpdate": self.last_update_time.isoformat() if self.last_update_time else None,
+                "lastDigest": self.last_digest,
+                "duplicateCache": self.duplicate_cache.stats(),
+                "droppedLogRecords": dropped_records(),
+                "sinks": sinks,
+                **{sink.name: sink.stats() for sink in self.sinks if hasattr(sink, "stats")},
+            }
+
+
+def status_data(state, last_update_time):
+    """Build the status reported on /status and /events"""
+    return {
+        "controlMode": "manual" if state.manualcontrol_mode else "auto" if state.autocontrol_mode else "semi",
+        "selectedPole": state.selected_pole,
+        "activeRoute": state.active_route,
+        "yellowBlink": state.all_pole_yellow_blink,
+        "timeZone": state.time_zone_number,
+        "lastCommand": state.last_command,
+        "lastUpdate": last_update_time.isoformat() if last_update_time else None
+    }
+
+
+# Shared state monitored on /status, with its pre-serialized body and event stream
+config_state = ConfigState()
+status_broadcaster = StatusBroadcaster()
+status_broadcaster.set_status(status_data(config_state, None))
+
+# On-demand profiling: SIGUSR2 or POST /profile from the Pi itself
+profiler = Profiler("ingest_service")
+
+
+def default_sinks(journal, recorder=None):
+    """Build the sinks used by the running service"""
+    backup_store = BackupStore(BACKUP_DIR)
+    backup_store.apply_retention(max_snapshots=BACKUP_MAX_SNAPSHOTS)
+    sinks = [BackupSink(backup_store), JournalSink(journal)]
+    if WRITE_VARIABLES_FILE:
+        sinks.append(VariablesFileSink(VARIABLES_FILE_PATH))
+    sinks += [
+        ControllerNotifySink(CONTROLLER_NOTIFY_ADDRESS),
+        StateMonitorSink(config_state, status_broadcaster),
+    ]
+    if recorder:
+        sinks.append(TraceSink(recorder))
+    return sinks
+
+
+class IngestHTTPServer(ThreadingHTTPServer):
+    """Class to serve the ingest service with a listen backlog that rides out a flood"""
+
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    """HTTP request handler for the ingest service"""
+
+    service = None
+    admission = None
+    _body = None
+    _correlation_id = None
+
+    def handle_one_request(self):
+        # Requests are only run under cProfile while a profiling session asks for it
+        profiler.call(super().handle_one_request)
+
+    def _set_response(self, status_code=200, content_type="application/json"):
+        self.send_response(status_code)
+        self.send_header('Content-type', content_type)
+        self.send_header('Access-Control-Allow-Origin', '*')  # Allow CORS
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', f'Content-Type, Content-Encoding, X-Signature, If-None-Match, {IDEMPOTENCY_HEADER}, {CORRELATION_HEADER}')
+        self.end_headers()
+
+    def _send_json(self, status_code, data):
+        if self._correlation_id is not None:
+            self.service.traces.mark(self._correlation_id, "responded")
+            if isinstance(data, dict):
+                data = dict(data, correlationId=self._correlation_id)
+        self._set_response(status_code)
+        self.wfile.write(json.dumps(data).encode())
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def do_OPTIONS(self):
+        """Handle OPTIONS requests for CORS preflight"""
+        self._set_response()
+
+    def _read_body(self):
+        """The request body, read once (admission may have read it already)"""
+        if self._body is None:
+            self._body = self.rfile.read(int(self.headers['Content-Length']))
+        return self._body
+
+    def _admission_lane(self, endpoint):
+        """Preemptions and all-red or flash commands travel in the safety lane"""
+        if endpoint in ('/preempt', '/preempt/release'):
+            return "safety"
+        if endpoint not in ('/command', '/commands/batch'):
+            return "bulk"
+        try:
+            if int(self.headers['Content-Length']) > MAX_COMMAND_BYTES:
+                return "command"
+            data = json.loads(self._read_body().decode())
+            commands = [data] if endpoint == '/command' else parse_batch(data)[0]
+        except (TypeError, ValueError, UnicodeDecodeError):
+            return "command"
+        return "safety" if all(is_safety_command(command) for command in commands) else "command"
+
+    def do_POST(self):
+        """Admit, then handle, configuration pushes and manual commands"""
+        self._body = None
+        endpoint = self.path.split('?')[0]
+        if endpoint == '/':
+            endpoint = '/webhook'
+        self._correlation_id = None
+        received_at = time.time()
+        if self.admission is None:
+            self._begin_trace(endpoint, received_at)
+            self._handle_post(endpoint)
+            return
+
+        lane = self._admission_lane(endpoint)
+        retry_after = self.admission.check(self.client_address[0], endpoint, lane)
+        if retry_after is not None:
+            reject(self, retry_after, f"Too many requests to {endpoint}")
+            return
+        with self.admission.work(lane) as admitted:
+            if not admitted:
+                reject(self, 1, "Busy, try again")
+                return
+            # Rejected requests are counted by admission control, not traced, so a flood cannot push out real traces
+            self._begin_trace(endpoint, received_at)
+            self.service.traces.mark(self._correlation_id, "admitted")
+            self._handle_post(endpoint)
+
+    def _begin_trace(self, endpoint, received_at):
+        if endpoint in LATENCY_TRACED:
+            self._correlation_id = self.service.traces.begin(self.headers.get(CORRELATION_HEADER),
+                                                             LATENCY_TRACED[endpoint], at=received_at)
+
+    def _handle_post(self, endpoint):
+        """Handle configuration pushes and manual commands; endpoint is the path without its query string"""
+        if endpoint == '/command':
+            self._handle_command()
+            return
+        if endpoint == '/profile':
+            serve_profile_request(self, profiler)
+            return
+        if endpoint == '/commands/batch':
+            self._handle_command_batch()
+            return
+        if endpoint == '/timeline':
+            self._handle_timeline()
+            return
+        if endpoint in ('/preempt', '/preempt/release'):
+            self._handle_preemption(endpoint)
+            return
+        if endpoint != '/webhook':
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            body = self._read_body()
+            status_code, response = self.service.ingest(
+                body,
+                signature=self.headers.get('X-Signature'),
+                idempotency_key=self.headers.get(IDEMPOTENCY_HEADER),
+                content_encoding=self.headers.get('Content-Encoding'),
+                correlation_id=self._correlation_id
+            )
+            self._send_json(status_code, response)
+        except Exception as e:
+            logger.error(f"Error processing webhook: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    def _handle_command(self):
+        """Apply one manual command sent over HTTP"""
+        try:
+            command = json.loads(self._read_body().decode())
+            status_code, response = self.service.apply_commands([command], self._correlation_id)
+            response["id"] = command.get("id") if isinstance(command, dict) else None
+            self._send_json(status_code, response)
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {"status": "error", "error": f"Invalid command: {e}"})
+        except Exception as e:
+            logger.error(f"Error processing command: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    def _handle_command_batch(self):
+        """Apply an ordered list of manual commands as one transaction"""
+        try:
+            commands, batch_id = parse_batch(json.loads(self._read_body().decode()))
+            status_code, response = self.service.apply_commands(commands, self._correlation_id)
+            response["id"] = batch_id
+            self._send_json(status_code, response)
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {"status": "error", "error": f"Invalid batch: {e}"})
+        except Exception as e:
+            logger.error(f"Error processing command batch: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    def _handle_preemption(self, endpoint):
+        """Relay a preemption request, or the release of one, to the controller"""
+        try:
+            request = json.loads(self._read_body().decode())
+            if endpoint == '/preempt/release':
+                if not isinstance(request, dict) or "id" not in request:
+                    raise ValueError("Release needs the preemption id")
+                status_code, response = self.service.release_preemption(request["id"])
+            else:
+                status_code, response = self.service.preempt(request, self._correlation_id)
+            self._send_json(status_code, response)
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {"status": "error", "error": f"Invalid preemption: {e}"})
+        except Exception as e:
+            logger.error(f"Error processing preemption: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    def _handle_timeline(self):
+        """Compile the lamp timeline of a proposed configuration without applying it"""
+        # Imported on first use: it loads the controller module for its auto mode logic
+        from timeline import compile_timeline
+
+        try:
+            query = parse_qs(urlsplit(self.path).query)
+            zone = int(query["zone"][0]) if "zone" in query else None
+            if zone is not None and not 1 <= zone <= 8:
+                raise ValueError(f"Time zone {zone} is not between 1 and 8")
+            config = decode_body(self._read_body(), self.headers.get('Content-Encoding'))
+            self._send_json(200, compile_timeline(config, zone))
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {"error": f"Invalid timeline request: {e}"})
+        except Exception as e:
+            logger.error(f"Error compiling timeline: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    def _handle_traces(self):
+        """Recent request traces and per-stage latency percentiles"""
+        try:
+            query = parse_qs(urlsplit(self.path).query)
+            limit = int(query["limit"][0]) if "limit" in query else LATENCY_TRACES_SHOWN
+        except ValueError:
+            self._send_json(400, {"error": "limit must be a number"})
+            return
+        self._send_json(200, {"traces": self.service.traces.recent(limit), "summary": self.service.traces.summary()})
+
+    def _serve_websocket(self):
+        """Apply manual commands arriving over one persistent WebSocket"""
+        connection = accept(self)
+        logger.info(f"WebSocket command channel opened from {self.client_address[0]}")
+        for message in connection.messages():
+            try:
+                command = json.loads(message)
+                if isinstance(command, dict) and "commands" in command:
+                    commands, batch_id = parse_batch(command)
+                    status_code, response = self._apply_admitted(commands)
+                    response["id"] = batch_id
+                else:
+                    status_code, response = self._apply_admitted([command])
+                    response["id"] = command.get("id") if isinstance(command, dict) else None
+            except ValueError as e:
+                response = {"status": "error", "error": f"Invalid command: {e}", "id": None}
+            connection.send_text(json.dumps(response))
+        logger.info(f"WebSocket command channel closed from {self.client_address[0]}")
+
+    def _apply_admitted(self, commands):
+        """Apply commands from the WebSocket under the same admission control as HTTP requests"""
+        if self.admission is None:
+            return self.service.apply_commands(commands)
+        lane = "safety" if all(is_safety_command(command) for command in commands) else "command"
+        retry_after = self.admission.check(self.client_address[0], '/ws', lane)
+        if retry_after is not None:
+            return 429, {"status": "error", "error": "Too many commands", "retryAfter": round(retry_after, 3)}
+        with self.admission.work(lane) as admitted:
+            if not admitted:
+                return 429, {"status": "error", "error": "Busy, try again", "retryAfter": 1}
+            return self.service.apply_commands(commands)
+
+    def do_GET(self):
+        """Handle GET requests for health check, status, latency traces and the command channel"""
+        self._correlation_id = None
+        # Admitted and dispatched on the same path, without its query string
+        endpoint = self.path.split('?')[0]
+        if self.admission is not None:
+            retry_after = self.admission.check(self.client_address[0], endpoint,
+                                               "command" if endpoint == '/ws' else "read")
+            if retry_after is not None:
+                reject(self, retry_after, f"Too many requests to {endpoint}")
+                return
+        if endpoint == '/ws' and is_websocket_request(self):
+            self._serve_websocket()
+        elif endpoint == '/health':
+            health = self.service.health()
+            if self.admission is not None:
+                health["admission"] = self.admission.stats()
+            self._send_json(200, health)
+        elif endpoint == '/profile':
+            serve_profile_request(self, profiler)
+        elif endpoint == '/traces':
+            self._handle_traces()
+        elif endpoint == '/status':
+            # Served from the cached body (304 when unchanged)
+            serve_cached_status(self, status_broadcaster)
+        elif endpoint == '/events':
+            # Server-Sent Events stream of status changes and lamp frames
+            serve_event_stream(self, status_broadcaster)
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+
+def start_mqtt_bridge(service):
+    """Start ingesting from the MQTT broker alongside the HTTP server"""
+    from mqtt_bridge import MQTT_AVAILABLE, MqttBridge
+
+    if not MQTT_AVAILABLE:
+        logger.error("MQTT_ENABLED is set but paho-mqtt is not installed")
+        return None
+    try:
+        bridge = MqttBridge(service, JUNCTION_ID, broadcaster=status_broadcaster)
+        bridge.start()
+        return bridge
+    except Exception as e:
+        # The broker may be unreachable; webhooks keep working without it
+        logger.error(f"Could not start MQTT bridge: {e}")
+        return None
+
+
+def run_server(service, recorder=None):
+    """Run the ingest server"""
+    IngestHandler.service = service
+    IngestHandler.admission = AdmissionControl(ENDPOINT_LIMITS) if ADMISSION_ENABLED else None
+    httpd = IngestHTTPServer(('', SERVER_PORT), IngestHandler)
+
+    def on_frame(frame):
+        service.trace_frame(frame)
+        if recorder:
+            recorder.frame(frame)
+
+    start_frame_listener(status_broadcaster, on_frame=on_frame)
+    if MQTT_ENABLED:
+        start_mqtt_bridge(service)
+    logger.info(f"Starting ingest service on port {SERVER_PORT}")
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Server stopped by user")
+    except Exception as e:
+        logger.error(f"Server error: {e}")
+    finally:
+        httpd.server_close()
+        logger.info("Server stopped")
+
+
+def benchmark(count=200):
+    """Measure in-process ingest throughput against temporary sink targets"""
+    work_dir = tempfile.mkdtemp(prefix="ingest_bench_")
+    state = ConfigState()
+    state.print_current_state = lambda: None
+    service = IngestService([
+        BackupSink(BackupStore(os.path.join(work_dir, "backups"))),
+        VariablesFileSink(os.path.join(work_dir, "traffic_start_variables.py")),
+        StateMonitorSink(state),
+    ])
+
+    bodies = [
+        json.dumps({"controlMode": "auto", "time_zone_number": i % 8 + 1, "timestamp": i}).encode()
+        for i in range(count)
+    ]
+
+    start = time.perf_counter()
+    for body in bodies:
+        service.ingest(body)
+    elapsed = time.perf_counter() - start
+
+    print(f"Ingested {count} payloads in {elapsed:.3f}s ({count / elapsed:.1f}/s, {elapsed * 1000 / count:.2f} ms each)")
+    print(json.dumps(service.health()["sinks"], indent=2))
+
+
+def _stub_controller():
+    """Stub controller acknowledging manual commands the way traffic_controller.py does; returns its address"""
+    controller_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    controller_sock.bind(("127.0.0.1", 0))
+
+    def acknowledge():
+        while True:
+            data, sender = controller_sock.recvfrom(65536)
+            message = json.loads(data.decode())
+            if message.get("event") == "manual":
+                reply = {"id": message["id"], "appliedAt": time.time()}
+                controller_sock.sendto(json.dumps(reply).encode(), sender)
+
+    threading.Thread(target=acknowledge, daemon=True).start()
+    return controller_sock.getsockname()
+
+
+def _bench_service(work_dir):
+    """Ingest service with temporary sink targets and a stub controller, for the HTTP benchmarks"""
+    state = ConfigState()
+    state.print_current_state = lambda: None
+    return IngestService([
+        BackupSink(BackupStore(os.path.join(work_dir, "backups"))),
+        VariablesFileSink(os.path.join(work_dir, "traffic_start_variables.py")),
+        ControllerNotifySink(_stub_controller()),
+        StateMonitorSink(state),
+    ])
+
+
+def benchmark_commands(count=200):
+    """
+    Compare manual command latency over a full-config HTTP push, HTTP /command
+    and the WebSocket channel, against a local server and a stub controller.
+    """
+    from statistics import median
+
+    work_dir = tempfile.mkdtemp(prefix="ingest_bench_")
+    IngestHandler.service = _bench_service(work_dir)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), IngestHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    host, port = httpd.server_address
+
+    full_config = process_json_data({"manualcontrol_mode": True})
+
+    def full_config_push(i):
+        full_config["manual_control_pole_1A_red_light"] = bool(i % 2)
+        full_config["timestamp"] = i
+        connection = http.client.HTTPConnection(host, port)
+        connection.request("POST", "/webhook", json.dumps(full_config, indent=2))
+        connection.getresponse().read()
+        connection.close()
+
+    def http_command(i):
+        connection = http.client.HTTPConnection(host, port)
+        connection.request("POST", "/command", json.dumps({"target": "P1A", "action": "red_on" if i % 2 else "red_off"}))
+        connection.getresponse().read()
+        connection.close()
+
+    websocket = connect(host, port)
+
+    def websocket_command(i):
+        websocket.send_text(json.dumps({"target": "P1A", "action": "red_on" if i % 2 else "red_off", "id": i}))
+        websocket.receive()
+
+    for name, send in (("full config POST", full_config_push), ("HTTP /command", http_command), ("WebSocket /ws", websocket_command)):
+        latencies = []
+        start = time.perf_counter()
+        for i in range(count):
+            sent = time.perf_counter()
+            send(i)
+            latencies.append((time.perf_counter() - sent) * 1000)
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        print(f"{name:18s} {count / elapsed:8.1f} cmd/s  p50 {median(latencies):6.2f} ms  "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:6.2f} ms")
+
+    websocket.close()
+    httpd.shutdown()
+
+
+def _post(host, port, path, body):
+    """POST a body on a new connection; returns the status code, or "error" """
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    try:
+        connection.request("POST", path, body)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    except OSError:
+        return "error"
+    finally:
+        connection.close()
+
+
+def _flood(host, port, seconds, flooders, results):
+    """Post distinct config uploads from many threads; puts (answers by status, 429 latencies in ms)"""
+    stop_at = time.monotonic() + seconds
+    answers = {}
+    rejected_ms = []
+    counter = iter(range(10 ** 9))
+
+    def flood():
+        config = process_json_data({})
+        while time.monotonic() < stop_at:
+            config["timestamp"] = next(counter)
+            sent = time.perf_counter()
+            status = _post(host, port, "/webhook", json.dumps(config))
+            answers[status] = answers.get(status, 0) + 1
+            if status == 429:
+                rejected_ms.append((time.perf_counter() - sent) * 1000)
+
+    threads = [threading.Thread(target=flood) for _ in range(flooders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((answers, sorted(rejected_ms)))
+
+
+def benchmark_flood(seconds=5, flooders=16):
+    """
+    Flood /webhook with distinct config uploads from many threads while an
+    all-red batch is sent every 100 ms, without and with admission control,
+    and report the all-red latency, how the flood was answered and the CPU
+    the service used.
+    """
+    import multiprocessing
+    import shutil
+
+    work_dir = tempfile.mkdtemp(prefix="ingest_bench_")
+    IngestHandler.service = _bench_service(work_dir)
+    all_red = json.dumps({"commands": [{"target": pole, "action": "red_on"}
+                                       for pole in ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]]})
+
+    for name, admission in (("no admission", None), ("admission", AdmissionControl(ENDPOINT_LIMITS))):
+        IngestHandler.admission = admission
+        httpd = IngestHTTPServer(("127.0.0.1", 0), IngestHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        host, port = httpd.server_address
+        results = multiprocessing.Queue()
+        # The flood comes from another process, as it would from another machine
+        flood = multiprocessing.Process(target=_flood, args=(host, port, seconds, flooders, results))
+        cpu_start = time.process_time()
+        flood.start()
+        safety_ms = []
+        stop_at = time.monotonic() + seconds
+        while time.monotonic() < stop_at:
+            sent = time.perf_counter()
+            if _post(host, port, "/commands/batch", all_red) == 200:
+                safety_ms.append((time.perf_counter() - sent) * 1000)
+            time.sleep(0.1)
+        answers, rejected_ms = results.get()
+        flood.join()
+        cpu = (time.process_time() - cpu_start) / seconds * 100
+        httpd.shutdown()
+        httpd.server_close()
+
+        safety_ms.sort()
+        rejected_ms.sort()
+        print(f"{name:13s} all-red p50 {safety_ms[len(safety_ms) // 2]:7.2f} ms  "
+              f"p99 {safety_ms[int(len(safety_ms) * 0.99) - 1]:7.2f} ms ({len(safety_ms)} sent); "
+              f"flood answers {dict(sorted(answers.items(), key=str))}"
+              + (f", 429 in {rejected_ms[len(rejected_ms) // 2]:.2f} ms" if rejected_ms else "")
+              + f"; service used {cpu:.0f}% CPU")
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_journal(pushes=24, commands=500):
+    """
+    Estimate bytes written per day by a day of configuration pushes and manual
+    commands, with the variables file and with the journal.
+    """
+    from wire_format import sample_config
+
+    def directory_bytes(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+
+    class CountingVariablesFileSink(VariablesFileSink):
+        bytes_written = 0
+
+        def handle(self, event):
+            before = os.path.getmtime(self.file_path) if os.path.exists(self.file_path) else None
+            super().handle(event)
+            if os.path.getmtime(self.file_path) != before or before is None:
+                self.bytes_written += os.path.getsize(self.file_path)
+
+    def run(make_sink):
+        work_dir = tempfile.mkdtemp(prefix="journal_bench_")
+        backup_dir = os.path.join(work_dir, "backups")
+        sink = make_sink(work_dir)
+        service = IngestService([BackupSink(BackupStore(backup_dir)), sink])
+        config = sample_config()
+        for push in range(pushes):
+            config = dict(config, pole_1A_red_time_time_zone_1=push + 1, time_zone_number=push % 8 + 1)
+            service.ingest(json.dumps(config).encode())
+            for command in range(commands // pushes):
+                signal = ["red", "yel", "grnL", "grnS", "grnR"][command % 5]
+                service.apply_commands([{"target": "P1A", "action": f"{signal}_{'on' if command % 2 else 'off'}"}])
+        return sink, directory_bytes(backup_dir)
+
+    logging.disable(logging.CRITICAL)
+    try:
+        file_sink, file_backup = run(lambda d: CountingVariablesFileSink(os.path.join(d, "traffic_start_variables.py")))
+        journal_sink, journal_backup = run(lambda d: JournalSink(ConfigJournal(os.path.join(d, "journal"))))
+        journal_sink.journal.close()
+    finally:
+        logging.disable(logging.NOTSET)
+
+    stats = journal_sink.stats()
+    print(f"One day: {pushes} configuration pushes, {commands // pushes * pushes} manual commands")
+    print(f"  Backup store (both):  {file_backup:>10} bytes")
+    print(f"  Variables file:       {file_sink.bytes_written:>10} bytes, one rewrite per change")
+    print(f"  Journal:              {stats['bytesWritten']:>10} bytes, {stats['fsyncs']} fsyncs, "
+          f"{stats['records']} records")
+
+
+def main():
+    """Main function to run the ingest service"""
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-commands":
+        benchmark_commands(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-journal":
+        benchmark_journal()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-flood":
+        benchmark_flood(float(sys.argv[2]) if len(sys.argv) > 2 else 5)
+        return
+
+    logger.info("Starting Traffic Junction Ingest Service")
+    install_signal_handler(profiler)
+    journal = ConfigJournal(JOURNAL_DIR).start()
+    recorder = None
+    if TRACE_ENABLED:
+        recorder = TraceRecorder(TRACE_FILE, TRACE_MAX_BYTES)
+        # The trace starts from what the controller is running with
+        recorder.snapshot(journal.state())
+    service = IngestService(default_sinks(journal, recorder))
+    # Manual commands after a restart apply on top of the recorded variables
+    service.variables = journal.state() or None
+    try:
+        run_server(service, recorder)
+    finally:
+        journal.close()
+        if recorder:
+            recorder.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,31 +12,56 @@ Configuration:
     - Set the WEB_SERVER_URL to your web hosting platform URL
     - Set the JSON_FILE_PATH to the location where you want to save the JSON file
     - Set the POLL_INTERVAL to control how frequently to check for updates (in seconds)
+    - Set LONG_POLL to True if the web server can hold a request open (?wait=<seconds>)
+      until the configuration changes
+
+Fetches are conditional: the ETag of the last configuration is sent as
+If-None-Match, and a 304 or an identical body is skipped without any disk write.
 """
 
+import bisect
 import json
 import time
 import os
+import random
 import requests
 import logging
 from datetime import datetime
 
+from async_logging import setup_logging
+from backup_store import BackupStore, content_hash
+from profiling import Profiler, install_signal_handler
+from wire_format import expand
+
 # Configuration
 WEB_SERVER_URL = "https://your-web-server.com/api/get-json-config"
 JSON_FILE_PATH = "/home/pi/traffic_junction/config.json"
 BACKUP_DIR = "/home/pi/traffic_junction/backups"
+BACKUP_MAX_SNAPSHOTS = 500  # Retention applied to the backup store at startup
 POLL_INTERVAL = 5  # seconds
+LONG_POLL = False  # Let the server hold each request for up to POLL_INTERVAL seconds
+BACKOFF_MAX = 300  # Maximum delay between attempts while the server is unreachable (seconds)
+REQUEST_TIMEOUT = 10  # seconds
+DEFAULT_ROUTE_DURATION = 10  # Route time when a zone has no time periods (seconds)
+CYCLE_EPOCH = 0  # Unix time at which every zone cycle is anchored to its first route
+ROUTE_CHANGE_SLACK = 0.01  # seconds past a route change the reader wakes, so the new route is the one looked up
 LOG_FILE = "/home/pi/traffic_junction/json_reader.log"
 
-# Setup logging
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Setup logging (written by a background thread, see async_logging.py)
+setup_logging(LOG_FILE)
+
+# Content-addressed backup store (creates the backup directory)
+backup_store = BackupStore(BACKUP_DIR)
 
-# Ensure backup directory exists
-os.makedirs(BACKUP_DIR, exist_ok=True)
+# Persistent keep-alive session and conditional fetch state
+session = requests.Session()
+last_etag = None
+last_config_hash = None
+fetch_failures = 0
+
+# Compiled zone cycles, rebuilt only when a different configuration is applied
+compiled_cycles_config = None
+compiled_cycles = {}
 
 # GPIO pin mapping for traffic lights
 # Format: {pole: {signal: gpio_pin}}
@@ -80,37 +105,68 @@ def setup_gpio():
         logging.error(f"Error setting up GPIO: {e}")
         return None
 
-def fetch_json_config():
-    """Fetch the JSON configuration from the web server"""
+def fetch_json_config(url=WEB_SERVER_URL, wait=None):
+    """
+    Fetch the JSON configuration from the web server.
+    
+    Returns the configuration only when it has changed since the last fetch,
+    otherwise None. With wait set, the server may hold the request open for up
+    to that many seconds until the configuration changes.
+    """
+    global last_etag, last_config_hash, fetch_failures
+    
     try:
-        response = requests.get(WEB_SERVER_URL, timeout=10)
+        headers = {}
+        if last_etag:
+            headers["If-None-Match"] = last_etag
+        params = {"wait": wait} if wait else None
+        timeout = REQUEST_TIMEOUT + (wait or 0)
+        
+        response = session.get(url, headers=headers, params=params, timeout=timeout)
+        fetch_failures = 0
+        
+        if response.status_code == 304:
+            return None
         response.raise_for_status()  # Raise an exception for HTTP errors
         
         # Parse JSON response
-        config = response.json()
-        
-        # Save to file
-        with open(JSON_FILE_PATH, 'w') as f:
-            json.dump(config, f, indent=2)
+        config = expand(response.json())
+        last_etag = response.headers.get("ETag")
         
-        # Create a backup with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = os.path.join(BACKUP_DIR, f"config_{timestamp}.json")
-        with open(backup_path, 'w') as f:
-            json.dump(config, f, indent=2)
+        # Servers without ETag support are detected by the body hash instead
+        config_hash = content_hash(config)
+        if config_hash == last_config_hash:
+            return None
+        last_config_hash = config_hash
         
-        logging.info(f"Successfully fetched and saved JSON configuration")
+        # Back up the configuration; unchanged payloads are not written again
+        if backup_store.save(config) is not None or not os.path.exists(JSON_FILE_PATH):
+            # Save to file
+            with open(JSON_FILE_PATH, 'w') as f:
+                json.dump(config, f, indent=2)
+            
+            logging.info(f"Successfully fetched and saved JSON configuration")
         return config
     except requests.exceptions.RequestException as e:
+        fetch_failures += 1
         logging.error(f"Error fetching JSON configuration: {e}")
         return None
     except json.JSONDecodeError as e:
+        fetch_failures += 1
         logging.error(f"Error parsing JSON response: {e}")
         return None
     except Exception as e:
+        fetch_failures += 1
         logging.error(f"Unexpected error: {e}")
         return None
 
+def next_poll_delay():
+    """Seconds to wait before the next fetch, backing off with jitter while offline"""
+    if fetch_failures == 0:
+        return POLL_INTERVAL
+    delay = min(BACKOFF_MAX, POLL_INTERVAL * 2 ** min(fetch_failures, 16))
+    return random.uniform(delay / 2, delay)
+
 def load_local_json_config():
     """Load the JSON configuration from the local file"""
     try:
@@ -127,10 +183,13 @@ def load_local_json_config():
         return None
 
 def apply_configuration(config, GPIO):
-    """Apply the configuration to control the traffic lights"""
+    """
+    Apply the configuration to control the traffic lights. Returns the seconds
+    until the running route ends in auto mode, else None.
+    """
     if not config:
         logging.warning("No configuration to apply")
-        return
+        return None
     
     try:
         # Extract the current control mode
@@ -138,7 +197,7 @@ def apply_configuration(config, GPIO):
         logging.info(f"Current control mode: {control_mode}")
         
         if control_mode == "auto":
-            apply_auto_control(config, GPIO)
+            return apply_auto_control(config, GPIO)
         elif control_mode == "manual":
             apply_manual_control(config, GPIO)
         elif control_mode == "semi":
@@ -147,12 +206,68 @@ def apply_configuration(config, GPIO):
             logging.warning(f"Unknown control mode: {control_mode}")
     except Exception as e:
         logging.error(f"Error applying configuration: {e}")
+    return None
+
+class ZoneCycle:
+    """Class to hold a time zone's route sequence compiled for position lookups"""
+    
+    def __init__(self, routes, durations):
+        self.routes = routes
+        self.durations = durations
+        # Prefix sums: route i runs from ends[i - 1] (or 0) up to ends[i]
+        self.ends = []
+        total = 0
+        for duration in durations:
+            total += duration
+            self.ends.append(total)
+        self.cycle_length = total
+    
+    def position(self, timestamp):
+        """Return (route, seconds left in it) at a unix time, in O(log n)"""
+        offset = (timestamp - CYCLE_EPOCH) % self.cycle_length
+        index = bisect.bisect_right(self.ends, offset)
+        return self.routes[index], self.ends[index] - offset
+
+def route_duration(config, zone, route_number):
+    """Duration of a route: the longest green period it shows on any pole"""
+    time_periods = zone.get("timePeriods") or {}
+    route_signals = config.get("signalSequences", {}).get(str(route_number), {})
+    
+    duration = 0
+    for pole, signals in route_signals.items():
+        periods = time_periods.get(pole, {})
+        for signal in ("greenLeft", "greenStraight", "greenRight"):
+            if signals.get(signal) in ("1", "D") or signals.get("greenAll") == "A":
+                duration = max(duration, periods.get(signal, 0))
+    
+    return duration if duration > 0 else DEFAULT_ROUTE_DURATION
+
+def compile_zone_cycle(config, zone):
+    """Compile a time zone's sequence string into a ZoneCycle"""
+    sequence_str = zone.get("sequence", "")
+    routes = [int(s.strip()) for s in sequence_str.split(",") if s.strip().isdigit()]
+    if not routes:
+        return None
+    return ZoneCycle(routes, [route_duration(config, zone, route) for route in routes])
+
+def get_zone_cycle(config, zone):
+    """Return the compiled cycle for a zone, compiling once per configuration"""
+    global compiled_cycles_config, compiled_cycles
+    
+    if config is not compiled_cycles_config:
+        compiled_cycles_config = config
+        compiled_cycles = {}
+    
+    key = zone.get("id", zone.get("name"))
+    if key not in compiled_cycles:
+        compiled_cycles[key] = compile_zone_cycle(config, zone)
+    return compiled_cycles[key]
 
 def apply_auto_control(config, GPIO):
-    """Apply auto control mode settings"""
+    """Apply auto control mode settings; returns the seconds left in the route applied, or None"""
     if not GPIO:
         logging.info("Simulation mode: Would apply auto control settings")
-        return
+        return None
     
     try:
         # Get current time
@@ -179,31 +294,30 @@ def apply_auto_control(config, GPIO):
         
         if not active_zone:
             logging.warning("No active time zone found for current time")
-            return
+            return None
         
         logging.info(f"Active time zone: {active_zone.get('name')}")
         
-        # Get the sequence for the active time zone
-        sequence_str = active_zone.get("sequence", "")
-        sequence = [int(s.strip()) for s in sequence_str.split(",") if s.strip().isdigit()]
+        # Get the compiled cycle for the active time zone
+        cycle = get_zone_cycle(config, active_zone)
         
-        if not sequence:
+        if not cycle:
             logging.warning("No valid sequence found in active time zone")
-            return
+            return None
         
-        # Get the current step in the sequence (based on time)
-        # This is a simple implementation - you might want to use a more sophisticated approach
-        seconds_since_midnight = now.hour * 3600 + now.minute * 60 + now.second
-        step_index = (seconds_since_midnight // 10) % len(sequence)  # Change route every 10 seconds
-        current_route = sequence[step_index]
+        # The current route follows from wall-clock time alone, so a restart or a
+        # zone change lands on the same frame without walking the sequence
+        current_route, remaining = cycle.position(time.time())
         
-        logging.info(f"Current route in sequence: {current_route}")
+        logging.info(f"Current route in sequence: {current_route} ({remaining:.1f}s left)")
         
         # Apply the current route
         apply_route(config, GPIO, current_route)
+        return remaining
         
     except Exception as e:
         logging.error(f"Error in auto control mode: {e}")
+        return None
 
 def apply_manual_control(config, GPIO):
     """Handle manual control mode settings"""
@@ -319,26 +433,57 @@ def main():
     """Main function to run the JSON reader"""
     logging.info("Starting Traffic Junction JSON Reader")
     
+    # On-demand profiling, started with SIGUSR2
+    profiler = Profiler("json_reader")
+    install_signal_handler(profiler)
+    
     # Setup GPIO
     GPIO = setup_gpio()
     
+    backup_store.apply_retention(max_snapshots=BACKUP_MAX_SNAPSHOTS)
+    
     # Load initial configuration from local file
+    global last_config_hash
     config = load_local_json_config()
     if config:
+        last_config_hash = content_hash(config)
         apply_configuration(config, GPIO)
     
-    # Main loop
+    # Main loop: fetch on the poll cadence, apply whenever the running route ends
+    next_fetch = time.monotonic()
+    remaining = None
     while True:
         try:
-            # Fetch new configuration
-            new_config = fetch_json_config()
+            profiler.checkpoint()
             
-            if new_config:
-                # Apply the new configuration
-                apply_configuration(new_config, GPIO)
+            # A long poll returns by the end of the running route, so the next one is applied on time
+            wait = None
+            if LONG_POLL:
+                wait = POLL_INTERVAL if remaining is None else min(POLL_INTERVAL, int(remaining))
+            if time.monotonic() >= next_fetch and wait == 0:
+                # Under a second of the route left: fetch once the next one has been applied
+                next_fetch = time.monotonic() + remaining + ROUTE_CHANGE_SLACK
+            elif time.monotonic() >= next_fetch:
+                started = time.monotonic()
+                
+                # Fetch the configuration if it has changed
+                new_config = fetch_json_config(wait=wait)
+                if new_config:
+                    config = new_config
+                
+                # A long poll has already waited on the server
+                if wait and fetch_failures == 0:
+                    next_fetch = started + wait
+                else:
+                    next_fetch = time.monotonic() + next_poll_delay()
             
-            # Wait for the next poll interval
-            time.sleep(POLL_INTERVAL)
+            # Re-apply so time based routes keep stepping, and wake again when the route ends
+            remaining = apply_configuration(config, GPIO) if config else None
+            delay = next_fetch - time.monotonic()
+            if remaining is not None:
+                delay = min(delay, remaining + ROUTE_CHANGE_SLACK)
+            if delay > 0:
+                time.sleep(delay)
             
         except KeyboardInterrupt:
             logging.info("Program terminated by user")
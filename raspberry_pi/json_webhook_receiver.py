@@ -22,30 +22,53 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 import hashlib
 import hmac
 
+from admission import AdmissionControl, reject
+from async_logging import setup_logging
+from backup_store import BackupStore
+from duplicate_cache import DuplicateCache, IDEMPOTENCY_HEADER
+from profiling import Profiler, install_signal_handler
+from wire_format import decode_body
+
 # Configuration
 SERVER_PORT = 8080
 JSON_FILE_PATH = "/home/pi/traffic_junction/config.json"
 BACKUP_DIR = "/home/pi/traffic_junction/backups"
+BACKUP_MAX_SNAPSHOTS = 500  # Retention applied to the backup store at startup
 SECRET_KEY = "your-secret-key-here"  # Change this to a secure key
 LOG_FILE = "/home/pi/traffic_junction/webhook_receiver.log"
 
-# Setup logging
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Setup logging (written by a background thread, see async_logging.py)
+setup_logging(LOG_FILE)
+
+# Content-addressed backup store (creates the backup directory)
+backup_store = BackupStore(BACKUP_DIR)
+
+# Recently handled payloads, so retried deliveries are acknowledged without disk writes
+duplicate_cache = DuplicateCache()
+
+# On-demand profiling, started with SIGUSR2
+profiler = Profiler("webhook_receiver")
 
-# Ensure backup directory exists
-os.makedirs(BACKUP_DIR, exist_ok=True)
+# Token buckets per client and for the endpoint, so a retry storm gets fast 429s
+admission = AdmissionControl({"/": (2, 10)})
 
 class WebhookHandler(BaseHTTPRequestHandler):
+    def handle_one_request(self):
+        # Requests are only run under cProfile while a profiling session asks for it
+        profiler.call(super().handle_one_request)
+    
     def _set_response(self, status_code=200, content_type="application/json"):
         self.send_response(status_code)
         self.send_header('Content-type', content_type)
         self.end_headers()
     
     def do_POST(self):
+        # Turn a flood away before reading the body (see admission.py)
+        retry_after = admission.check(self.client_address[0], self.path.split('?')[0], "bulk")
+        if retry_after is not None:
+            reject(self, retry_after, "Too many requests")
+            return
+        
         try:
             # Get content length
             content_length = int(self.headers['Content-Length'])
@@ -68,30 +91,37 @@ class WebhookHandler(BaseHTTPRequestHandler):
                     self.wfile.write(json.dumps({"error": "Invalid signature"}).encode())
                     return
             
+            # Acknowledge duplicate deliveries with the original response
+            idempotency_key = self.headers.get(IDEMPOTENCY_HEADER)
+            cached = duplicate_cache.lookup(post_data, idempotency_key)
+            if cached:
+                status_code, response_body = cached
+                self._set_response(status_code)
+                self.wfile.write(response_body)
+                return
+            
             # Parse JSON data
             try:
-                config = json.loads(post_data.decode())
-            except json.JSONDecodeError as e:
+                config = decode_body(post_data, self.headers.get('Content-Encoding'))
+            except (ValueError, UnicodeDecodeError) as e:
                 logging.error(f"Invalid JSON received: {e}")
                 self._set_response(400)
                 self.wfile.write(json.dumps({"error": "Invalid JSON"}).encode())
                 return
             
-            # Save to file
-            with open(JSON_FILE_PATH, 'w') as f:
-                json.dump(config, f, indent=2)
-            
-            # Create a backup with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = os.path.join(BACKUP_DIR, f"config_{timestamp}.json")
-            with open(backup_path, 'w') as f:
-                json.dump(config, f, indent=2)
+            # Back up the configuration; unchanged payloads are not written again
+            if backup_store.save(config) is not None or not os.path.exists(JSON_FILE_PATH):
+                # Save to file
+                with open(JSON_FILE_PATH, 'w') as f:
+                    json.dump(config, f, indent=2)
             
             logging.info(f"Received and saved JSON configuration update")
             
             # Send success response
+            response_body = json.dumps({"status": "success"}).encode()
+            duplicate_cache.store(post_data, idempotency_key, 200, response_body)
             self._set_response()
-            self.wfile.write(json.dumps({"status": "success"}).encode())
+            self.wfile.write(response_body)
             
         except Exception as e:
             logging.error(f"Error processing webhook: {e}")
@@ -102,7 +132,11 @@ class WebhookHandler(BaseHTTPRequestHandler):
         if self.path == '/health':
             # Health check endpoint
             self._set_response()
-            self.wfile.write(json.dumps({"status": "healthy"}).encode())
+            self.wfile.write(json.dumps({
+                "status": "healthy",
+                "duplicateCache": duplicate_cache.stats(),
+                "admission": admission.stats()
+            }).encode())
         else:
             self._set_response(404)
             self.wfile.write(json.dumps({"error": "Not found"}).encode())
@@ -111,6 +145,8 @@ def run_server():
     """Run the webhook server"""
     server_address = ('', SERVER_PORT)
     httpd = HTTPServer(server_address, WebhookHandler)
+    install_signal_handler(profiler)
+    backup_store.apply_retention(max_snapshots=BACKUP_MAX_SNAPSHOTS)
     logging.info(f"Starting webhook server on port {SERVER_PORT}")
     
     try:
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+End-to-end Latency Tracing from Dashboard Click to Lamp Change
+
+The dashboard gives every command and configuration push a correlation ID
+(X-Correlation-Id). The ingest service carries it through its own stages, on
+the reload and manual events to the controller, and back on the lamp frame the
+controller publishes once the change reaches the GPIO pins. Each stage is
+timestamped (time.time(), so the controller's stamps compare with the
+service's on the same Pi) in a small in-memory buffer of recent traces:
+
+    received           request line and headers read by the ingest service
+    admitted           past admission control
+    parsed             body decoded and converted to variables
+    notified           reload announced to the controller (configuration pushes)
+    controllerLoaded   controller loaded the new variables (configuration pushes)
+    lampsWritten       lamps written by the controller
+    clearanceStarted   clearance towards the requested route started (preemptions)
+    persisted          every sink done (backup, journal, variables file)
+    responded          response about to be sent
+
+GET /traces on the ingest service returns the recent traces and, per kind of
+request, percentiles of each stage's time since the request was received.
+
+Usage:
+    traces = TraceBuffer()
+    correlation_id = traces.begin(request.headers.get(CORRELATION_HEADER), "command")
+    traces.mark(correlation_id, "parsed")
+    traces.summary()
+"""
+
+import math
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+CORRELATION_HEADER = "X-Correlation-Id"
+MAX_TRACES = 256  # Traces kept, oldest dropped first
+STAGES = ["received", "admitted", "parsed", "notified", "controllerLoaded", "lampsWritten", "clearanceStarted",
+          "persisted", "responded"]
+PERCENTILES = [50, 90, 99]
+VALID_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")  # IDs from clients are echoed back, so only plain ones are kept
+
+
+def new_id():
+    return uuid.uuid4().hex
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    index = max(0, math.ceil(percent / 100 * len(values)) - 1)
+    return values[index]
+
+
+class TraceBuffer:
+    """Class to keep per-stage timestamps of recent requests by correlation ID"""
+
+    def __init__(self, max_traces=MAX_TRACES):
+        self.max_traces = max_traces
+        self._lock = threading.Lock()
+        self._traces = OrderedDict()  # correlation ID -> {"kind": ..., "stages": {stage: time}}
+
+    def begin(self, correlation_id=None, kind="command", at=None):
+        """Start a trace at its received stage; returns its correlation ID (a new one if none or a bad one was given)"""
+        if not correlation_id or not VALID_ID.match(correlation_id):
+            correlation_id = new_id()
+        with self._lock:
+            self._traces[correlation_id] = {"kind": kind, "stages": {"received": time.time() if at is None else at}}
+            self._traces.move_to_end(correlation_id)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        return correlation_id
+
+    def mark(self, correlation_id, stage, at=None):
+        """Timestamp a stage of a trace; the first mark of a stage is kept, unknown IDs are ignored"""
+        if correlation_id is None:
+            return
+        with self._lock:
+            trace = self._traces.get(correlation_id)
+            if trace is not None:
+                trace["stages"].setdefault(stage, time.time() if at is None else at)
+
+    def recent(self, limit=20):
+        """The latest traces, newest first, with each stage in ms since the request was received"""
+        with self._lock:
+            items = list(self._traces.items())[-limit:] if limit > 0 else []
+        return [self._describe(correlation_id, trace) for correlation_id, trace in reversed(items)]
+
+    def summary(self):
+        """Per kind of request and stage: count and percentiles of the ms since the request was received"""
+        offsets = {}
+        with self._lock:
+            for trace in self._traces.values():
+                received = trace["stages"]["received"]
+                kind = offsets.setdefault(trace["kind"], {})
+                for stage, at in trace["stages"].items():
+                    if stage != "received":
+                        kind.setdefault(stage, []).append((at - received) * 1000)
+        summary = {}
+        for kind, stages in offsets.items():
+            summary[kind] = {}
+            for stage in sorted(stages, key=_stage_order):
+                values = sorted(stages[stage])
+                summary[kind][stage] = {
+                    "count": len(values),
+                    **{f"p{percent}": round(percentile(values, percent), 3) for percent in PERCENTILES},
+                    "max": round(values[-1], 3),
+                }
+        return summary
+
+    def _describe(self, correlation_id, trace):
+        received = trace["stages"]["received"]
+        return {
+            "correlationId": correlation_id,
+            "kind": trace["kind"],
+            "receivedAt": received,
+            "stagesMs": {stage: round((at - received) * 1000, 3)
+                         for stage, at in sorted(trace["stages"].items(), key=lambda item: item[1])
+                         if stage != "received"},
+        }
+
+
+def _stage_order(stage):
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
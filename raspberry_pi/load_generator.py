@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Webhook Load Generator for the Traffic Junction Receivers
+
+Sends a realistic mix of requests to one receiver at a set concurrency and
+reports throughput, latency percentiles and errors per request kind:
+
+    config      full configuration pushes (every one different), signed with
+                X-Signature and sent without indentation like the web app does
+    manual      small manual control toggles; sent to the command endpoint when
+                the receiver has one, otherwise as a small configuration push
+    duplicate   a repeated delivery of an earlier push with the same
+                Idempotency-Key, answered from the duplicate cache
+
+While the load runs, the traffic controller's heartbeat and sleep lateness
+histogram are sampled over UDP ({"event": "stats"} on its notify port), so the
+report shows whether the lamps' phase timing suffered.
+
+With --rate, requests are paced at a fixed total rate and latency is measured
+from when each request was due, so a server that falls behind shows up in the
+percentiles instead of silently lowering the rate.
+
+Usage:
+    python3 load_generator.py ingest --concurrency 8 --duration 30
+    python3 load_generator.py monitor --host 192.168.1.50 --rate 20
+    python3 load_generator.py receiver --mix config=1,manual=4,duplicate=1 --json
+"""
+
+import argparse
+import collections
+import hashlib
+import hmac
+import http.client
+import json
+import math
+import random
+import socket
+import threading
+import time
+
+from duplicate_cache import IDEMPOTENCY_HEADER
+from wire_format import sample_config
+
+SECRET_KEY = "your-secret-key-here"  # Must match the receiver's SECRET_KEY
+CONTROLLER_STATS_ADDRESS = ("127.0.0.1", 8091)  # NOTIFY_PORT in traffic_controller.py
+CONTROLLER_SAMPLE_INTERVAL = 1.0  # seconds between controller stats samples
+REQUEST_TIMEOUT = 10  # seconds
+DEFAULT_MIX = {"config": 1, "manual": 3, "duplicate": 1}
+KINDS = ["config", "manual", "duplicate"]
+
+# Endpoints of each receiver; command is None where manual toggles are sent as pushes
+TARGETS = {
+    "ingest": {"port": 8080, "webhook": "/webhook", "command": "/command"},
+    "webhook_receiver": {"port": 8080, "webhook": "/", "command": None},
+    "monitor": {"port": 8080, "webhook": "/", "command": None},
+    "receiver": {"port": 8080, "webhook": "/webhook", "command": "/commands/batch"},
+}
+POLES = ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(math.ceil(fraction * len(sorted_values)) - 1, 0))]
+
+
+class PayloadFactory:
+    """Class to build the requests of each kind for one worker"""
+
+    def __init__(self, target, worker, secret_key=SECRET_KEY):
+        self.target = target
+        self.worker = worker
+        self.secret_key = secret_key
+        self.base = sample_config()
+        self.count = 0
+        self.last_push = None
+
+    def _signed(self, path, data, idempotency_key=None):
+        body = json.dumps(data, separators=(",", ":")).encode()
+        headers = {
+            "Content-Type": "application/json",
+            "X-Signature": hmac.new(self.secret_key.encode(), body, hashlib.sha256).hexdigest(),
+        }
+        if idempotency_key:
+            headers[IDEMPOTENCY_HEADER] = idempotency_key
+        return path, body, headers
+
+    def build(self, kind):
+        """Return (path, body, headers) for a request of the given kind"""
+        self.count += 1
+        if kind == "duplicate" and self.last_push:
+            return self.last_push
+
+        if kind == "manual":
+            pole = POLES[self.count % len(POLES)]
+            on = self.count % 2 == 0
+            command_path = self.target["command"]
+            if command_path == "/command":
+                return self._signed(command_path, {"target": f"P{pole}", "action": "red_on" if on else "red_off"})
+            if command_path:
+                command = {"target": f"P{pole}", "action": "red_on" if on else "red_off"}
+                return self._signed(command_path, {"id": f"load-{self.worker}-{self.count}", "commands": [command]})
+            return self._signed(self.target["webhook"], {
+                "manualcontrol_mode": True,
+                f"manual_control_pole_{pole}_red_light": on,
+                "timestamp": time.time(),
+            })
+
+        config = dict(self.base)
+        config["timestamp"] = time.time()
+        config["time_zone_number"] = self.count % 8 + 1
+        self.last_push = self._signed(self.target["webhook"], config, f"load-{self.worker}-{self.count}")
+        return self.last_push
+
+
+class ControllerSampler:
+    """Class to sample the traffic controller's stats in the background during a run"""
+
+    def __init__(self, address=CONTROLLER_STATS_ADDRESS, interval=CONTROLLER_SAMPLE_INTERVAL):
+        self.address = address
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.settimeout(0.5)
+
+    def sample(self):
+        try:
+            self._sock.sendto(json.dumps({"event": "stats"}).encode(), self.address)
+            data, _ = self._sock.recvfrom(65536)
+            self.samples.append(json.loads(data.decode()))
+        except (OSError, ValueError):
+            pass
+
+    def start(self):
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.sample()
+        self._sock.close()
+
+    def report(self):
+        """Summarize the change between the first and last samples"""
+        if len(self.samples) < 2:
+            return None
+        first, last = self.samples[0], self.samples[-1]
+        counts = [b - a for a, b in zip(first["jitterCounts"], last["jitterCounts"])]
+        bounds = [f"<{bound} ms" for bound in last["jitterBucketsMs"]] + [f">{last['jitterBucketsMs'][-1]} ms"]
+        total = sum(counts)
+
+        def bucket(fraction):
+            seen = 0
+            for label, count in zip(bounds, counts):
+                seen += count
+                if total and seen >= fraction * total:
+                    return label
+            return None
+
+        elapsed = last["time"] - first["time"]
+        return {
+            "samples": len(self.samples),
+            "ticksPerSecond": round((last["heartbeat"] - first["heartbeat"]) / elapsed, 1) if elapsed else None,
+            "sleeps": total,
+            "latenessP50": bucket(0.5),
+            "latenessP99": bucket(0.99),
+            "latenessP999": bucket(0.999),
+            "latenessWorst": next((label for label, count in reversed(list(zip(bounds, counts))) if count), None),
+            "stalls": last["stalls"] - first["stalls"],
+            "failSafe": any(sample["failSafe"] for sample in self.samples),
+        }
+
+
+class LoadGenerator:
+    """Class to drive one receiver with concurrent workers and collect latencies"""
+
+    def __init__(self, target, host="127.0.0.1", port=None, concurrency=4, duration=10.0, rate=None,
+                 mix=None, secret_key=SECRET_KEY, seed=0):
+        self.target = TARGETS[target] if isinstance(target, str) else target
+        self.target_name = target if isinstance(target, str) else "custom"
+        self.host = host
+        self.port = port or self.target["port"]
+        self.concurrency = concurrency
+        self.duration = duration
+        self.rate = rate
+        self.mix = mix or DEFAULT_MIX
+        self.secret_key = secret_key
+        self.seed = seed
+        self.latencies = {kind: [] for kind in KINDS}
+        self.errors = {kind: collections.Counter() for kind in KINDS}
+        self._lock = threading.Lock()
+        self.elapsed = None
+
+    def _worker(self, index, start, stop_at):
+        rng = random.Random(self.seed * 1000 + index)
+        kinds = [kind for kind in KINDS for _ in range(self.mix.get(kind, 0))]
+        payloads = PayloadFactory(self.target, index, self.secret_key)
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+        latencies = {kind: [] for kind in KINDS}
+        errors = {kind: collections.Counter() for kind in KINDS}
+        # With a rate, each worker sends every interval seconds, offset so workers interleave
+        interval = self.concurrency / self.rate if self.rate else None
+        due = start + (interval * index / self.concurrency if interval else 0)
+
+        while True:
+            if interval:
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if time.perf_counter() >= stop_at:
+                break
+            kind = rng.choice(kinds)
+            path, body, headers = payloads.build(kind)
+            sent = time.perf_counter()
+            try:
+                connection.request("POST", path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                if not 200 <= response.status < 300:
+                    errors[kind][str(response.status)] += 1
+            except (OSError, http.client.HTTPException) as e:
+                errors[kind][type(e).__name__] += 1
+                connection.close()
+            # Paced requests are timed from when they were due, not when they went out
+            latencies[kind].append(time.perf_counter() - (due if interval else sent))
+            if interval:
+                due += interval
+        connection.close()
+
+        with self._lock:
+            for kind in KINDS:
+                self.latencies[kind] += latencies[kind]
+                self.errors[kind].update(errors[kind])
+
+    def run(self):
+        """Run the load and return the report"""
+        sampler = ControllerSampler()
+        sampler.start()
+        start = time.perf_counter()
+        stop_at = start + self.duration
+        workers = [threading.Thread(target=self._worker, args=(index, start, stop_at), daemon=True)
+                   for index in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.elapsed = time.perf_counter() - start
+        sampler.stop()
+        return self.report(sampler.report())
+
+    def report(self, controller=None):
+        kinds = {}
+        every = []
+        all_errors = collections.Counter()
+        for kind in KINDS:
+            values = sorted(self.latencies[kind])
+            every += values
+            all_errors.update(self.errors[kind])
+            if values:
+                kinds[kind] = self._summary(values, self.errors[kind])
+        every.sort()
+        return {
+            "target": self.target_name,
+            "address": f"{self.host}:{self.port}",
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "seconds": round(self.elapsed, 3),
+            "kinds": kinds,
+            "all": self._summary(every, all_errors),
+            "controller": controller,
+        }
+
+    def _summary(self, values, errors):
+        failed = sum(errors.values())
+        return {
+            "requests": len(values),
+            "errors": failed,
+            "errorRate": round(failed / len(values), 4) if values else 0.0,
+            "perSecond": round(len(values) / self.elapsed, 1),
+            "p50Ms": round(percentile(values, 0.5) * 1000, 2) if values else None,
+            "p99Ms": round(percentile(values, 0.99) * 1000, 2) if values else None,
+            "p999Ms": round(percentile(values, 0.999) * 1000, 2) if values else None,
+            "maxMs": round(values[-1] * 1000, 2) if values else None,
+            "errorCounts": dict(errors),
+        }
+
+
+def print_report(report):
+    rate = f", paced at {report['rate']} req/s" if report["rate"] else ""
+    print(f"Target {report['target']} at {report['address']}: {report['concurrency']} workers, "
+          f"{report['seconds']:.1f}s{rate}")
+    print(f"{'kind':<11}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}{'max ms':>10}")
+    for name, summary in list(report["kinds"].items()) + [("all", report["all"])]:
+        print(f"{name:<11}{summary['requests']:>9}{summary['errors']:>8}{summary['perSecond']:>9}"
+              f"{summary['p50Ms']:>10}{summary['p99Ms']:>10}{summary['p999Ms']:>10}{summary['maxMs']:>10}")
+    if report["all"]["errorCounts"]:
+        print("Errors: " + ", ".join(f"{name} x{count}" for name, count in report["all"]["errorCounts"].items()))
+
+    controller = report["controller"]
+    if controller is None:
+        print("Controller: no stats (traffic_controller.py not running on this host?)")
+    else:
+        print(f"Controller: {controller['ticksPerSecond']} heartbeats/s, sleep lateness p50 {controller['latenessP50']}, "
+              f"p99 {controller['latenessP99']}, p999 {controller['latenessP999']}, "
+              f"worst {controller['latenessWorst']}, {controller['stalls']} stalls"
+              f"{', entered fail-safe' if controller['failSafe'] else ''}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown request kind: {kind}")
+        mix[kind] = int(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a traffic junction receiver with webhook traffic")
+    parser.add_argument("target", choices=sorted(TARGETS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--rate", type=float, help="total requests per second (default: as fast as possible)")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="e.g. config=1,manual=3,duplicate=1")
+    parser.add_argument("--secret", default=SECRET_KEY)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    generator = LoadGenerator(args.target, args.host, args.port, args.concurrency, args.duration, args.rate,
+                              args.mix, args.secret)
+    report = generator.run()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
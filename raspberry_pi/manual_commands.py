@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Manual Control Commands for Traffic Junction Control System
+
+Converts the Command objects sent by the web interface's CommunicationService
+({"target": "P1A", "action": "red_on", "value": ...}) into the
+manual_control_pole_<pole>_<signal>_light variables used by traffic_controller.py.
+
+Supported actions:
+    <signal>_on / <signal>_off     e.g. red_on, grnL_off, yel_blink_on
+    <signal> with a value          e.g. {"action": "grnS", "value": 1}
+    all_off                        turn every signal of the target pole off
+
+Signals: red, yel, grnL, grnS, grnR, yel_blink
+
+A batch ({"id": ..., "commands": [...]} or a bare list) is applied as one
+change: every command is validated first and the merged variables are written
+in a single lamp update and persisted once.
+"""
+
+POLES = ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]
+SIGNALS = ["red", "yel", "grnL", "grnS", "grnR", "yel_blink"]
+MAX_BATCH_SIZE = 256  # Every signal of every pole is 48 commands
+SAFE_STATES = {"red": True, "yel_blink": True, "grnL": False, "grnS": False, "grnR": False}
+
+
+class CommandError(ValueError):
+    """Raised when a command cannot be applied"""
+
+
+def manual_variable(pole, signal):
+    """Name of the variable holding one manual control signal"""
+    return f"manual_control_pole_{pole}_{signal}_light"
+
+
+def parse_target(target):
+    """Convert a target such as 'P1A' or '1A' to a pole name"""
+    pole = str(target or "").upper()
+    if pole.startswith("P"):
+        pole = pole[1:]
+    if pole not in POLES:
+        raise CommandError(f"Unknown target: {target}")
+    return pole
+
+
+def parse_value(value):
+    """Interpret a command value as on/off"""
+    if isinstance(value, str):
+        if value.lower() in ("1", "true", "on"):
+            return True
+        if value.lower() in ("0", "false", "off", ""):
+            return False
+        raise CommandError(f"Invalid value: {value}")
+    return bool(value)
+
+
+def command_to_variables(command):
+    """
+    Return the manual control variables a command sets.
+
+    Raises CommandError if the command is malformed.
+    """
+    if not isinstance(command, dict):
+        raise CommandError("Command must be an object")
+
+    pole = parse_target(command.get("target"))
+    action = str(command.get("action") or "")
+
+    if action == "all_off":
+        return {manual_variable(pole, signal): False for signal in SIGNALS}
+
+    if action.endswith("_on") or action.endswith("_off"):
+        signal, _, state = action.rpartition("_")
+        value = state == "on"
+    else:
+        signal = action
+        if "value" not in command:
+            raise CommandError(f"Action {action} needs a value")
+        value = parse_value(command["value"])
+
+    if signal not in SIGNALS:
+        raise CommandError(f"Unknown action: {action}")
+
+    return {manual_variable(pole, signal): value}
+
+
+def is_safety_command(command):
+    """
+    Whether a command only moves its pole towards a safe state: red or the
+    yellow flash on, or a green off. Batches made only of these (all-red,
+    flash) are served in the receivers' safety lane (see admission.py).
+    """
+    try:
+        changes = command_to_variables(command)
+    except CommandError:
+        return False
+    pole = parse_target(command.get("target"))
+    return all(SAFE_STATES.get(signal) is changes[manual_variable(pole, signal)]
+               for signal in SIGNALS if manual_variable(pole, signal) in changes)
+
+
+def commands_to_variables(commands):
+    """
+    Validate an ordered list of commands and merge the variables they set.
+
+    Later commands win. Nothing is returned unless every command is valid.
+    """
+    changes = {}
+    for index, command in enumerate(commands):
+        try:
+            changes.update(command_to_variables(command))
+        except CommandError as e:
+            raise CommandError(f"Command {index}: {e}")
+    return changes
+
+
+def parse_batch(data):
+    """
+    Extract the command list and batch id from a batch message.
+
+    Accepts {"id": ..., "commands": [...]} or a bare list of commands.
+    Returns (commands, batch_id).
+    """
+    if isinstance(data, list):
+        commands, batch_id = data, None
+    elif isinstance(data, dict) and isinstance(data.get("commands"), list):
+        commands, batch_id = data["commands"], data.get("id")
+    else:
+        raise CommandError("Batch must be a list of commands or an object with a commands list")
+    if not commands:
+        raise CommandError("Batch is empty")
+    if len(commands) > MAX_BATCH_SIZE:
+        raise CommandError(f"Batch has {len(commands)} commands, the limit is {MAX_BATCH_SIZE}")
+    return commands, batch_id
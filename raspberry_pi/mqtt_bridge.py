@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+MQTT Bridge for the Traffic Junction Ingest Service
+
+Subscribes to the command and configuration topics the web interface publishes
+to (CommunicationService uses "traffic/commands") with QoS 1 and a persistent
+session, so messages sent while the Pi is offline are queued by the broker and
+delivered on reconnect. Messages go through the same ingest path as webhooks:
+
+    traffic/commands            Command object, or a batch ({"commands": [...]} or a list)
+    traffic/config              full configuration payload
+    traffic/commands/response   acknowledgement of each command message
+    traffic/status              lamp frames and status changes (retained)
+
+QoS 1 is at-least-once, so redelivered messages are expected: configuration
+payloads are absorbed by the ingest service's duplicate cache, and manual
+commands set absolute lamp states, so applying one twice is harmless.
+
+paho-mqtt is optional; LocalBroker is an in-process stand-in for development,
+testing and fan-out measurements.
+
+Usage:
+    python3 mqtt_bridge.py --bench-fanout [junctions]
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+
+from manual_commands import CommandError, parse_batch
+
+# Try to import paho-mqtt, but provide a local stand-in if not available (for development)
+try:
+    import paho.mqtt.client as mqtt
+    MQTT_AVAILABLE = True
+except ImportError:
+    mqtt = None
+    MQTT_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MQTT_BROKER_HOST = "192.168.1.100"
+MQTT_BROKER_PORT = 1883
+MQTT_KEEPALIVE = 30  # seconds
+MQTT_QOS = 1
+MQTT_MAX_QUEUED = 1000  # Outgoing messages kept while disconnected
+COMMAND_TOPIC = "traffic/commands"
+CONFIG_TOPIC = "traffic/config"
+RESPONSE_TOPIC = "traffic/commands/response"
+STATUS_TOPIC = "traffic/status"
+
+
+class LocalBroker:
+    """In-process stand-in for an MQTT broker with QoS 1 persistent sessions"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sessions = {}  # client_id -> {"topics": set, "queue": list, "client": LocalClient or None}
+        self.retained = {}
+        self.delivered = 0
+
+    def client(self, client_id):
+        return LocalClient(self, client_id)
+
+    def _connect(self, client, clean_session):
+        with self._lock:
+            session = self.sessions.get(client.client_id)
+            if session is None or clean_session:
+                session = {"topics": set(), "queue": [], "client": None}
+                self.sessions[client.client_id] = session
+            session["client"] = client
+            pending, session["queue"] = session["queue"], []
+        for topic, payload in pending:
+            self._deliver(client, topic, payload)
+
+    def _disconnect(self, client):
+        with self._lock:
+            session = self.sessions.get(client.client_id)
+            if session and session["client"] is client:
+                session["client"] = None
+
+    def _subscribe(self, client, topic):
+        with self._lock:
+            self.sessions[client.client_id]["topics"].add(topic)
+            retained = self.retained.get(topic)
+        if retained is not None:
+            self._deliver(client, topic, retained)
+
+    def publish(self, topic, payload, retain=False):
+        """Deliver to connected subscribers and queue for offline persistent sessions"""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        targets = []
+        with self._lock:
+            if retain:
+                self.retained[topic] = payload
+            for session in self.sessions.values():
+                if topic in session["topics"]:
+                    if session["client"] is None:
+                        session["queue"].append((topic, payload))
+                    else:
+                        targets.append(session["client"])
+        for client in targets:
+            self._deliver(client, topic, payload)
+
+    def _deliver(self, client, topic, payload):
+        self.delivered += 1
+        if client.on_message:
+            client.on_message(client, None, LocalMessage(topic, payload))
+
+
+class LocalMessage:
+    """Class matching the attributes of paho's MQTTMessage that the bridge uses"""
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+        self.qos = MQTT_QOS
+
+
+class LocalClient:
+    """Class implementing the subset of paho's Client interface the bridge uses"""
+
+    def __init__(self, broker, client_id):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self.clean_session = False
+
+    def max_queued_messages_set(self, count):
+        pass
+
+    def connect(self, host=None, port=None, keepalive=None):
+        self.broker._connect(self, self.clean_session)
+        if self.on_connect:
+            self.on_connect(self, None, {"session present": 1}, 0)
+
+    def disconnect(self):
+        self.broker._disconnect(self)
+        if self.on_disconnect:
+            self.on_disconnect(self, None, 0)
+
+    def subscribe(self, topic, qos=0):
+        self.broker._subscribe(self, topic)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.broker.publish(topic, payload, retain=retain)
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+
+class MqttBridge:
+    """Class connecting the ingest service to an MQTT broker"""
+
+    def __init__(self, service, junction_id, client=None, broadcaster=None):
+        self.service = service
+        self.junction_id = junction_id
+        self.broadcaster = broadcaster
+        self.received = 0
+        self.errors = 0
+
+        if client is None:
+            if not MQTT_AVAILABLE:
+                raise RuntimeError("paho-mqtt is not installed")
+            # A fixed client id with clean_session=False keeps the broker-side
+            # session, so QoS 1 messages published while offline are delivered later
+            client = mqtt.Client(client_id=f"traffic-{junction_id}", clean_session=False)
+        self.client = client
+        self.client.max_queued_messages_set(MQTT_MAX_QUEUED)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+
+    def start(self, host=MQTT_BROKER_HOST, port=MQTT_BROKER_PORT):
+        """Connect and start forwarding messages in the background"""
+        self.client.connect(host, port, MQTT_KEEPALIVE)
+        self.client.loop_start()
+        if self.broadcaster:
+            threading.Thread(target=self._forward_status, daemon=True).start()
+        logger.info(f"MQTT bridge connecting to {host}:{port} as junction {self.junction_id}")
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            logger.error(f"MQTT connection refused with code {rc}")
+            return
+        # Subscriptions are renewed on every connect; the persistent session keeps the queue
+        client.subscribe(COMMAND_TOPIC, qos=MQTT_QOS)
+        client.subscribe(CONFIG_TOPIC, qos=MQTT_QOS)
+        logger.info("MQTT bridge connected and subscribed")
+
+    def _on_message(self, client, userdata, message):
+        self.received += 1
+        try:
+            if message.topic == CONFIG_TOPIC:
+                status_code, response = self.service.ingest(message.payload)
+            elif message.topic == COMMAND_TOPIC:
+                data = json.loads(message.payload.decode())
+                batch_id = data.get("id") if isinstance(data, dict) else None
+                try:
+                    if isinstance(data, list) or (isinstance(data, dict) and "commands" in data):
+                        commands, batch_id = parse_batch(data)
+                    else:
+                        commands = [data]
+                    status_code, response = self.service.apply_commands(commands)
+                except CommandError as e:
+                    status_code, response = 400, {"status": "error", "error": str(e)}
+                response["id"] = batch_id
+                response["junction"] = self.junction_id
+                client.publish(RESPONSE_TOPIC, json.dumps(response), qos=MQTT_QOS)
+            else:
+                return
+            if status_code != 200:
+                self.errors += 1
+                logger.warning(f"MQTT message on {message.topic} rejected: {response.get('error', response.get('status'))}")
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error handling MQTT message on {message.topic}: {e}")
+
+    def _forward_status(self):
+        """Publish status changes and lamp frames from the broadcaster"""
+        subscriber = self.broadcaster.subscribe()
+        while True:
+            try:
+                event, body = subscriber.get(timeout=60)
+            except queue.Empty:
+                if not self.broadcaster.is_subscribed(subscriber):
+                    subscriber = self.broadcaster.subscribe()
+                continue
+            message = json.dumps({"junction": self.junction_id, "event": event, "data": json.loads(body)})
+            self.client.publish(STATUS_TOPIC, message, qos=MQTT_QOS, retain=True)
+
+
+def benchmark_fanout(junctions=50, rounds=20):
+    """
+    Compare delivering one configuration to many junctions through a single
+    broker publish with pushing it to each junction over HTTP, using
+    in-process stand-ins for the Pis.
+    """
+    import http.client
+    import os
+    import tempfile
+    from http.server import ThreadingHTTPServer
+
+    import ingest_service
+    from backup_store import BackupStore
+
+    work_dir = tempfile.mkdtemp(prefix="mqtt_bench_")
+    broker = LocalBroker()
+    services = []
+    for index in range(junctions):
+        state = ingest_service.ConfigState()
+        state.print_current_state = lambda: None
+        service = ingest_service.IngestService([
+            ingest_service.BackupSink(BackupStore(os.path.join(work_dir, f"junction_{index}"))),
+            ingest_service.StateMonitorSink(state),
+        ])
+        services.append(service)
+        MqttBridge(service, index, client=broker.client(f"junction-{index}")).start()
+
+    def payload(i):
+        return json.dumps({"controlMode": "auto", "time_zone_number": i % 8 + 1, "timestamp": i}).encode()
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        broker.publish(CONFIG_TOPIC, payload(i))
+    mqtt_elapsed = time.perf_counter() - start
+
+    # One HTTP server stands in for every Pi; the cost measured is the per-junction push
+    ingest_service.IngestHandler.service = services[0]
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ingest_service.IngestHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    host, port = httpd.server_address
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        for _ in range(junctions):
+            connection = http.client.HTTPConnection(host, port)
+            connection.request("POST", "/webhook", payload(rounds + i))
+            connection.getresponse().read()
+            connection.close()
+    http_elapsed = time.perf_counter() - start
+    httpd.shutdown()
+
+    print(f"{junctions} junctions, {rounds} updates")
+    # LocalBroker delivers synchronously, so the MQTT time includes every junction's ingest;
+    # with a real broker the sender only pays for the single publish
+    print(f"  MQTT:      1 publish per update, {mqtt_elapsed * 1000 / rounds:8.2f} ms including "
+          f"{broker.delivered // rounds} deliveries")
+    print(f"  HTTP push: {junctions} requests per update, {http_elapsed * 1000 / rounds:8.2f} ms from the sender")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-fanout":
+        benchmark_fanout(int(sys.argv[2]) if len(sys.argv) > 2 else 50)
+    else:
+        print(__doc__)
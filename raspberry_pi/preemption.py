@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Priority Preemption Requests for the Traffic Controller
+
+Emergency vehicles, a manual override from the operator and late-running
+transit can ask the junction for a route right now. Requests wait in a
+priority queue (emergency before manual before transit, then first come first
+served); the controller is woken the moment one arrives instead of finishing
+the route time it was sleeping through. It then:
+
+    1. clears the poles losing their green: the clearance route that follows
+       the running route in the compiled plan, or yellow then red on those
+       poles if the plan has none (clearance is never cut short)
+    2. holds the requested route for the request's hold time, or until it is
+       released; a higher-priority request takes over at once and the
+       interrupted one is queued again with the hold it had left
+    3. clears towards the route the cycle rejoins at: the clock's position for
+       a coordinated junction, the route after the interrupted one in auto
+       mode, and the first route of the plan in semi mode
+
+The time from a request arriving to its clearance starting is recorded per
+request and reported in the controller's stats.
+
+A running controller takes requests on its notify port:
+    {"event": "preempt", "id": "amb-7", "kind": "emergency", "route": 3, "hold": 20}
+    {"event": "release", "id": "amb-7"}
+and replies to a preempt once its clearance has started (or at once if it is
+rejected):
+    {"id": "amb-7", "clearanceStartedAt": 1700000000.123, "latencyMs": 0.4}
+
+Usage:
+    python3 preemption.py <kind> <route> [hold]
+    python3 preemption.py --release <id>
+    python3 preemption.py --bench [requests]
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+KINDS = ["emergency", "manual", "transit"]  # In priority order
+DEFAULT_HOLD = {"emergency": 30, "manual": 60, "transit": 10}  # seconds a route is held unless the request says
+MAX_HOLD = 300  # Longest hold a request may ask for (seconds)
+QUEUE_TIMEOUT = 120  # Requests still queued after this long are dropped (seconds)
+LATENCY_HISTORY = 100  # Clearance latencies kept for the stats
+CONTROLLER_ADDRESS = ("127.0.0.1", 8091)  # NOTIFY_PORT in traffic_controller.py
+REPLY_TIMEOUT = 2.0  # seconds the command line client waits for the clearance to start
+
+
+class PreemptionRequest:
+    """Class to hold one request for a route and when it was served"""
+
+    def __init__(self, request_id, kind, route, hold, received, on_clearance=None):
+        self.id = request_id
+        self.kind = kind
+        self.priority = KINDS.index(kind)
+        self.route = route
+        self.hold = hold
+        self.received = received  # clock() when the request arrived
+        self.on_clearance = on_clearance  # called with the request once its clearance starts
+        self.clearance_started = None
+        self.latency_ms = None
+        self.released = False
+
+    def summary(self):
+        return {"id": self.id, "kind": self.kind, "route": self.route, "hold": self.hold}
+
+
+class PreemptionQueue:
+    """Class to order preemption requests by priority and wake the control loop for them"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.wake = threading.Event()  # Set whenever a request arrives or is released
+        self.active = None  # The request whose route is being held
+        self._lock = threading.Lock()
+        self._heap = []
+        self._order = itertools.count()
+        self._ids = itertools.count(1)
+        self.latencies = []
+        self.served = {kind: 0 for kind in KINDS}
+        self.expired = 0
+
+    def request(self, route, kind="emergency", hold=None, request_id=None, on_clearance=None):
+        """Queue a request for a route; returns it. Raises ValueError for a bad kind, route or hold."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown preemption kind {kind!r}, expected one of {', '.join(KINDS)}")
+        if not isinstance(route, int) or isinstance(route, bool) or route <= 0:
+            raise ValueError(f"Route must be a positive route number, got {route!r}")
+        hold = DEFAULT_HOLD[kind] if hold is None else hold
+        if not isinstance(hold, (int, float)) or isinstance(hold, bool) or not 0 < hold <= MAX_HOLD:
+            raise ValueError(f"Hold must be between 0 and {MAX_HOLD} seconds, got {hold!r}")
+
+        with self._lock:
+            if request_id is None:
+                request_id = f"p{next(self._ids)}"
+            if self._find(request_id):
+                raise ValueError(f"Preemption {request_id} is already queued")
+            request = PreemptionRequest(request_id, kind, route, hold, self.clock(), on_clearance)
+            self._push(request)
+        logger.info(f"Preemption {request_id} queued: {kind} route {route} for {hold}s")
+        self.wake.set()
+        return request
+
+    def release(self, request_id):
+        """End a request's hold, or drop it from the queue; returns whether it was found"""
+        with self._lock:
+            request = self._find(request_id)
+            if request is None:
+                return False
+            request.released = True
+            if request is not self.active:
+                self._heap = [entry for entry in self._heap if entry[2] is not request]
+                heapq.heapify(self._heap)
+        logger.info(f"Preemption {request_id} released")
+        self.wake.set()
+        return True
+
+    def requeue(self, request, hold):
+        """Queue an interrupted request again with the hold it had left"""
+        with self._lock:
+            request.hold = hold
+            self._push(request)
+
+    def pop(self):
+        """The highest-priority request still wanted, or None; it becomes the active request"""
+        with self._lock:
+            self._expire()
+            # Made active under the lock, so a release arriving meanwhile always finds it
+            self.active = heapq.heappop(self._heap)[2] if self._heap else None
+            return self.active
+
+    def pending(self, priority=len(KINDS)):
+        """Whether a request of a higher priority (lower number) than given is queued"""
+        with self._lock:
+            return bool(self._heap) and self._heap[0][0] < priority
+
+    def clearance_started(self, request):
+        """Record how long the request waited for its clearance to start"""
+        if request.clearance_started is not None:
+            # Resuming after a higher-priority request: already counted
+            return
+        request.clearance_started = time.time()
+        request.latency_ms = (self.clock() - request.received) * 1000
+        with self._lock:
+            self.latencies = (self.latencies + [request.latency_ms])[-LATENCY_HISTORY:]
+            self.served[request.kind] += 1
+        logger.info(f"Preemption {request.id} clearance started {request.latency_ms:.1f} ms after the request")
+        if request.on_clearance:
+            try:
+                request.on_clearance(request)
+            except Exception as e:
+                logger.error(f"Error reporting preemption {request.id}: {e}")
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                "active": self.active.summary() if self.active else None,
+                "queued": [entry[2].summary() for entry in sorted(self._heap)],
+                "served": dict(self.served),
+                "expired": self.expired,
+                "latencyMs": {
+                    "last": round(self.latencies[-1], 3),
+                    "mean": round(sum(latencies) / len(latencies), 3),
+                    "max": round(latencies[-1], 3),
+                } if latencies else None,
+            }
+
+    def _push(self, request):
+        heapq.heappush(self._heap, (request.priority, next(self._order), request))
+
+    def _find(self, request_id):
+        if self.active is not None and self.active.id == request_id and not self.active.released:
+            return self.active
+        return next((entry[2] for entry in self._heap if entry[2].id == request_id), None)
+
+    def _expire(self):
+        now = self.clock()
+        # Requests already served once are resuming after a higher-priority one, not stale
+        stale = [entry for entry in self._heap
+                 if entry[2].clearance_started is None and now - entry[2].received > QUEUE_TIMEOUT]
+        if stale:
+            self.expired += len(stale)
+            self._heap = [entry for entry in self._heap if entry not in stale]
+            heapq.heapify(self._heap)
+            logger.warning(f"Dropped {len(stale)} preemption requests queued for over {QUEUE_TIMEOUT}s")
+
+
+def send_event(message, address=CONTROLLER_ADDRESS, timeout=REPLY_TIMEOUT):
+    """Send a preempt or release event to the controller; returns its reply, or None"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.settimeout(timeout)
+        sock.sendto(json.dumps(message).encode(), address)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            sock.settimeout(max(deadline - time.monotonic(), 0.001))
+            data, _ = sock.recvfrom(4096)
+            reply = json.loads(data.decode())
+            if reply.get("id") == message.get("id"):
+                return reply
+    except (socket.timeout, ConnectionRefusedError):
+        return None
+    finally:
+        sock.close()
+    return None
+
+
+def benchmark(requests=8, route_time=3, hold=0.5):
+    """
+    Preempt a live controller (mock GPIO, real clock) at random moments and
+    report the time from each request to its clearance, against the wait for
+    the end of the running route that a request used to have.
+    """
+    import contextlib
+    import io
+    import random
+
+    import traffic_controller
+    from timing_optimizer import route_row
+
+    matrix = []
+    for arm in ["1", "2", "3", "4"]:
+        poles = [arm + "A", arm + "B"]
+        matrix += [route_row(green_poles=poles), route_row(yellow_poles=poles)]
+    controller = traffic_controller.TrafficController()
+    controller.variables = {
+        "autocontrol_mode": True,
+        "route_matrix": matrix,
+        "route_sequence_1": [1, 2, 3, 4, 5, 6, 7, 8],
+        "pole_1A_red_time_time_zone_1": route_time,
+        "all_pole_yellow_time": 1,
+    }
+    controller._variables_changed = lambda: False
+    rng = random.Random(5)
+    served = []
+
+    # MockGPIO prints every pin change
+    with contextlib.redirect_stdout(io.StringIO()):
+        controller.start_control()
+        for _ in range(requests):
+            time.sleep(rng.uniform(1.0, route_time))
+            done = threading.Event()
+            request = controller.preemptions.request(rng.choice([1, 3, 5, 7]), rng.choice(KINDS), hold,
+                                                     on_clearance=lambda request: done.set())
+            done.wait(5)
+            served.append(request)
+            # Let it hold, clear back (a clearance route lasts one route time) and rejoin before the next one
+            time.sleep(hold + 2 * route_time + 0.5)
+        controller.stop_control()
+
+    latencies = sorted(request.latency_ms for request in served if request.latency_ms is not None)
+    print(f"{len(latencies)}/{requests} preemptions cleared {sum(latencies) / len(latencies):.2f} ms after the "
+          f"request on average (max {latencies[-1]:.2f} ms); waiting for the route to end took "
+          f"{(route_time + 0.1) / 2:.2f} s on average with {route_time} s routes")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 8)
+        return
+    if len(sys.argv) == 3 and sys.argv[1] == "--release":
+        reply = send_event({"event": "release", "id": sys.argv[2]})
+        print(json.dumps(reply) if reply else "No reply from the controller")
+        return
+    if len(sys.argv) in (3, 4) and sys.argv[1] in KINDS:
+        message = {"event": "preempt", "id": f"cli-{os.getpid()}", "kind": sys.argv[1], "route": int(sys.argv[2])}
+        if len(sys.argv) == 4:
+            message["hold"] = float(sys.argv[3])
+        started = time.monotonic()
+        reply = send_event(message)
+        if reply is None:
+            print("No reply from the controller (queued behind another request, or not running)")
+        else:
+            print(json.dumps(reply))
+            print(f"Round trip {(time.monotonic() - started) * 1000:.1f} ms")
+        return
+    print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
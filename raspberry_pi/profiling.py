@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+On-demand Profiling for Traffic Junction Processes
+
+Nothing runs until a session is requested, so it is safe to leave installed in
+production. A session lasts a given number of seconds and writes its results
+to PROFILE_DIR for offline analysis:
+
+    <name>-<time>.collapsed   stack samples of every thread, one
+                              "thread;outer;...;inner count" line per stack,
+                              ready for flamegraph.pl or speedscope
+    <name>-<time>.pstats      cProfile statistics (python3 -m pstats <file>)
+
+The stack sampler is a background thread reading sys._current_frames() every
+SAMPLE_INTERVAL, so its cost does not depend on how busy the process is.
+cProfile only sees threads that opt in: loop threads call checkpoint() on
+each iteration (one attribute check while idle) and request handlers run
+through call().
+
+Sessions are started with SIGUSR2 (install_signal_handler) or from code, for
+example the /profile endpoint of the ingest service:
+    profiler = Profiler("ingest_service")
+    profiler.start(seconds=10, mode="both")
+
+Usage:
+    kill -USR2 <pid>
+    curl -X POST 'http://127.0.0.1:8080/profile?seconds=30&mode=sample'
+    python3 profiling.py summary <file.pstats> [count]
+"""
+
+import cProfile
+import collections
+import json
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = "/home/pi/traffic_junction/profiles"
+DEFAULT_SECONDS = 10
+MAX_SECONDS = 300
+SAMPLE_INTERVAL = 0.01  # seconds between stack samples
+MODES = ("sample", "cprofile", "both")
+
+
+class StackSampler:
+    """Class to sample the stacks of all threads from a background thread"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """Class to run timed cProfile and stack sampling sessions on request"""
+
+    def __init__(self, name, output_dir=PROFILE_DIR):
+        self.name = name
+        self.output_dir = output_dir
+        self.last_result = None
+        self._lock = threading.Lock()
+        self._session = None
+        self._local = threading.local()
+
+    def start(self, seconds=DEFAULT_SECONDS, mode="both"):
+        """Begin a session; returns the files it will write"""
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        seconds = min(max(float(seconds), 0.1), MAX_SECONDS)
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"{self.name}-{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+        with self._lock:
+            if self._session is not None:
+                raise RuntimeError("A profiling session is already running")
+            session = {
+                "id": object(),
+                "mode": mode,
+                "seconds": seconds,
+                "deadline": time.monotonic() + seconds,
+                "profiles": [],
+                "sampler": None,
+                "files": {},
+            }
+            if mode in ("sample", "both"):
+                session["sampler"] = StackSampler()
+                session["sampler"].start()
+                session["files"]["collapsed"] = prefix + ".collapsed"
+            if mode in ("cprofile", "both"):
+                session["files"]["pstats"] = prefix + ".pstats"
+            self._session = session
+
+        threading.Thread(target=self._finish, args=(session,), name="profiler", daemon=True).start()
+        logger.info(f"Profiling {self.name} for {seconds:.1f}s ({mode})")
+        return {"mode": mode, "seconds": seconds, "files": session["files"]}
+
+    def running(self):
+        return self._session is not None
+
+    def checkpoint(self):
+        """Let a loop thread join or leave cProfile sessions; call once per iteration"""
+        session = self._session
+        current = getattr(self._local, "profile", None)
+        if session is None and current is None:
+            return
+        if current is not None:
+            profile, session_id = current
+            if session is None or session["id"] is not session_id or time.monotonic() >= session["deadline"]:
+                profile.disable()
+                self._local.profile = None
+                self._add_profile(session_id, profile)
+            return
+        if "pstats" in session["files"] and time.monotonic() < session["deadline"]:
+            profile = cProfile.Profile()
+            self._local.profile = (profile, session["id"])
+            profile.enable()
+
+    def call(self, function, *args, **kwargs):
+        """Run a function, under cProfile if a session wants it"""
+        session = self._session
+        if session is None or "pstats" not in session["files"] or getattr(self._local, "profile", None):
+            return function(*args, **kwargs)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            self._add_profile(session["id"], profile)
+
+    def _add_profile(self, session_id, profile):
+        with self._lock:
+            session = self._session
+            if session is not None and session["id"] is session_id:
+                session["profiles"].append(profile)
+
+    def _finish(self, session):
+        time.sleep(session["seconds"])
+        if session["sampler"]:
+            session["sampler"].stop()
+        # Give loop threads one more iteration to hand in their profiles
+        time.sleep(min(1.0, session["seconds"]))
+
+        with self._lock:
+            self._session = None
+            profiles = list(session["profiles"])
+
+        result = {"mode": session["mode"], "seconds": session["seconds"], "files": {}}
+        try:
+            if session["sampler"]:
+                session["sampler"].write(session["files"]["collapsed"])
+                result["files"]["collapsed"] = session["files"]["collapsed"]
+                result["samples"] = session["sampler"].samples
+            if "pstats" in session["files"]:
+                if profiles:
+                    stats = pstats.Stats(profiles[0])
+                    for profile in profiles[1:]:
+                        stats.add(profile)
+                    stats.dump_stats(session["files"]["pstats"])
+                    result["files"]["pstats"] = session["files"]["pstats"]
+                result["profiledCalls"] = len(profiles)
+            logger.info(f"Profiling of {self.name} finished: {result['files']}")
+        except Exception as e:
+            logger.error(f"Error writing profile: {e}")
+            result["error"] = str(e)
+        self.last_result = result
+
+    def status(self):
+        session = self._session
+        if session is None:
+            return {"running": False, "lastResult": self.last_result}
+        return {
+            "running": True,
+            "mode": session["mode"],
+            "remainingSeconds": round(max(session["deadline"] - time.monotonic(), 0.0), 1),
+            "files": session["files"],
+        }
+
+
+def install_signal_handler(profiler, signum=None, seconds=DEFAULT_SECONDS):
+    """Start a profiling session when the process receives SIGUSR2 (main thread only)"""
+    signum = signum or getattr(signal, "SIGUSR2", None)
+    if signum is None:
+        return False
+
+    def handler(received, frame):
+        try:
+            profiler.start(seconds=seconds)
+        except RuntimeError as e:
+            logger.warning(f"Profiling signal ignored: {e}")
+
+    try:
+        signal.signal(signum, handler)
+        return True
+    except ValueError:
+        # Not called from the main thread
+        return False
+
+
+def serve_profile_request(handler, profiler):
+    """Answer GET /profile (status) and POST /profile?seconds=N&mode=M, from the Pi itself only"""
+    if handler.client_address[0] not in ("127.0.0.1", "::1"):
+        status_code, response = 403, {"error": "Profiling can only be requested from the Pi itself"}
+    elif handler.command == "POST":
+        query = parse_qs(urlsplit(handler.path).query)
+        try:
+            status_code, response = 202, profiler.start(
+                seconds=query.get("seconds", [DEFAULT_SECONDS])[0],
+                mode=query.get("mode", ["both"])[0]
+            )
+        except ValueError as e:
+            status_code, response = 400, {"error": str(e)}
+        except RuntimeError as e:
+            status_code, response = 409, {"error": str(e)}
+    else:
+        status_code, response = 200, profiler.status()
+
+    body = json.dumps(response).encode()
+    handler.send_response(status_code)
+    handler.send_header('Content-type', 'application/json')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "summary":
+        count = int(sys.argv[3]) if len(sys.argv) > 3 else 25
+        pstats.Stats(sys.argv[2]).sort_stats("cumulative").print_stats(count)
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
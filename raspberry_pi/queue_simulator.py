@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Queue Micro-simulation for Scoring Traffic Junction Timing Plans
+
+Estimates how a timing plan would serve traffic before it is pushed to the
+junction. A plan is the cycle the controller would run for one time zone,
+compiled from route_matrix, route_sequence_<zone> and the zone's timing the
+same way _apply_route() uses them: each route lasts
+pole_1A_red_time_time_zone_<zone> seconds plus the control loop's pause, and an
+approach (pole) discharges while any of its green lamps is lit.
+
+Each approach is a fluid queue stepped once per second: vehicles arrive
+(Poisson, from a rate per approach in vehicles per hour) and leave at the
+saturation flow while the approach has green. The same arrivals are used for
+every plan, so differences between plans are down to the plans. Per plan:
+
+    delay          average delay per arriving vehicle (seconds)
+    meanQueue      vehicles waiting at the junction, averaged over the period
+    maxQueue       longest queue on any approach (vehicles)
+    throughput     vehicles served per hour
+    leftOver       vehicles still queued at the end of the period
+    approachDelay  average delay per vehicle for each approach (seconds)
+
+With NumPy installed a batch of plans is simulated as one set of arrays
+(a batch of thousands of plans takes seconds); without it each plan is
+stepped in plain Python. Either way, on a Pi with more than one core the
+plans can be split over a process pool, one slice per worker.
+
+Usage:
+    scores = score_plans(plans, {"1A": 600, "2A": 450, ...})
+    python3 queue_simulator.py <config.json> <rates.json> [zone]
+    python3 queue_simulator.py --bench [plans]
+"""
+
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from traffic_json_receiver import process_json_data
+
+# Try to import NumPy, but fall back to plain Python if not available (it is not on every Pi image)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+APPROACHES = ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]
+LIGHTS_PER_POLE = 6  # red, yellow, greenLeft, greenStraight, greenRight, GA in a route matrix row
+GREEN_LIGHTS = [2, 3, 4]  # greenLeft, greenStraight, greenRight
+DEFAULT_ROUTE_TIME = 5  # seconds; what the controller uses when the zone has no timing
+LOOP_PAUSE = 0.1  # The control loop's pause after each route (seconds)
+SATURATION_FLOW = 1800  # vehicles per hour of green per approach
+SIMULATION_PERIOD = 3600  # seconds
+SIMULATION_STEP = 1.0  # seconds
+BATCH_SIZE = 1000  # plans simulated together
+SEARCH_TIMINGS = range(3, 61)  # route times (seconds) tried by candidate_plans()
+
+
+def _route_greens(row, previous):
+    """Green approaches of a route matrix row; lamps a short row does not set keep their state"""
+    greens = list(previous)
+    for pole_index in range(len(APPROACHES)):
+        base = pole_index * LIGHTS_PER_POLE
+        if base + GREEN_LIGHTS[-1] < len(row):
+            greens[pole_index] = any(row[base + light] for light in GREEN_LIGHTS)
+    return tuple(greens)
+
+
+def compile_plan(variables, zone=1, sequence=None, route_time=None, coordinated=None):
+    """
+    Compile the cycle the controller runs for a time zone into phases of
+    (seconds, green per approach). The sequence and route time default to
+    the zone's own; pass them to build a candidate plan.
+
+    A coordinated junction (coordination_enabled, or coordinated=True) runs
+    each route for exactly the route time and skips invalid routes outright.
+    """
+    if coordinated is None:
+        coordinated = variables.get("coordination_enabled", False)
+    pause = 0 if coordinated else LOOP_PAUSE
+    if sequence is None:
+        sequence = variables.get(f"route_sequence_{zone}", [])
+    if route_time is None:
+        route_time = variables.get(f"pole_1A_red_time_time_zone_{zone}", DEFAULT_ROUTE_TIME)
+    route_matrix = variables.get("route_matrix", [])
+
+    # Lamps carry over from the end of the previous cycle, so compile it twice and keep the second pass
+    greens = (False,) * len(APPROACHES)
+    phases = []
+    for _ in range(2):
+        phases = []
+        for route in sequence:
+            if route <= 0 or route > len(route_matrix):
+                # The controller skips invalid routes; only the loop pause passes
+                if pause:
+                    phases.append((pause, greens))
+                continue
+            greens = _route_greens(route_matrix[route - 1], greens)
+            phases.append((route_time + pause, greens))
+
+    return {
+        "zone": zone,
+        "sequence": list(sequence),
+        "routeTime": route_time,
+        "cycle": round(sum(seconds for seconds, _ in phases), 1),
+        "phases": phases,
+    }
+
+
+def candidate_plans(variables, zone=1, timings=SEARCH_TIMINGS):
+    """
+    Candidate plans for a zone: every route sequence in the configuration,
+    and the zone's sequence with each route given a second slot, at each route time.
+    """
+    own = list(variables.get(f"route_sequence_{zone}", []))
+    sequences = [own]
+    for key, value in variables.items():
+        if key.startswith("route_sequence_") and isinstance(value, list) and value and value not in sequences:
+            sequences.append(list(value))
+    for index in range(len(own)):
+        longer = own[:index + 1] + own[index:]
+        if longer not in sequences:
+            sequences.append(longer)
+
+    return [compile_plan(variables, zone, sequence, route_time)
+            for route_time in timings for sequence in sequences if sequence]
+
+
+def _poisson(rng, mean):
+    # Knuth's method; the means here are a fraction of a vehicle per step
+    limit = math.exp(-mean)
+    count = 0
+    product = rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def arrival_counts(rates, period=SIMULATION_PERIOD, step=SIMULATION_STEP, seed=1):
+    """Vehicles arriving per step and approach, from rates in vehicles per hour"""
+    rng = random.Random(seed)
+    means = [rates.get(pole, 0) * step / 3600 for pole in APPROACHES]
+    return [[_poisson(rng, mean) if mean > 0 else 0 for mean in means]
+            for _ in range(int(period / step))]
+
+
+def _green_steps(plan, step):
+    """Green per approach for each step of the plan's cycle"""
+    steps = []
+    elapsed = 0.0
+    for seconds, greens in plan["phases"]:
+        # Phase ends are rounded rather than phase lengths, so the loop pauses add up to the plan's cycle
+        elapsed += seconds
+        steps += [greens] * (int(round(elapsed / step)) - len(steps))
+    return steps or [(False,) * len(APPROACHES)]
+
+
+def _simulate_python(plans, arrivals, capacity, step):
+    totals = []
+    for plan in plans:
+        cycle = _green_steps(plan, step)
+        queue = [0.0] * len(APPROACHES)
+        delay = [0.0] * len(APPROACHES)
+        departed = [0.0] * len(APPROACHES)
+        peak = 0.0
+        for index, arrived in enumerate(arrivals):
+            greens = cycle[index % len(cycle)]
+            for approach in range(len(APPROACHES)):
+                waiting = queue[approach] + arrived[approach]
+                if greens[approach]:
+                    served = min(waiting, capacity[approach])
+                    waiting -= served
+                    departed[approach] += served
+                queue[approach] = waiting
+                delay[approach] += waiting * step
+                if waiting > peak:
+                    peak = waiting
+        totals.append((delay, departed, queue, peak))
+    return totals
+
+
+def _simulate_numpy(plans, arrivals, capacity, step):
+    cycles = [_green_steps(plan, step) for plan in plans]
+    lengths = np.array([len(cycle) for cycle in cycles])
+    green = np.zeros((len(plans), lengths.max(), len(APPROACHES)), dtype=bool)
+    for index, cycle in enumerate(cycles):
+        green[index, :len(cycle)] = cycle
+
+    arrivals = np.asarray(arrivals, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+    rows = np.arange(len(plans))
+    queue = np.zeros((len(plans), len(APPROACHES)))
+    delay = np.zeros_like(queue)
+    departed = np.zeros_like(queue)
+    peak = np.zeros(len(plans))
+    served = np.empty_like(queue)
+    for index, arrived in enumerate(arrivals):
+        queue += arrived
+        np.minimum(queue, capacity * green[rows, index % lengths], out=served)
+        queue -= served
+        departed += served
+        delay += queue
+        np.maximum(peak, queue.max(axis=1), out=peak)
+    delay *= step
+    return [(delay[index].tolist(), departed[index].tolist(), queue[index].tolist(), float(peak[index]))
+            for index in range(len(plans))]
+
+
+def _simulate_plans(plans, arrivals, capacity, step, use_numpy):
+    """Simulate plans BATCH_SIZE at a time"""
+    simulate = _simulate_numpy if use_numpy else _simulate_python
+    return [total for index in range(0, len(plans), BATCH_SIZE)
+            for total in simulate(plans[index:index + BATCH_SIZE], arrivals, capacity, step)]
+
+
+# Arrivals and settings shared by every slice a pool worker simulates, sent once per worker
+_worker_inputs = None
+
+
+def _init_worker(arrivals, capacity, step, use_numpy):
+    global _worker_inputs
+    _worker_inputs = (arrivals, capacity, step, use_numpy)
+
+
+def _simulate_slice(plans):
+    return _simulate_plans(plans, *_worker_inputs)
+
+
+def usable_cpus():
+    """CPUs this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def score_plans(plans, rates, period=SIMULATION_PERIOD, step=SIMULATION_STEP, saturation=None,
+                seed=1, workers=None, use_numpy=None):
+    """
+    Simulate each plan against the same arrivals and return one score dict per plan.
+
+    rates and saturation map approaches to vehicles per hour; saturation
+    defaults to SATURATION_FLOW. With workers > 1 the plans are split into
+    one slice per worker and run in a process pool; workers is capped at the
+    usable CPUs, so on a single core everything runs in this process.
+    """
+    use_numpy = NUMPY_AVAILABLE if use_numpy is None else use_numpy and NUMPY_AVAILABLE
+    saturation = saturation or {}
+    capacity = [saturation.get(pole, SATURATION_FLOW) * step / 3600 for pole in APPROACHES]
+    arrivals = arrival_counts(rates, period, step, seed)
+    arrived = [sum(counts[approach] for counts in arrivals) for approach in range(len(APPROACHES))]
+
+    workers = min(workers or 1, usable_cpus(), len(plans))
+    if workers > 1:
+        size = math.ceil(len(plans) / workers)
+        slices = [plans[index:index + size] for index in range(0, len(plans), size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(arrivals, capacity, step, use_numpy)) as pool:
+            totals = [total for part in pool.map(_simulate_slice, slices) for total in part]
+    else:
+        totals = _simulate_plans(plans, arrivals, capacity, step, use_numpy)
+
+    hours = len(arrivals) * step / 3600
+    scores = []
+    for delay, departed, queue, peak in totals:
+        scores.append({
+            "delay": round(sum(delay) / max(sum(arrived), 1), 2),
+            "meanQueue": round(sum(delay) / (len(arrivals) * step), 2),
+            "maxQueue": round(peak, 1),
+            "throughput": round(sum(departed) / hours, 1),
+            "leftOver": round(sum(queue), 1),
+            "approachDelay": {pole: round(delay[index] / arrived[index], 2)
+                              for index, pole in enumerate(APPROACHES) if arrived[index]},
+        })
+    return scores
+
+
+def best_plans(plans, scores, count=5):
+    """The plans with the lowest average delay, best first"""
+    ranked = sorted(range(len(plans)), key=lambda index: (scores[index]["delay"], scores[index]["leftOver"]))
+    return [(plans[index], scores[index]) for index in ranked[:count]]
+
+
+def _describe(plan, score):
+    return (f"route time {plan['routeTime']:>3}s, cycle {plan['cycle']:>4}s, sequence {plan['sequence']}: "
+            f"delay {score['delay']}s, mean queue {score['meanQueue']}, max queue {score['maxQueue']}, "
+            f"{score['throughput']} veh/h, {score['leftOver']} left over")
+
+
+def benchmark(count=5000):
+    """Time scoring a batch of random plans, vectorised and in plain Python"""
+    from wire_format import sample_config
+
+    variables = process_json_data(sample_config())
+    rng = random.Random(7)
+    plans = [compile_plan(variables, 1, rng.sample(range(1, 15), rng.randint(4, 14)), rng.randint(3, 60))
+             for _ in range(count)]
+    rates = {pole: 300 + 60 * index for index, pole in enumerate(APPROACHES)}
+
+    workers = min(4, usable_cpus())
+    runs = [("plain Python", False, None, plans[:400])]
+    if workers > 1:
+        runs += [(f"plain Python, {workers} processes", False, workers, plans[:400])]
+    if NUMPY_AVAILABLE:
+        runs += [("NumPy", True, None, plans)]
+        if workers > 1:
+            runs += [(f"NumPy, {workers} processes", True, workers, plans)]
+    else:
+        print("NumPy is not installed; timing plain Python only")
+    if workers == 1:
+        print("Only one CPU is usable; the process pool is not timed")
+    for name, use_numpy, workers, batch in runs:
+        start = time.perf_counter()
+        score_plans(batch, rates, workers=workers, use_numpy=use_numpy)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<28}{len(batch):>6} plans {elapsed:8.2f} s {len(batch) / elapsed:10.0f} plans/s")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 5000)
+        return
+    if len(sys.argv) < 3:
+        print(__doc__)
+        return
+    with open(sys.argv[1]) as f:
+        variables = process_json_data(json.load(f))
+    with open(sys.argv[2]) as f:
+        rates = json.load(f)
+    if variables is None:
+        print("Configuration could not be converted to variables")
+        sys.exit(1)
+    zone = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+
+    current = compile_plan(variables, zone)
+    plans = [current] + candidate_plans(variables, zone)
+    start = time.perf_counter()
+    scores = score_plans(plans, rates, workers=4)
+    elapsed = time.perf_counter() - start
+
+    print(f"Scored {len(plans)} plans for time zone {zone} in {elapsed:.2f} s")
+    print(f"current   {_describe(current, scores[0])}")
+    for rank, (plan, score) in enumerate(best_plans(plans[1:], scores[1:]), 1):
+        print(f"#{rank:<8} {_describe(plan, score)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Real-time Execution for the Traffic Controller's Timing Thread
+
+Opt-in (traffic_controller.py --realtime, or REALTIME_MODE) settings that keep
+the light-timing thread waking on time while the Pi is busy with logging,
+HTTP ingest and Python's own garbage collector:
+
+    - SCHED_FIFO for the control thread, so it runs the moment its sleep ends
+      instead of waiting for a time slice. The watchdog thread gets one
+      priority step more, so it can still flash yellow if the control loop
+      ever spins. The kernel's RT throttling (sched_rt_runtime_us) leaves the
+      rest of the system 5% of the CPU even then.
+    - Pinning the control thread to one CPU (the last, which on a multi-core
+      Pi can be kept free of other work with isolcpus=3 on the kernel
+      command line), so it never migrates between caches.
+    - mlockall(), so no page the controller uses is swapped out or faulted in
+      on the SD card at a lamp change.
+    - A short GIL switch interval, so a busy Python thread hands over the
+      interpreter within half a millisecond rather than five.
+    - GCScheduler: everything allocated at startup is frozen out of the
+      collector and automatic collection is switched off; the young
+      generation is collected by the control loop in the slack before its
+      next deadline instead, with a full collection every so often.
+
+Each step needs privileges (CAP_SYS_NICE and CAP_IPC_LOCK, or running as
+root; LimitRTPRIO=99 and LimitMEMLOCK=infinity in a systemd unit). A step that
+is not permitted is logged and skipped; the controller keeps running.
+
+Usage:
+    status = enable_realtime(priority=50)  # from the thread to boost
+    gc_scheduler = GCScheduler()
+    gc_scheduler.start()
+    gc_scheduler.idle(seconds_to_next_deadline)  # from the control loop
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+MCL_CURRENT = 1  # mlockall() flags from <sys/mman.h> on Linux
+MCL_FUTURE = 2
+SWITCH_INTERVAL = 0.0005  # seconds a Python thread may hold the GIL while others wait
+GC_YOUNG_THRESHOLD = 700  # Allocations before the young generation is collected (CPython's default)
+GC_FULL_EVERY = 100  # Young collections between full collections
+GC_MIN_SLACK = 0.02  # Shortest slack before a deadline that a young collection may use (seconds)
+GC_FULL_MIN_SLACK = 0.05  # Shortest slack a full collection may use (seconds)
+
+
+def set_fifo(priority):
+    """Run the calling thread under SCHED_FIFO at a priority (1-99); returns whether it was allowed"""
+    try:
+        # On Linux, pid 0 is the calling thread
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        return True
+    except (AttributeError, OSError) as e:
+        logger.warning(f"SCHED_FIFO priority {priority} not available: {e}")
+        return False
+
+
+def pin_to_cpu(cpu=None):
+    """Pin the calling thread to one CPU (default: the last); returns the CPU, or None"""
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+        cpu = cpus[-1] if cpu is None else cpu
+        os.sched_setaffinity(0, {cpu})
+        return cpu
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Could not pin the control thread to CPU {cpu}: {e}")
+        return None
+
+
+def lock_memory():
+    """Lock every current and future page of the process in RAM; returns whether it was allowed"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        return True
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Could not lock memory: {e}")
+        return False
+
+
+def enable_realtime(priority, cpu=None, switch_interval=SWITCH_INTERVAL):
+    """
+    Apply the real-time settings to the calling thread (scheduling and
+    affinity) and the process (memory lock, GIL switch interval). Returns
+    what took effect, for the controller's stats.
+    """
+    status = {
+        "fifoPriority": priority if set_fifo(priority) else None,
+        "cpu": pin_to_cpu(cpu),
+        "memoryLocked": lock_memory(),
+        "switchInterval": switch_interval,
+    }
+    sys.setswitchinterval(switch_interval)
+    logger.info(f"Real-time mode: {status}")
+    return status
+
+
+class GCScheduler:
+    """Class to run garbage collection in the control loop's slack instead of whenever allocations trigger it"""
+
+    def __init__(self, young_threshold=GC_YOUNG_THRESHOLD, full_every=GC_FULL_EVERY):
+        self.young_threshold = young_threshold
+        self.full_every = full_every
+        self.young = 0
+        self.full = 0
+        self.max_young_ms = 0.0
+        self.max_full_ms = 0.0
+        self.frozen = 0
+
+    def start(self):
+        """Collect once, move what survives out of the collector's reach and stop automatic collection"""
+        gc.collect()
+        gc.freeze()
+        self.frozen = gc.get_freeze_count()
+        gc.disable()
+        logger.info(f"Garbage collection runs between phases ({self.frozen} startup objects frozen)")
+
+    def stop(self):
+        gc.unfreeze()
+        gc.enable()
+
+    def idle(self, slack):
+        """Collect if enough was allocated and the next deadline is at least slack seconds away"""
+        if slack < GC_MIN_SLACK or gc.get_count()[0] < self.young_threshold:
+            return
+        started = time.perf_counter()
+        if self.young and self.young % self.full_every == 0 and slack >= GC_FULL_MIN_SLACK:
+            gc.collect()
+            self.full += 1
+            self.max_full_ms = max(self.max_full_ms, (time.perf_counter() - started) * 1000)
+        else:
+            gc.collect(0)
+            self.max_young_ms = max(self.max_young_ms, (time.perf_counter() - started) * 1000)
+        self.young += 1
+
+    def stats(self):
+        return {
+            "frozen": self.frozen,
+            "youngCollections": self.young,
+            "fullCollections": self.full,
+            "maxYoungMs": round(self.max_young_ms, 3),
+            "maxFullMs": round(self.max_full_ms, 3),
+        }
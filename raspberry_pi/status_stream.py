@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Status Stream for Traffic Junction Receivers
+
+Keeps the latest /status body pre-serialized together with an ETag, so polling
+clients are answered from memory (or with 304 Not Modified), and pushes every
+status change and lamp frame to Server-Sent Events subscribers as it happens.
+
+Usage from a BaseHTTPRequestHandler:
+    if self.path == '/status':
+        serve_cached_status(self, broadcaster)
+    elif self.path == '/events':
+        serve_event_stream(self, broadcaster)
+"""
+
+import hashlib
+import json
+import logging
+import queue
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+FRAME_LISTEN_ADDRESS = ("127.0.0.1", 8092)  # Matches FRAME_PUBLISH_ADDRESS in traffic_controller.py
+KEEPALIVE_INTERVAL = 15  # seconds between SSE comments on an idle stream
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class StatusBroadcaster:
+    """Class to cache the serialized status and fan events out to subscribers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._status_body = b"{}"
+        self._status_etag = '"0"'
+        self._last_frame = None
+
+    def set_status(self, status):
+        """Replace the status; subscribers are only notified when it changed"""
+        body = json.dumps(status, sort_keys=True).encode()
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        with self._lock:
+            if etag == self._status_etag:
+                return False
+            self._status_body = body
+            self._status_etag = etag
+        self._publish("status", body)
+        return True
+
+    def publish_frame(self, frame):
+        """Push a lamp frame to subscribers if it differs from the last one"""
+        body = json.dumps(frame, sort_keys=True).encode()
+        with self._lock:
+            if body == self._last_frame:
+                return False
+            self._last_frame = body
+        self._publish("frame", body)
+        return True
+
+    def snapshot(self):
+        """Return the cached (body, etag) for the current status"""
+        with self._lock:
+            return self._status_body, self._status_etag
+
+    def subscribe(self):
+        """Register a subscriber queue primed with the current status"""
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            subscriber.put(("status", self._status_body))
+            if self._last_frame is not None:
+                subscriber.put(("frame", self._last_frame))
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def is_subscribed(self, subscriber):
+        with self._lock:
+            return subscriber in self._subscribers
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _publish(self, event, body):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, body))
+            except queue.Full:
+                # A stalled client must never block the publisher; it is dropped
+                logger.warning("Dropping status stream subscriber with a full queue")
+                self.unsubscribe(subscriber)
+
+
+def serve_cached_status(handler, broadcaster):
+    """Answer GET /status from the cached body, honouring If-None-Match"""
+    body, etag = broadcaster.snapshot()
+    if handler.headers.get('If-None-Match') == etag:
+        handler.send_response(304)
+        handler.send_header('ETag', etag)
+        handler.send_header('Access-Control-Allow-Origin', '*')
+        handler.send_header('Access-Control-Expose-Headers', 'ETag')
+        handler.end_headers()
+        return
+
+    handler.send_response(200)
+    handler.send_header('Content-type', 'application/json')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.send_header('ETag', etag)
+    handler.send_header('Access-Control-Allow-Origin', '*')
+    handler.send_header('Access-Control-Expose-Headers', 'ETag')
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def serve_event_stream(handler, broadcaster):
+    """Stream status and frame events to one client until it disconnects"""
+    handler.send_response(200)
+    handler.send_header('Content-type', 'text/event-stream')
+    handler.send_header('Cache-Control', 'no-cache')
+    handler.send_header('Connection', 'keep-alive')
+    handler.send_header('Access-Control-Allow-Origin', '*')
+    handler.end_headers()
+
+    subscriber = broadcaster.subscribe()
+    try:
+        while True:
+            try:
+                event, body = subscriber.get(timeout=KEEPALIVE_INTERVAL)
+                handler.wfile.write(b"event: " + event.encode() + b"\ndata: " + body + b"\n\n")
+            except queue.Empty:
+                if not broadcaster.is_subscribed(subscriber):
+                    break
+                handler.wfile.write(b": keepalive\n\n")
+            handler.wfile.flush()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+def start_frame_listener(broadcaster, address=FRAME_LISTEN_ADDRESS, on_frame=None):
+    """Forward lamp frames announced by traffic_controller.py to the broadcaster (and on_frame)"""
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(address)
+    except OSError as e:
+        logger.warning(f"Lamp frames unavailable on {address[0]}:{address[1]}: {e}")
+        return None
+
+    def listen():
+        while True:
+            try:
+                data, _ = sock.recvfrom(4096)
+                frame = json.loads(data.decode())
+                broadcaster.publish_frame(frame)
+                if on_frame:
+                    on_frame(frame)
+            except Exception as e:
+                logger.error(f"Error reading lamp frame: {e}")
+
+    thread = threading.Thread(target=listen, daemon=True)
+    thread.start()
+    return thread
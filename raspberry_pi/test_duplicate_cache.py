@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Tests for duplicate_cache.py
+
+Usage:
+python3 -m unittest test_duplicate_cache
+"""
+
+import unittest
+
+from duplicate_cache import DuplicateCache
+
+CONFIG_A = b'{"time_zone_number": 1}'
+CONFIG_B = b'{"time_zone_number": 2}'
+
+
+class DuplicateCacheTest(unittest.TestCase):
+
+    def test_repeat_of_last_body_is_duplicate(self):
+        cache = DuplicateCache()
+        cache.store(CONFIG_A, None, 200, "A")
+        self.assertEqual(cache.lookup(CONFIG_A), (200, "A"))
+
+    def test_earlier_body_is_applied_again(self):
+        # A, B, A: the second A must not be acknowledged while B is in force
+        cache = DuplicateCache()
+        cache.store(CONFIG_A, None, 200, "A")
+        self.assertIsNone(cache.lookup(CONFIG_B))
+        cache.store(CONFIG_B, None, 200, "B")
+        self.assertIsNone(cache.lookup(CONFIG_A))
+        self.assertEqual(cache.lookup(CONFIG_B), (200, "B"))
+
+    def test_forget_body(self):
+        cache = DuplicateCache()
+        cache.store(CONFIG_A, None, 200, "A")
+        cache.forget_body()
+        self.assertIsNone(cache.lookup(CONFIG_A))
+
+    def test_idempotency_key_outlives_later_bodies(self):
+        cache = DuplicateCache()
+        cache.store(CONFIG_A, "push-1", 200, "A")
+        cache.store(CONFIG_B, None, 200, "B")
+        self.assertEqual(cache.lookup(CONFIG_A, "push-1"), (200, "A"))
+
+    def test_idempotency_key_expires(self):
+        cache = DuplicateCache(ttl=-1)
+        cache.store(CONFIG_A, "push-1", 200, "A")
+        cache.store(CONFIG_B, None, 200, "B")
+        self.assertIsNone(cache.lookup(CONFIG_A, "push-1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
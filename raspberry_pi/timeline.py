@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Dry-run Timeline for Proposed Traffic Junction Configurations
+
+Compiles the lamp timeline a configuration would produce for one time zone,
+before it is pushed to the junction. The timeline comes from the controller's
+own auto mode logic (route sequence, route matrix, timings, blink mode and time
+zone selection), run under a virtual clock with a silent GPIO whose sleeps
+return immediately, so one cycle compiles in a millisecond or two.
+
+    {
+      "zone": 1, "controlMode": "auto", "blink": false, "cycleMs": 70700,
+      "routes":  [{"route": 1, "startMs": 0, "endMs": 5100}, ...],
+      "phases":  {"1A": {"red": [{"startMs": 0, "endMs": 5100}], ...}, ...},
+      "conflicts": [{"type": "red_green", "route": 3, "pole": "2A", "startMs": 10200,
+                     "message": "..."}]
+    }
+
+Phases are the intervals each lamp is lit; blinking lamps are marked
+"blinking". Conflict types:
+
+    red_green         red and a green lit together on one pole
+    dark              no lamp lit on a pole
+    no_clearance      a pole goes from green to red without yellow in between
+    invalid_route     a sequence entry with no row in the route matrix (skipped)
+    incomplete_route  a route row with fewer than 48 lamp values (lamps keep
+                      the previous route's state)
+    no_sequence       the zone has no route sequence
+
+The timeline covers auto mode even if the configuration selects manual
+control, which the result reports as controlMode. It starts at the first route
+of the sequence; a coordinated junction (see green_wave.py) runs the same cycle
+shifted by its offset.
+
+Usage:
+    timeline = compile_timeline(config, zone=2)
+    curl -X POST --data @config.json 'http://<pi>:8080/timeline?zone=2'
+    python3 timeline.py <config.json> [zone]
+    python3 timeline.py --bench
+"""
+
+import copy
+import json
+import sys
+import threading
+import time
+
+from trace_replay import ReplayController, ReplayGPIO, VirtualClock, traffic_controller, virtual_controller_module
+from traffic_json_receiver import process_json_data
+
+ROUTE_LAMPS = 48  # 8 poles x 6 lights in a route matrix row
+GREENS = ["greenLeft", "greenStraight", "greenRight"]
+
+
+class TimelineController(ReplayController):
+    """Class to run one cycle of the controller's auto mode without waiting"""
+
+    def _wait(self, seconds, interruptible=True):
+        if not self._loop_active():
+            return False
+        self.replay.clock.sleep(seconds)
+        return True
+
+    def _determine_current_time_zone(self):
+        if self.replay.zone is None:
+            super()._determine_current_time_zone()
+        else:
+            self.current_time_zone = self.replay.zone
+
+    def _handle_auto_control(self):
+        routes = len(self.replay.routes)
+        super()._handle_auto_control()
+        if len(self.replay.routes) == routes and not self.replay.blink:
+            # No sequence to run (or an error): the real controller would idle here
+            self.running = False
+
+    def _apply_route(self, route, time_zone, duration=None):
+        self.replay.route_started(route, time_zone)
+        if self.running:
+            super()._apply_route(route, time_zone, duration)
+
+
+class TimelineCompiler:
+    """Class to collect the routes and lamp frames of one controller cycle"""
+
+    def __init__(self, variables, zone=None, start=None):
+        self.variables = variables
+        self.zone = zone
+        self.start = time.time() if start is None else start
+        self.clock = VirtualClock(self.start)
+        self.gpio = ReplayGPIO()
+        self.controller = None
+        self.frames = []
+        self.routes = []
+        self.conflicts = []
+        self.zone_used = None
+        self.blink = False
+
+    def _ms(self, when=None):
+        return int(round(((self.clock.now if when is None else when) - self.start) * 1000))
+
+    def add_frame(self, frame):
+        self.frames.append(frame)
+        if frame["mode"] == "route" and self.routes:
+            self.routes[-1]["lights"] = frame["lights"]
+        elif frame["mode"] == "blink":
+            # Blink mode repeats the same frame, so one is enough
+            self.blink = True
+            self.controller.running = False
+
+    def route_started(self, route, time_zone):
+        """Called by the controller before each route; ends the run after a full cycle"""
+        self.zone_used = time_zone
+        sequence = self.variables.get(f"route_sequence_{time_zone}", [])
+        if self.routes:
+            self.routes[-1]["endMs"] = self._ms()
+        if len(self.routes) >= len(sequence):
+            self.controller.running = False
+            return
+
+        entry = {"route": route, "startMs": self._ms(), "lights": copy.deepcopy(self.controller.lamp_states)}
+        matrix = self.variables.get("route_matrix", [])
+        if route <= 0 or route > len(matrix):
+            self._conflict("invalid_route", entry, None, f"Route {route} has no row in the route matrix")
+        elif len(matrix[route - 1]) < ROUTE_LAMPS:
+            self._conflict("incomplete_route", entry, None,
+                           f"Route {route} sets {len(matrix[route - 1])} of {ROUTE_LAMPS} lamp values; "
+                           f"the rest keep the previous route's state")
+        self.routes.append(entry)
+
+    def _conflict(self, kind, entry, pole, message):
+        self.conflicts.append({
+            "type": kind,
+            "route": entry["route"],
+            "pole": pole,
+            "startMs": entry["startMs"],
+            "message": message,
+        })
+
+    def run(self):
+        sequence_lengths = [len(value) for key, value in self.variables.items()
+                            if key.startswith("route_sequence_") and isinstance(value, list)]
+        longest = max([value for key, value in self.variables.items()
+                       if "_time" in key and isinstance(value, (int, float))] + [5])
+        # Safety net only: a cycle normally ends itself once every route has run
+        horizon = (max(sequence_lengths + [1]) + 1) * (longest + 1)
+
+        with virtual_controller_module(self.clock, time.localtime(self.start).tm_gmtoff, self.gpio):
+            self.controller = TimelineController(self)
+            self.controller.load_variables()
+            # The timeline is of auto mode; manual mode would only repeat the manual frame
+            self.controller.variables['manualcontrol_mode'] = False
+            # Start from the first route; a coordinated junction runs the same cycle shifted by its offset
+            self.controller.variables['coordination_enabled'] = False
+            self.clock.end = self.start + horizon
+            self.clock.on_end = self._stop
+            self.controller.running = True
+            self.controller.control_thread = threading.current_thread()
+            self.controller._control_loop()
+            if self.zone_used is None:
+                self.zone_used = self.controller.current_time_zone \
+                    if self.variables.get('use_time_zone', False) else 1
+        return self._result()
+
+    def _stop(self):
+        self.controller.running = False
+
+    def _phases(self, end_ms):
+        """Turn the frames into lit intervals per pole and light"""
+        phases = {pole: {light: [] for light in lights} for pole, lights in traffic_controller.GPIO_MAPPING.items()}
+        lit = {}
+        for frame in self.frames:
+            at = self._ms(frame["time"])
+            for pole, lights in frame["lights"].items():
+                for light, state in lights.items():
+                    current = lit.get((pole, light))
+                    if current and current["state"] != state:
+                        phases[pole][light].append(self._interval(current, at))
+                        current = lit[(pole, light)] = None
+                    if state and current is None:
+                        lit[(pole, light)] = {"state": state, "startMs": at}
+        for (pole, light), current in lit.items():
+            if current:
+                phases[pole][light].append(self._interval(current, end_ms))
+        return phases
+
+    def _interval(self, current, end_ms):
+        interval = {"startMs": current["startMs"], "endMs": end_ms}
+        if current["state"] == 2:
+            interval["blinking"] = True
+        return interval
+
+    def _check_lamps(self):
+        """Per-pole conflicts within each route and between consecutive routes"""
+        for index, entry in enumerate(self.routes):
+            previous = self.routes[index - 1]["lights"] if len(self.routes) > 1 else None
+            for pole, lights in entry["lights"].items():
+                greens = [light for light in GREENS if lights.get(light)]
+                if lights.get("red") and greens:
+                    self._conflict("red_green", entry, pole, f"Pole {pole} shows red and {', '.join(greens)} together")
+                if not any(lights.values()):
+                    self._conflict("dark", entry, pole, f"Pole {pole} has no lamp lit")
+                if previous:
+                    before = previous[pole]
+                    if (any(before.get(light) for light in GREENS) and lights.get("red") and not greens
+                            and not before.get("yellow") and not lights.get("yellow")):
+                        self._conflict("no_clearance", entry, pole,
+                                       f"Pole {pole} changes from green to red without yellow")
+
+    def _result(self):
+        end_ms = self._ms()
+        if self.blink:
+            cycle_ms = end_ms = int(traffic_controller.BLINK_INTERVAL * 2000)
+            self.routes = []
+        else:
+            cycle_ms = self.routes[-1].get("endMs", end_ms) if self.routes else 0
+            if not self.variables.get(f"route_sequence_{self.zone_used}"):
+                self.conflicts.append({"type": "no_sequence", "route": None, "pole": None, "startMs": 0,
+                                       "message": f"Time zone {self.zone_used} has no route sequence"})
+            self._check_lamps()
+            end_ms = cycle_ms
+
+        if self.variables.get('manualcontrol_mode', False):
+            control_mode = "manual"
+        elif self.variables.get('autocontrol_mode', False) or not self.variables.get('semicontrol_mode', False):
+            control_mode = "auto"
+        else:
+            control_mode = "semi"
+
+        return {
+            "zone": self.zone_used,
+            "controlMode": control_mode,
+            "blink": self.blink,
+            "cycleMs": cycle_ms,
+            "routes": [{"route": entry["route"], "startMs": entry["startMs"], "endMs": entry.get("endMs", end_ms)}
+                       for entry in self.routes],
+            "phases": self._phases(end_ms),
+            "conflicts": self.conflicts,
+        }
+
+
+def compile_timeline(config, zone=None, start=None):
+    """
+    Compile the lamp timeline of a proposed configuration (plain or compact wire
+    format) for a time zone, or for the zone the controller would pick at start.
+
+    Raises ValueError if the configuration cannot be converted to variables.
+    """
+    started = time.perf_counter()
+    variables = process_json_data(config)
+    if variables is None:
+        raise ValueError("Configuration could not be converted to variables")
+    if zone is not None and not variables.get('use_time_zone', False) and zone != 1:
+        # The controller ignores the zones unless use_time_zone is set
+        zone = 1
+    result = TimelineCompiler(variables, zone, start).run()
+    result["compileMs"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+def benchmark(rounds=200):
+    """Measure how long compiling a full 14 route cycle takes"""
+    from wire_format import sample_config
+
+    config = sample_config()
+    timeline = compile_timeline(config, zone=1)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        compile_timeline(config, zone=1)
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"{len(timeline['routes'])} routes, cycle {timeline['cycleMs']} ms, "
+          f"{len(timeline['conflicts'])} conflicts: {elapsed * 1000:.2f} ms per compile")
+
+
+def main():
+    import logging
+    from async_logging import setup_logging
+
+    setup_logging(level=logging.WARNING, console=True)
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark()
+        return
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+    with open(sys.argv[1]) as f:
+        config = json.load(f)
+    zone = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    print(json.dumps(compile_timeline(config, zone), indent=2))
+
+
+if __name__ == "__main__":
+    main()
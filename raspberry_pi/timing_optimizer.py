@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Count-driven Timing Optimizer for the Traffic Junction Time Zones
+
+Turns historical approach counts per time zone into timing plans, starting
+from Webster's cycle and split formulas and refining the result by scoring
+candidate plans with queue_simulator.py:
+
+    1. Each route of the zone's sequence that lights a green is a phase. Its
+       flow ratio is the highest demand / saturation flow among the approaches
+       it serves (an approach served by several routes shares its demand).
+    2. Webster's cycle C = (1.5 L + 5) / (1 - Y), with Y the sum of the flow
+       ratios and L the lost time (start-up plus yellow per phase), and the
+       effective green split in proportion to the flow ratios.
+    3. The controller runs every route for the same time
+       (pole_1A_red_time_time_zone_<zone>), so a split is expressed as the number
+       of consecutive slots each route gets in route_sequence_<zone>. Candidates
+       cover slot lengths and cycles around Webster's; the one with the least
+       simulated delay wins, and the current plan is kept if nothing beats it.
+
+On a Pi with more than one core the zones are optimized in parallel in a process
+pool. The output is the input configuration with the optimized keys replaced, in
+the format process_json_data accepts:
+
+    route_sequence_<zone>                     routes with their slots
+    pole_<pole>_<light>_time_time_zone_<zone> seconds per cycle each lamp is lit
+    all_pole_yellow_time                      yellow (clearance) time
+
+pole_1A_red_time_time_zone_<zone> is the exception: the controller uses it as
+the time of every route, so it holds the slot length instead.
+
+Counts are vehicles per hour per approach, or vehicles over "period" seconds:
+
+    {"1": {"1A": 620, "2A": 410, ...}, "3": {"period": 10800, "1A": 1500, ...}}
+
+Usage:
+    config, report = optimize_config(config, counts)
+    python3 timing_optimizer.py <config.json> <counts.json> [output.json]
+    python3 timing_optimizer.py --bench
+"""
+
+import copy
+import json
+import math
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from queue_simulator import APPROACHES, GREEN_LIGHTS, LIGHTS_PER_POLE, SATURATION_FLOW, \
+    NUMPY_AVAILABLE, compile_plan, score_plans, usable_cpus
+from traffic_json_receiver import process_json_data
+from wire_format import expand
+
+LIGHT_TIMINGS = ["red", "yel", "grnL", "grnS", "grnR"]  # Route matrix lamp order; ped and buz are left alone
+STARTUP_LOST_TIME = 2  # seconds lost each time a phase gets green
+MIN_YELLOW_TIME = 3  # seconds
+MIN_GREEN_TIME = 5  # seconds per phase
+MIN_CYCLE = 30  # seconds
+MAX_CYCLE = 120  # seconds
+MAX_FLOW_RATIO = 0.9  # Webster's cycle grows without bound as Y approaches 1
+MAX_TIMING = 300  # Largest timing the configuration accepts
+SLOT_TIMES = range(3, 31)  # Route times (seconds) tried for the slots
+CYCLE_FACTORS = [0.75, 0.9, 1.0, 1.15, 1.3, 1.5]  # Cycles tried around Webster's, within MIN_CYCLE and MAX_CYCLE
+OPTIMIZER_PERIOD = 3600  # Simulated seconds per candidate plan
+OPTIMIZER_WORKERS = 4  # One per Pi 4 core; capped at the usable CPUs
+
+
+def zone_rates(counts):
+    """Vehicles per hour per approach from a zone's counts"""
+    period = counts.get("period", 3600)
+    return {pole: counts[pole] * 3600 / period for pole in APPROACHES if counts.get(pole)}
+
+
+def zone_phases(variables, zone):
+    """The zone's routes in order of first appearance, with their green approaches"""
+    phases = []
+    seen = set()
+    # Uncoordinated plans keep a phase for every sequence entry, invalid ones included
+    plan = compile_plan(variables, zone, coordinated=False)
+    valid = len(variables.get("route_matrix", []))
+    for route, (_, greens) in zip(plan["sequence"], plan["phases"]):
+        if 0 < route <= valid and route not in seen:
+            seen.add(route)
+            phases.append((route, greens))
+    return phases
+
+
+def webster(phases, rates, yellow, saturation=None):
+    """
+    Webster's optimum cycle and effective green per phase.
+
+    Returns (cycle, {route: green seconds}); routes without green get no split.
+    """
+    saturation = saturation or {}
+    served = {index: sum(1 for _, greens in phases if greens[index]) for index in range(len(APPROACHES))}
+    ratios = {}
+    for route, greens in phases:
+        ratios[route] = max([rates.get(pole, 0) / saturation.get(pole, SATURATION_FLOW) / served[index]
+                             for index, pole in enumerate(APPROACHES) if greens[index]] or [0])
+    green_routes = [route for route, greens in phases if any(greens)]
+    lost = len(green_routes) * (STARTUP_LOST_TIME + yellow)
+    total = min(sum(ratios[route] for route in green_routes), MAX_FLOW_RATIO)
+    cycle = min(max((1.5 * lost + 5) / (1 - total), MIN_CYCLE), MAX_CYCLE)
+
+    weights = {route: ratios[route] or 0.01 for route in green_routes}
+    effective = max(cycle - lost, MIN_GREEN_TIME * len(green_routes))
+    return cycle, {route: max(effective * weight / sum(weights.values()), MIN_GREEN_TIME)
+                   for route, weight in weights.items()}
+
+
+def slot_sequence(phases, greens, slot_time, yellow):
+    """
+    A route sequence giving each green route round(green / slot time)
+    consecutive slots, and each clearance route at least the yellow time
+    """
+    sequence = []
+    for route, _ in phases:
+        if route in greens:
+            slots = max(1, round(greens[route] / slot_time))
+        else:
+            slots = max(1, math.ceil(yellow / slot_time))
+        sequence += [route] * slots
+    return sequence
+
+
+def candidate_sequences(phases, greens, yellow, cycle):
+    """(sequence, slot time) candidates around Webster's split, with cycles from MIN_CYCLE to MAX_CYCLE"""
+    candidates = []
+    targets = []
+    for factor in CYCLE_FACTORS:
+        target = min(max(cycle * factor, MIN_CYCLE), MAX_CYCLE)
+        if target in targets:
+            continue
+        targets.append(target)
+        scaled = {route: green * target / cycle for route, green in greens.items()}
+        shortest = min(scaled.values())
+        for slot_time in SLOT_TIMES:
+            if slot_time > max(shortest, SLOT_TIMES[0]):
+                break
+            candidate = (slot_sequence(phases, scaled, slot_time, yellow), slot_time)
+            # Whole slots can still round the cycle past the limits
+            if candidate not in candidates and MIN_CYCLE <= len(candidate[0]) * slot_time <= MAX_CYCLE:
+                candidates.append(candidate)
+    return candidates
+
+
+def lamp_timings(variables, sequence, slot_time, yellow):
+    """Seconds per cycle each lamp of each pole is lit under a plan"""
+    route_matrix = variables["route_matrix"]
+    lit = {pole: {timing: 0 for timing in LIGHT_TIMINGS} for pole in APPROACHES}
+    state = {pole: {timing: 0 for timing in LIGHT_TIMINGS} for pole in APPROACHES}
+    for _ in range(2):  # The first pass only settles the lamps a short route row leaves alone
+        for pole in APPROACHES:
+            lit[pole] = {timing: 0 for timing in LIGHT_TIMINGS}
+        for route in sequence:
+            row = route_matrix[route - 1]
+            for pole_index, pole in enumerate(APPROACHES):
+                for light, timing in enumerate(LIGHT_TIMINGS):
+                    position = pole_index * LIGHTS_PER_POLE + light
+                    if position < len(row):
+                        state[pole][timing] = row[position]
+                    if state[pole][timing]:
+                        lit[pole][timing] += slot_time
+
+    timings = {}
+    for pole in APPROACHES:
+        for timing in LIGHT_TIMINGS:
+            seconds = lit[pole][timing]
+            if timing == "yel" and not seconds:
+                seconds = yellow
+            timings[f"pole_{pole}_{timing}_time"] = min(max(seconds, 1), MAX_TIMING)
+    return timings
+
+
+def optimize_zone(variables, zone, counts, saturation=None):
+    """Optimize one time zone; returns a report with the chosen plan and its score"""
+    started = time.perf_counter()
+    rates = zone_rates(counts)
+    yellow = max(variables.get("all_pole_yellow_time", 1), MIN_YELLOW_TIME)
+    phases = zone_phases(variables, zone)
+    if not phases or not any(any(greens) for _, greens in phases):
+        return {"zone": zone, "skipped": "no route of the zone's sequence lights a green"}
+
+    cycle, greens = webster(phases, rates, yellow, saturation)
+    candidates = candidate_sequences(phases, greens, yellow, cycle)
+    current = compile_plan(variables, zone)
+    plans = [current] + [compile_plan(variables, zone, sequence, slot_time) for sequence, slot_time in candidates]
+    scores = score_plans(plans, rates, period=OPTIMIZER_PERIOD, saturation=saturation)
+
+    best = min(range(len(plans)), key=lambda index: (scores[index]["delay"], plans[index]["cycle"], index))
+    plan = plans[best]
+    return {
+        "zone": zone,
+        "websterCycle": round(cycle, 1),
+        "candidates": len(plans),
+        "kept": best == 0,
+        "sequence": plan["sequence"],
+        "slotTime": plan["routeTime"],
+        "cycle": plan["cycle"],
+        "yellow": yellow,
+        "before": scores[0],
+        "after": scores[best],
+        "timings": lamp_timings(variables, plan["sequence"], plan["routeTime"], yellow),
+        "optimizeMs": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _optimize_zone_task(args):
+    return optimize_zone(*args)
+
+
+def optimize_config(config, counts, saturation=None, workers=OPTIMIZER_WORKERS):
+    """
+    Optimize every zone that has counts; returns (updated configuration, reports).
+
+    Raises ValueError if the configuration cannot be converted to variables.
+    """
+    config = copy.deepcopy(expand(config))
+    variables = process_json_data(config)
+    if variables is None:
+        raise ValueError("Configuration could not be converted to variables")
+
+    tasks = []
+    reports = []
+    for zone, zone_counts in sorted(counts.items(), key=lambda item: int(item[0])):
+        if not 1 <= int(zone) <= 8:
+            continue
+        if variables.get(f"blink_mode_enabled_time_zone_{zone}", False):
+            reports.append({"zone": int(zone), "skipped": "the zone runs blink mode"})
+        else:
+            tasks.append((variables, int(zone), zone_counts, saturation))
+    # More processes than CPUs only interleave, so a single core optimizes the zones in this process
+    workers = min(workers or 1, usable_cpus(), len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            reports += pool.map(_optimize_zone_task, tasks)
+    else:
+        reports += [_optimize_zone_task(task) for task in tasks]
+    reports.sort(key=lambda report: report["zone"])
+
+    for report in reports:
+        if "skipped" in report or report["kept"]:
+            continue
+        zone = report["zone"]
+        config[f"route_sequence_{zone}"] = report["sequence"]
+        for key, seconds in report["timings"].items():
+            config[f"{key}_time_zone_{zone}"] = seconds
+        config[f"pole_1A_red_time_time_zone_{zone}"] = report["slotTime"]
+        config["all_pole_yellow_time"] = max(config.get("all_pole_yellow_time", 1), report["yellow"])
+    return config, reports
+
+
+def print_report(reports):
+    for report in reports:
+        if "skipped" in report:
+            print(f"zone {report['zone']}: skipped, {report['skipped']}")
+            continue
+        before, after = report["before"], report["after"]
+        outcome = "current plan kept" if report["kept"] else \
+            f"{report['slotTime']}s slots, cycle {report['cycle']}s, sequence {report['sequence']}"
+        print(f"zone {report['zone']}: Webster cycle {report['websterCycle']}s, {report['candidates']} plans "
+              f"in {report['optimizeMs']} ms; {outcome}")
+        print(f"    delay {before['delay']}s -> {after['delay']}s, max queue {before['maxQueue']} -> "
+              f"{after['maxQueue']}, left over {before['leftOver']} -> {after['leftOver']}")
+
+
+def sample_counts():
+    """Counts for a four-arm junction with a morning and an evening peak"""
+    profile = [0.2, 0.75, 0.45, 0.5, 0.45, 0.8, 0.35, 0.15]
+    counts = {}
+    for zone, level in enumerate(profile, 1):
+        counts[str(zone)] = {"1A": 700 * level, "1B": 150 * level, "2A": 450 * level, "2B": 90 * level,
+                             "3A": 520 * level, "3B": 160 * level, "4A": 380 * level, "4B": 70 * level}
+    return counts
+
+
+def route_row(green_poles=(), yellow_poles=()):
+    """A route matrix row with green on some poles, yellow on others and red on the rest"""
+    values = []
+    for pole in APPROACHES:
+        lights = [0] * LIGHTS_PER_POLE
+        if pole in green_poles:
+            for light in GREEN_LIGHTS:
+                lights[light] = 1
+        elif pole in yellow_poles:
+            lights[1] = 1
+        else:
+            lights[0] = 1
+        values += lights
+    return values
+
+
+def sample_routes():
+    """
+    Route matrix rows for a four-phase junction: each arm green in turn,
+    followed by a clearance row with that arm on yellow
+    """
+    routes = []
+    for arm in ["1", "2", "3", "4"]:
+        poles = [arm + "A", arm + "B"]
+        routes += [route_row(green_poles=poles), route_row(yellow_poles=poles)]
+    return routes
+
+
+def benchmark():
+    """Optimize all eight zones of a sample configuration"""
+    from wire_format import sample_config
+
+    config = sample_config()
+    config["route_matrix"] = sample_routes()
+    for zone in range(1, 9):
+        config[f"route_sequence_{zone}"] = list(range(1, 9))
+        config[f"pole_1A_red_time_time_zone_{zone}"] = 15
+    start = time.perf_counter()
+    _, reports = optimize_config(config, sample_counts())
+    elapsed = time.perf_counter() - start
+    print_report(reports)
+    workers = min(OPTIMIZER_WORKERS, usable_cpus())
+    print(f"8 zones in {elapsed:.2f} s ({'NumPy' if NUMPY_AVAILABLE else 'plain Python'}, "
+          f"{workers} process{'es' if workers > 1 else ''})")
+
+
+def main():
+    import logging
+    from async_logging import setup_logging
+
+    setup_logging(level=logging.WARNING, console=True)
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark()
+        return
+    if len(sys.argv) < 3:
+        print(__doc__)
+        return
+    with open(sys.argv[1]) as f:
+        config = json.load(f)
+    with open(sys.argv[2]) as f:
+        counts = json.load(f)
+    config, reports = optimize_config(config, counts)
+    print_report(reports)
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], "w") as f:
+            json.dump(config, f, indent=2)
+        print(f"Optimized configuration written to {sys.argv[3]}")
+
+
+if __name__ == "__main__":
+    main()
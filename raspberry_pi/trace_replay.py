@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Replay an Activity Trace Through the Traffic Controller
+
+Feeds the inputs recorded by activity_trace.py (variables, configuration
+payloads, reloads and manual commands) back through process_json_data() and
+the real TrafficController logic, under a virtual clock and a silent mock GPIO,
+and checks that the controller produces the lamp frames that were recorded.
+
+Virtual time only advances when the controller sleeps, so a day of activity
+replays in seconds. The replay starts at the first recorded frame and continues
+the route sequence from the route it shows; frames must then match in order,
+with the time between consecutive frames within a tolerance.
+
+The controller module's time, datetime and GPIO are swapped for the duration
+of a replay, so replaying on the Pi never drives the real lamps.
+
+Usage:
+    python3 trace_replay.py <trace file> [tolerance seconds]
+    python3 trace_replay.py --bench [hours]
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from activity_trace import TraceRecorder, read_trace
+from async_logging import setup_logging
+from traffic_json_receiver import process_json_data
+
+try:
+    import traffic_controller
+except ImportError:
+    # In the repository the controller sits one directory up
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import traffic_controller
+
+FRAME_TOLERANCE = 0.25  # Allowed difference in time between consecutive frames (seconds)
+END_MARGIN = 1.0  # Virtual seconds replayed past the last record
+
+# The controller module is patched while a virtual run is in progress, one run at a time
+_environment_lock = threading.Lock()
+
+
+class VirtualClock:
+    """Class to stand in for the time module, delivering trace inputs as virtual time passes"""
+
+    def __init__(self, start):
+        self.now = start
+        self.end = None
+        self.on_end = None
+        self._events = []
+        self._next = 0
+
+    def schedule(self, events):
+        """Set the (time, callback) pairs to run, in time order"""
+        self._events = events
+        self._next = 0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        target = self.now + max(seconds, 0)
+        while self._next < len(self._events) and self._events[self._next][0] <= target:
+            when, callback = self._events[self._next]
+            self._next += 1
+            self.now = max(self.now, when)
+            callback()
+        self.now = target
+        if self.end is not None and self.now >= self.end and self.on_end:
+            self.on_end()
+
+    def __getattr__(self, name):
+        # Anything else (strftime, localtime) comes from the real time module
+        return getattr(time, name)
+
+
+class VirtualDatetime:
+    """Class to answer datetime.now() from the virtual clock in the recorded UTC offset"""
+
+    def __init__(self, clock, utc_offset):
+        self.clock = clock
+        self.tz = timezone(timedelta(seconds=utc_offset))
+
+    def now(self):
+        return datetime.fromtimestamp(self.clock.now, self.tz).replace(tzinfo=None)
+
+
+class ReplayGPIO:
+    """Class to accept GPIO calls silently and count pin writes"""
+
+    BCM = "BCM"
+    OUT = "OUT"
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self):
+        self.pins = {}
+        self.writes = 0
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, mode):
+        self.pins[pin] = 0
+
+    def output(self, pin, value):
+        self.pins[pin] = value
+        self.writes += 1
+
+    def cleanup(self):
+        self.pins = {}
+
+
+class FrameCapture:
+    """Class to take the controller's lamp frame datagrams instead of a socket"""
+
+    def __init__(self, replay):
+        self.replay = replay
+
+    def sendto(self, data, address):
+        self.replay.add_frame(json.loads(data.decode()))
+
+    def close(self):
+        pass
+
+
+@contextlib.contextmanager
+def virtual_controller_module(clock, utc_offset, gpio):
+    """Swap the controller module's time, datetime and GPIO for virtual ones while in use"""
+    with _environment_lock:
+        saved = (traffic_controller.time, traffic_controller.datetime, traffic_controller.GPIO)
+        traffic_controller.time = clock
+        traffic_controller.datetime = VirtualDatetime(clock, utc_offset)
+        traffic_controller.GPIO = gpio
+        try:
+            yield
+        finally:
+            traffic_controller.time, traffic_controller.datetime, traffic_controller.GPIO = saved
+
+
+class ReplayController(traffic_controller.TrafficController):
+    """Class to run the controller logic with variables supplied by a replay"""
+
+    def __init__(self, replay):
+        super().__init__()
+        self.replay = replay
+        self.profiler = None
+        # Replays carry no preemption requests, and virtual time only passes in time.sleep()
+        self.preemptions = None
+        self._frame_socket.close()
+        self._frame_socket = FrameCapture(replay)
+
+    def _variables_changed(self):
+        return self._reload_requested.is_set()
+
+    def load_variables(self):
+        self._reload_requested.clear()
+        with self._frame_lock:
+            self.variables = dict(self.replay.variables)
+        if self.variables.get('use_time_zone', False):
+            self._determine_current_time_zone()
+        return True
+
+
+class TraceReplay:
+    """Class to drive the traffic controller from recorded inputs under a virtual clock"""
+
+    def __init__(self, inputs, start, end, utc_offset=0, recorder=None):
+        self.inputs = inputs
+        self.start = start
+        self.end = end
+        self.utc_offset = utc_offset
+        # When set, inputs and frames are recorded as they happen (used to build test traces)
+        self.recorder = recorder
+        self.clock = VirtualClock(start)
+        self.gpio = ReplayGPIO()
+        self.variables = {}
+        self.frames = []
+        self.controller = None
+        self.configs = 0
+
+    def add_frame(self, frame):
+        self.frames.append(frame)
+        if self.recorder:
+            self.recorder.frame(frame)
+
+    def _apply(self, kind, value, live=True):
+        """Apply one recorded input; before the replay starts only the variables change"""
+        if kind == "snapshot":
+            self.variables = dict(value)
+            if self.recorder:
+                self.recorder.snapshot(value)
+        elif kind == "config":
+            self.configs += 1
+            variables = process_json_data(value)
+            if variables is not None:
+                self.variables = variables
+            if self.recorder:
+                self.recorder.config(value)
+        elif kind == "reload":
+            if live:
+                self.controller._reload_requested.set()
+            if self.recorder:
+                self.recorder.reload(value)
+        elif kind == "manual":
+            self.variables.update(value)
+            if live:
+                self.controller.apply_manual_changes(value)
+            if self.recorder:
+                self.recorder.manual(value)
+
+    def _align(self, frame):
+        """Continue the route sequence from the route shown by the first recorded frame"""
+        controller = self.controller
+        if frame.get("mode") != "route" or not frame.get("route"):
+            return
+        controller._determine_current_time_zone()
+        zone = controller.current_time_zone if controller.variables.get('use_time_zone', False) else 1
+        sequence = controller.variables.get(f"route_sequence_{zone}", [])
+        if frame["route"] in sequence:
+            controller.sequence_index = sequence.index(frame["route"])
+
+    def _stop(self):
+        self.controller.running = False
+
+    def run(self, first_frame=None):
+        """Run the controller from start to end; returns the frames it published"""
+        with virtual_controller_module(self.clock, self.utc_offset, self.gpio):
+            self.controller = ReplayController(self)
+
+            # Inputs up to the start set the state the recorded controller was in
+            pending = [(when, kind, value) for when, kind, value in self.inputs if when > self.start]
+            for when, kind, value in self.inputs:
+                if when <= self.start:
+                    self._apply(kind, value, live=False)
+            self.clock.schedule([(when, lambda kind=kind, value=value: self._apply(kind, value))
+                                 for when, kind, value in pending])
+            self.clock.end = self.end
+            self.clock.on_end = self._stop
+
+            self.controller.load_variables()
+            if first_frame:
+                self._align(first_frame)
+            self.controller.running = True
+            self.controller.control_thread = threading.current_thread()
+            self.controller._control_loop()
+        return self.frames
+
+
+def _frame_content(frame):
+    return frame["mode"], frame["route"], frame["lights"]
+
+
+def _describe(frame):
+    return f"{frame['mode']} frame" + (f" for route {frame['route']}" if frame["route"] else "")
+
+
+def compare_frames(expected, replayed, end, tolerance=FRAME_TOLERANCE):
+    """
+    Compare recorded (time, frame) pairs with replayed frames.
+
+    Returns (frames matched, description of the first mismatch or None).
+    """
+    for index, (when, frame) in enumerate(expected):
+        if index >= len(replayed):
+            return index, f"frame {index} at {when:.3f} ({_describe(frame)}) was not replayed"
+        replayed_frame = replayed[index]
+        if _frame_content(replayed_frame) != _frame_content(frame):
+            difference = _describe(replayed_frame)
+            if difference == _describe(frame):
+                difference += " with different lamps"
+            return index, f"frame {index} at {when:.3f}: recorded {_describe(frame)}, replayed {difference}"
+        if index:
+            recorded_gap = when - expected[index - 1][0]
+            replayed_gap = replayed_frame["time"] - replayed[index - 1]["time"]
+            if abs(replayed_gap - recorded_gap) > tolerance:
+                return index, (f"frame {index} at {when:.3f} came {recorded_gap:.3f}s after the previous one, "
+                               f"replayed after {replayed_gap:.3f}s")
+    for frame in replayed[len(expected):]:
+        if frame["time"] < end - tolerance:
+            return len(expected), f"unexpected {_describe(frame)} replayed at {frame['time']:.3f}"
+    return len(expected), None
+
+
+def replay_trace(path, tolerance=FRAME_TOLERANCE):
+    """Replay a trace file and compare the frames; returns a report dict"""
+    header, records = read_trace(path)
+    inputs = [record for record in records if record[1] != "frame"]
+    expected = [(when, value) for when, kind, value in records if kind == "frame"]
+    if not records:
+        raise ValueError(f"{path} has no records")
+
+    start = expected[0][0] if expected else records[0][0]
+    end = records[-1][0]
+    replay = TraceReplay(inputs, start, end + END_MARGIN, header["utcOffset"])
+    started = time.perf_counter()
+    frames = replay.run(expected[0][1] if expected else None)
+    elapsed = time.perf_counter() - started
+
+    matched, mismatch = compare_frames(expected, frames, end, tolerance)
+    return {
+        "virtualSeconds": round(end + END_MARGIN - start, 3),
+        "wallSeconds": round(elapsed, 3),
+        "speedup": round((end + END_MARGIN - start) / elapsed, 1) if elapsed else None,
+        "inputs": len(inputs),
+        "configs": replay.configs,
+        "recordedFrames": len(expected),
+        "replayedFrames": len(frames),
+        "gpioWrites": replay.gpio.writes,
+        "matched": matched,
+        "mismatch": mismatch,
+    }
+
+
+def synthetic_inputs(start, hours):
+    """Build a day-like sequence of inputs: hourly configuration pushes and an hour of manual control"""
+    from wire_format import sample_config
+
+    config = sample_config()
+    for zone in range(1, 9):
+        config[f"time_zone_{zone}_start_hr"] = (zone - 1) * 3
+        config[f"time_zone_{zone}_start_min"] = 0
+        config[f"time_zone_{zone}_end_hr"] = zone * 3 % 24
+        config[f"time_zone_{zone}_end_min"] = 0
+        config[f"pole_1A_red_time_time_zone_{zone}"] = 20
+    config["blink_mode_enabled_time_zone_8"] = True
+
+    def push(when, config):
+        digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+        return [(when, "config", config), (when, "reload", digest)]
+
+    inputs = [(start, "snapshot", process_json_data(config))]
+    for hour in range(1, hours):
+        when = start + hour * 3600 + 17.3
+        config = dict(config)
+        if hour % 12 == 10:
+            config["manualcontrol_mode"] = True
+            inputs += push(when, config)
+            for minute in range(1, 60):
+                pole = ["1A", "2A", "3A", "4A"][minute % 4]
+                signal = ["red", "grnS", "yel_blink"][minute % 3]
+                inputs.append((when + minute * 60, "manual",
+                               {f"manual_control_pole_{pole}_{signal}_light": minute % 2 == 0}))
+            continue
+        config["manualcontrol_mode"] = False
+        zone = (hour // 3) % 8 + 1
+        config[f"pole_1A_red_time_time_zone_{zone}"] = 10 + hour % 20
+        inputs += push(when, config)
+    return inputs
+
+
+def benchmark(hours=24):
+    """Record a synthetic trace under the virtual clock, then replay and verify it"""
+    work_dir = tempfile.mkdtemp(prefix="trace_bench_")
+    path = os.path.join(work_dir, "activity.trace")
+    start = datetime(2024, 1, 1).timestamp()
+    end = start + hours * 3600
+
+    recording = TraceReplay(synthetic_inputs(start, hours), start, end, time.localtime(start).tm_gmtoff)
+    recording.recorder = TraceRecorder(path, clock=recording.clock.time)
+    started = time.perf_counter()
+    recording.run()
+    record_seconds = time.perf_counter() - started
+    recording.recorder.close()
+
+    report = replay_trace(path)
+    print(f"Synthetic trace: {hours} h, {recording.recorder.records} records, "
+          f"{os.path.getsize(path)} bytes ({os.path.getsize(path) / hours / 1024:.1f} KB per hour)")
+    print(f"  Recording run:  {record_seconds:.2f}s")
+    print(f"  Replay:         {report['wallSeconds']:.2f}s for {report['virtualSeconds'] / 3600:.1f} h "
+          f"({report['speedup']:.0f}x real time)")
+    print(f"  Frames:         {report['recordedFrames']} recorded, {report['replayedFrames']} replayed, "
+          f"{report['gpioWrites']} GPIO writes, {report['configs']} configurations")
+    print(f"  Result:         {'match' if report['mismatch'] is None else report['mismatch']}")
+    os.remove(path)
+    os.rmdir(work_dir)
+
+
+def main():
+    # process_json_data logs every payload; only problems are of interest here
+    setup_logging(level=logging.WARNING, console=True)
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 24)
+        return
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+
+    tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else FRAME_TOLERANCE
+    report = replay_trace(sys.argv[1], tolerance)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["mismatch"] is None else 1)
+
+
+if __name__ == "__main__":
+    main()
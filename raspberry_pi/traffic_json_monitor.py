@@ -15,19 +15,22 @@ import time
 import os
 import logging
 import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from datetime import datetime
 import sys
 
+from admission import AdmissionControl, reject
+from async_logging import LazyJson, setup_logging
+from backup_store import BackupStore
+from config_journal import JOURNAL_DIR, journal_exists, read_state_with_seq
+from duplicate_cache import DuplicateCache, IDEMPOTENCY_HEADER
+from latency_trace import CORRELATION_HEADER
+from profiling import Profiler, install_signal_handler, serve_profile_request
+from status_stream import StatusBroadcaster, serve_cached_status, serve_event_stream, start_frame_listener
+from wire_format import decode_body
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("traffic_monitor.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+setup_logging("traffic_monitor.log", console=True, stream=sys.stdout)
 
 # Import initial variables
 try:
@@ -43,18 +46,44 @@ except ImportError:
     all_pole_yellow_blink = False
     time_zone_number = 1
 
+# The ingest service's journal, once it exists, is newer than traffic_start_variables.py
+if journal_exists(JOURNAL_DIR):
+    try:
+        journal_seq, journal_state = read_state_with_seq(JOURNAL_DIR)
+        manualcontrol_mode = journal_state.get("manualcontrol_mode", manualcontrol_mode)
+        autocontrol_mode = journal_state.get("autocontrol_mode", autocontrol_mode)
+        semicontrol_mode = journal_state.get("semicontrol_mode", semicontrol_mode)
+        all_pole_yellow_blink = journal_state.get("all_pole_yellow_blink", all_pole_yellow_blink)
+        time_zone_number = journal_state.get("time_zone_number", time_zone_number)
+        logging.info(f"Read initial variables from {JOURNAL_DIR} at seq {journal_seq}")
+    except Exception as e:
+        logging.error(f"Failed to read {JOURNAL_DIR}, keeping the imported variables: {e}")
+
 # Configuration
 JSON_FILE_PATH = "traffic_config.json"
 BACKUP_DIR = "backups"
+BACKUP_MAX_SNAPSHOTS = 500  # Retention applied to the backup store at startup
 SERVER_PORT = 8080
 
-# Ensure backup directory exists
-os.makedirs(BACKUP_DIR, exist_ok=True)
+# Content-addressed backup store (creates the backup directory)
+backup_store = BackupStore(BACKUP_DIR)
+
+# Recently handled payloads, so retried deliveries are acknowledged without disk writes
+duplicate_cache = DuplicateCache()
 
 # Global variables to track state
 last_update_time = None
 current_config = {}
 
+# Pre-serialized /status body and the /events stream of status changes and lamp frames
+status_broadcaster = StatusBroadcaster()
+
+# On-demand profiling: SIGUSR2 or POST /profile from the Pi itself
+profiler = Profiler("traffic_json_monitor")
+
+# Token buckets per client and endpoint and bounded work, so a retry storm gets fast 429s
+admission = AdmissionControl({"/": (2, 10), "/profile": (1, 2)})
+
 class ConfigState:
     """Class to store and manage the current configuration state"""
     def __init__(self):
@@ -115,15 +144,31 @@ class ConfigState:
 # Initialize config state
 config_state = ConfigState()
 
+def status_data():
+    """Build the status reported on /status and /events"""
+    return {
+        "controlMode": "manual" if config_state.manualcontrol_mode else "auto" if config_state.autocontrol_mode else "semi",
+        "selectedPole": config_state.selected_pole,
+        "activeRoute": config_state.active_route,
+        "yellowBlink": config_state.all_pole_yellow_blink,
+        "timeZone": config_state.time_zone_number,
+        "lastCommand": config_state.last_command,
+        "lastUpdate": last_update_time.isoformat() if last_update_time else None
+    }
+
 class WebhookHandler(BaseHTTPRequestHandler):
     """HTTP request handler for receiving JSON updates from the web frontend"""
     
+    def handle_one_request(self):
+        # Requests are only run under cProfile while a profiling session asks for it
+        profiler.call(super().handle_one_request)
+    
     def _set_response(self, status_code=200, content_type="application/json"):
         self.send_response(status_code)
         self.send_header('Content-type', content_type)
         self.send_header('Access-Control-Allow-Origin', '*')  # Allow CORS
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', f'Content-Type, Content-Encoding, X-Signature, If-None-Match, {IDEMPOTENCY_HEADER}, {CORRELATION_HEADER}')
         self.end_headers()
     
     def do_OPTIONS(self):
@@ -131,9 +176,25 @@ class WebhookHandler(BaseHTTPRequestHandler):
         self._set_response()
     
     def do_POST(self):
+        """Admit, then handle, POST requests (see admission.py)"""
+        retry_after = admission.check(self.client_address[0], self.path.split('?')[0], "bulk")
+        if retry_after is not None:
+            reject(self, retry_after, "Too many requests")
+            return
+        with admission.work("bulk") as admitted:
+            if not admitted:
+                reject(self, 1, "Busy, try again")
+                return
+            self._handle_post()
+    
+    def _handle_post(self):
         """Handle POST requests with JSON configuration updates"""
         global last_update_time, current_config
         
+        if self.path.split('?')[0] == '/profile':
+            serve_profile_request(self, profiler)
+            return
+        
         try:
             # Get content length
             content_length = int(self.headers['Content-Length'])
@@ -141,36 +202,47 @@ class WebhookHandler(BaseHTTPRequestHandler):
             # Read the request body
             post_data = self.rfile.read(content_length)
             
+            # Acknowledge duplicate deliveries with the original response
+            idempotency_key = self.headers.get(IDEMPOTENCY_HEADER)
+            cached = duplicate_cache.lookup(post_data, idempotency_key)
+            if cached:
+                status_code, response_body = cached
+                self._set_response(status_code)
+                self.wfile.write(response_body)
+                return
+            
             # Parse JSON data
             try:
-                config = json.loads(post_data.decode())
-                logging.info(f"Received JSON configuration update: {json.dumps(config, indent=2)}")
-            except json.JSONDecodeError as e:
+                config = decode_body(post_data, self.headers.get('Content-Encoding'))
+                # Serialized on the log writer thread, not while the client waits
+                logging.info("Received JSON configuration update: %s", LazyJson(config))
+            except (ValueError, UnicodeDecodeError) as e:
                 logging.error(f"Invalid JSON received: {e}")
                 self._set_response(400)
                 self.wfile.write(json.dumps({"error": "Invalid JSON"}).encode())
                 return
             
-            # Save to file
-            with open(JSON_FILE_PATH, 'w') as f:
-                json.dump(config, f, indent=2)
+            # Back up the configuration; unchanged payloads are not written again
+            if backup_store.save(config) is not None or not os.path.exists(JSON_FILE_PATH):
+                # Save to file
+                with open(JSON_FILE_PATH, 'w') as f:
+                    json.dump(config, f, indent=2)
             
-            # Create a backup with timestamp
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = os.path.join(BACKUP_DIR, f"config_{timestamp}.json")
-            with open(backup_path, 'w') as f:
-                json.dump(config, f, indent=2)
             
             # Update last update time and current config
             last_update_time = datetime.now()
             current_config = config
             
-            # Update the config state
+            # Update the config state and push it to stream subscribers
             config_state.update_from_json(config)
+            status_broadcaster.set_status(status_data())
             
             # Send success response
+            response_body = json.dumps({"status": "success", "timestamp": timestamp}).encode()
+            duplicate_cache.store(post_data, idempotency_key, 200, response_body)
             self._set_response()
-            self.wfile.write(json.dumps({"status": "success", "timestamp": timestamp}).encode())
+            self.wfile.write(response_body)
             
         except Exception as e:
             logging.error(f"Error processing webhook: {e}")
@@ -184,21 +256,18 @@ class WebhookHandler(BaseHTTPRequestHandler):
             self._set_response()
             self.wfile.write(json.dumps({
                 "status": "healthy",
-                "lastUpdate": last_update_time.isoformat() if last_update_time else None
+                "lastUpdate": last_update_time.isoformat() if last_update_time else None,
+                "duplicateCache": duplicate_cache.stats(),
+                "admission": admission.stats()
             }).encode())
         elif self.path == '/status':
-            # Status endpoint
-            self._set_response()
-            status_data = {
-                "controlMode": "manual" if config_state.manualcontrol_mode else "auto" if config_state.autocontrol_mode else "semi",
-                "selectedPole": config_state.selected_pole,
-                "activeRoute": config_state.active_route,
-                "yellowBlink": config_state.all_pole_yellow_blink,
-                "timeZone": config_state.time_zone_number,
-                "lastCommand": config_state.last_command,
-                "lastUpdate": last_update_time.isoformat() if last_update_time else None
-            }
-            self.wfile.write(json.dumps(status_data).encode())
+            # Status endpoint, served from the cached body (304 when unchanged)
+            serve_cached_status(self, status_broadcaster)
+        elif self.path == '/events':
+            # Server-Sent Events stream of status changes and lamp frames
+            serve_event_stream(self, status_broadcaster)
+        elif self.path == '/profile':
+            serve_profile_request(self, profiler)
         else:
             self._set_response(404)
             self.wfile.write(json.dumps({"error": "Not found"}).encode())
@@ -206,7 +275,9 @@ class WebhookHandler(BaseHTTPRequestHandler):
 def run_server():
     """Run the webhook server to receive JSON updates"""
     server_address = ('', SERVER_PORT)
-    httpd = HTTPServer(server_address, WebhookHandler)
+    httpd = ThreadingHTTPServer(server_address, WebhookHandler)
+    httpd.daemon_threads = True
+    backup_store.apply_retention(max_snapshots=BACKUP_MAX_SNAPSHOTS)
     logging.info(f"Starting webhook server on port {SERVER_PORT}")
     
     try:
@@ -233,12 +304,15 @@ def process_json_file():
 def main():
     """Main function to run the JSON receiver"""
     logging.info("Starting Traffic Junction JSON Monitor")
+    install_signal_handler(profiler)
     
     # Process existing JSON file if available
     process_json_file()
     
     # Print initial state
     config_state.print_current_state()
+    status_broadcaster.set_status(status_data())
+    start_frame_listener(status_broadcaster)
     
     # Run the webhook server
     run_server()
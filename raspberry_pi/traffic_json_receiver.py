@@ -5,18 +5,31 @@ import sys
 import os
 from datetime import datetime
 
+from backup_store import BackupStore
+from duplicate_cache import DuplicateCache, IDEMPOTENCY_HEADER
+from manual_commands import CommandError, commands_to_variables, parse_batch
+from wire_format import decode_body, expand
+
 # Configure logging
 import logging
-logging.basicConfig(
-    level=logging.INFO,
+from async_logging import setup_logging
+setup_logging(
+    "traffic_json_receiver.log",
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("traffic_json_receiver.log"),
-        logging.StreamHandler()
-    ]
+    console=True
 )
 logger = logging.getLogger(__name__)
 
+# Content-addressed store for previous variable sets (replaces per-update .bak files)
+BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backups")
+BACKUP_MAX_SNAPSHOTS = 500  # Retention applied to the backup store at startup
+backup_store = BackupStore(BACKUP_DIR)
+
+# Recently handled payloads, so retried deliveries are acknowledged without disk writes
+duplicate_cache = DuplicateCache()
+
+VARIABLES_FILE_PATH = os.path.join(os.path.dirname(__file__), "traffic_variables.py")
+
 # Global variables to store the current state
 current_state = {}
 
@@ -27,6 +40,9 @@ def process_json_data(data):
     try:
         logger.info("Processing received JSON data")
         
+        # Payloads in the compact wire format are expanded first
+        data = expand(data)
+        
         # Create a dictionary to hold all the variables
         variables = {}
         
@@ -61,6 +77,14 @@ def process_json_data(data):
         variables["total_no_of_time_zones"] = data.get("total_no_of_time_zones", 1)
         variables["time_zone_number"] = data.get("time_zone_number", 1)
         
+        # Extract corridor coordination (cycle offsets are per time zone)
+        variables["coordination_enabled"] = data.get("coordination_enabled", False)
+        
+        # Extract semi-actuated timings
+        variables["actuated_min_green_time"] = data.get("actuated_min_green_time", 5)
+        variables["actuated_max_green_time"] = data.get("actuated_max_green_time", 40)
+        variables["actuated_gap_time"] = data.get("actuated_gap_time", 3)
+        
         # Extract time zone data
         for zone in range(1, 9):
             variables[f"time_zone_{zone}_start_hr"] = data.get(f"time_zone_{zone}_start_hr", 12)
@@ -71,6 +95,9 @@ def process_json_data(data):
             # Extract blink mode enabled flag for this time zone
             variables[f"blink_mode_enabled_time_zone_{zone}"] = data.get(f"blink_mode_enabled_time_zone_{zone}", False)
             
+            # Extract the cycle offset from the shared epoch for this time zone
+            variables[f"cycle_offset_time_zone_{zone}"] = data.get(f"cycle_offset_time_zone_{zone}", 0)
+            
             # Extract route sequence for this time zone
             variables[f"route_sequence_{zone}"] = data.get(f"route_sequence_{zone}", [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14])
             
@@ -112,6 +139,11 @@ def handle_webhook(json_data):
         variables = process_json_data(json_data)
         
         if variables:
+            # Unchanged variable sets are acknowledged without rewriting the file
+            if backup_store.save(variables) is None and os.path.exists(VARIABLES_FILE_PATH):
+                logger.info("Configuration unchanged, skipping save")
+                return True
+            
             # Save the variables to a Python file
             save_variables_to_file(variables)
             
@@ -126,24 +158,44 @@ def handle_webhook(json_data):
         logger.error(f"Error handling webhook: {str(e)}")
         return False
 
-def save_variables_to_file(variables):
+def handle_command_batch(commands):
+    """
+    Apply an ordered list of manual commands as one change: all commands are
+    validated before anything is written, then the variables are saved once.
+    Raises CommandError if any command is invalid.
+    """
+    changes = commands_to_variables(commands)
+    variables = backup_store.latest() or process_json_data({})
+    variables.update(changes)
+    
+    global current_state
+    current_state = variables
+    # Resending the last configuration now has to undo this change
+    duplicate_cache.forget_body()
+    
+    if backup_store.save(variables) is None and os.path.exists(VARIABLES_FILE_PATH):
+        logger.info("Command batch left the configuration unchanged")
+        return True
+    
+    if not save_variables_to_file(variables):
+        return False
+    return apply_configuration(variables)
+
+def save_variables_to_file(variables, file_path=None):
     """
     Save the variables to a Python file
     """
     try:
         logger.info("Saving variables to file")
         
-        # Create the file path
-        file_path = os.path.join(os.path.dirname(__file__), "traffic_variables.py")
+        file_path = file_path or VARIABLES_FILE_PATH
         
-        # Create a backup of the existing file if it exists
-        if os.path.exists(file_path):
-            backup_path = f"{file_path}.bak.{int(time.time())}"
-            os.rename(file_path, backup_path)
-            logger.info(f"Created backup of existing file: {backup_path}")
+        # Previous versions are kept in the backup store, so the file is replaced
+        # atomically instead of being renamed to a .bak copy
+        temp_path = f"{file_path}.tmp"
         
         # Write the variables to the file
-        with open(file_path, "w") as f:
+        with open(temp_path, "w") as f:
             f.write("# Traffic Junction Control Variables\n")
             f.write(f"# Generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
             
@@ -255,6 +307,18 @@ def save_variables_to_file(variables):
             for zone in range(1, 9):
                 f.write(f"blink_mode_enabled_time_zone_{zone} = {variables.get(f'blink_mode_enabled_time_zone_{zone}', False)}\n")
             
+            # Write corridor coordination
+            f.write("\n## Coordinated junctions start each cycle at the shared epoch plus the time zone's offset (seconds)\n")
+            f.write(f"coordination_enabled = {variables.get('coordination_enabled', False)}\n")
+            for zone in range(1, 9):
+                f.write(f"cycle_offset_time_zone_{zone} = {variables.get(f'cycle_offset_time_zone_{zone}', 0)}\n")
+            
+            # Write semi-actuated timings
+            f.write("\n## Semi mode with detectors: minimum and maximum green, and the detector gap that ends a green\n")
+            f.write(f"actuated_min_green_time = {variables.get('actuated_min_green_time', 5)}\n")
+            f.write(f"actuated_max_green_time = {variables.get('actuated_max_green_time', 40)}\n")
+            f.write(f"actuated_gap_time = {variables.get('actuated_gap_time', 3)}\n")
+            
             # Write all pole test modes
             f.write("\n## List of variables from control all signals\n")
             f.write(f"all_pole_red_test = {variables.get('all_pole_red_test', False)}\n")
@@ -265,6 +329,7 @@ def save_variables_to_file(variables):
             
             f.write("\n##################################################################################################################\n")
         
+        os.replace(temp_path, file_path)
         logger.info(f"Variables saved to file: {file_path}")
         return True
     except Exception as e:
@@ -299,10 +364,34 @@ def start_webhook_server(port=8080):
     
     app = Flask(__name__)
     
+    # Token buckets per client and endpoint, so a retry storm gets fast 429s (see admission.py)
+    from admission import AdmissionControl
+    admission = AdmissionControl({"/webhook": (2, 10), "/commands/batch": (10, 20)})
+    
+    @app.before_request
+    def admit():
+        lane = "command" if request.path == '/commands/batch' else "bulk"
+        retry_after = admission.check(request.remote_addr, request.path, lane)
+        if retry_after is not None:
+            response = jsonify({"status": "error", "message": "Too many requests", "retryAfter": round(retry_after, 3)})
+            return response, 429, {"Retry-After": str(max(1, int(retry_after + 0.999)))}
+        return None
+    
     @app.route('/webhook', methods=['POST'])
     def webhook():
         try:
-            json_data = request.json
+            # Acknowledge duplicate deliveries with the original response
+            body = request.get_data()
+            idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+            cached = duplicate_cache.lookup(body, idempotency_key)
+            if cached:
+                status_code, response_body = cached
+                return app.response_class(response_body, status=status_code, mimetype="application/json")
+            
+            try:
+                json_data = decode_body(body, request.headers.get('Content-Encoding'))
+            except (ValueError, UnicodeDecodeError) as e:
+                return jsonify({"status": "error", "message": f"Invalid JSON: {e}"}), 400
             
             if not json_data:
                 return jsonify({"status": "error", "message": "No JSON data received"}), 400
@@ -310,13 +399,28 @@ def start_webhook_server(port=8080):
             success = handle_webhook(json_data)
             
             if success:
-                return jsonify({"status": "success", "message": "Configuration applied successfully"}), 200
+                response_body = json.dumps({"status": "success", "message": "Configuration applied successfully"}).encode()
+                duplicate_cache.store(body, idempotency_key, 200, response_body)
+                return app.response_class(response_body, status=200, mimetype="application/json")
             else:
                 return jsonify({"status": "error", "message": "Failed to apply configuration"}), 500
         except Exception as e:
             logger.error(f"Error in webhook endpoint: {str(e)}")
             return jsonify({"status": "error", "message": f"Internal server error: {str(e)}"}), 500
     
+    @app.route('/commands/batch', methods=['POST'])
+    def command_batch():
+        try:
+            commands, batch_id = parse_batch(request.get_json(silent=True))
+            if handle_command_batch(commands):
+                return jsonify({"status": "success", "id": batch_id, "commandCount": len(commands)}), 200
+            return jsonify({"status": "error", "id": batch_id, "message": "Failed to apply commands"}), 500
+        except CommandError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error in command batch endpoint: {str(e)}")
+            return jsonify({"status": "error", "message": f"Internal server error: {str(e)}"}), 500
+    
     @app.route('/status', methods=['GET'])
     def status():
         """
@@ -325,12 +429,19 @@ def start_webhook_server(port=8080):
         return jsonify({
             "status": "running",
             "timestamp": datetime.now().isoformat(),
-            "current_state": current_state
+            "current_state": current_state,
+            "duplicate_cache": duplicate_cache.stats(),
+            "admission": admission.stats()
         }), 200
     
+    backup_store.apply_retention(max_snapshots=BACKUP_MAX_SNAPSHOTS)
     logger.info(f"Starting webhook server on port {port}")
     app.run(host='0.0.0.0', port=port)
 
 if __name__ == "__main__":
+    # On-demand profiling, started with SIGUSR2
+    from profiling import Profiler, install_signal_handler
+    install_signal_handler(Profiler("traffic_json_receiver"))
+    
     # Start the webhook server
     start_webhook_server()
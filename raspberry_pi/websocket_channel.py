@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Minimal WebSocket (RFC 6455) Support for Traffic Junction Receivers
+
+Standard-library WebSocket server helpers for BaseHTTPRequestHandler, plus a
+small client used for benchmarking. Only what the command channel needs is
+implemented: text messages, fragmentation, ping/pong and close. A protocol
+violation (an unmasked client frame, invalid UTF-8, a binary message) ends the
+connection with the matching close status instead of an exception.
+
+Usage from a BaseHTTPRequestHandler:
+    if self.path == '/ws' and is_websocket_request(self):
+        connection = accept(self)
+        for message in connection.messages():
+            connection.send_text(reply)
+"""
+
+import base64
+import hashlib
+import os
+import socket
+import struct
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_UNSUPPORTED_DATA = 1003
+CLOSE_INVALID_DATA = 1007
+CLOSE_TOO_LARGE = 1009
+
+
+class WebSocketError(Exception):
+    """Raised on a protocol violation; code is the close status to answer it with"""
+
+    def __init__(self, message, code=CLOSE_PROTOCOL_ERROR):
+        super().__init__(message)
+        self.code = code
+
+
+def accept_key(key):
+    """Compute the Sec-WebSocket-Accept value for a client key"""
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+
+
+def is_websocket_request(handler):
+    """Check whether an HTTP request asks for a WebSocket upgrade"""
+    return (handler.headers.get('Upgrade', '').lower() == 'websocket'
+            and 'Sec-WebSocket-Key' in handler.headers)
+
+
+def accept(handler):
+    """Complete the upgrade handshake and return the connection"""
+    handler.send_response(101, "Switching Protocols")
+    handler.send_header('Upgrade', 'websocket')
+    handler.send_header('Connection', 'Upgrade')
+    handler.send_header('Sec-WebSocket-Accept', accept_key(handler.headers['Sec-WebSocket-Key']))
+    handler.end_headers()
+    handler.wfile.flush()
+    handler.close_connection = True
+    return WebSocketConnection(handler.rfile, handler.wfile, mask_outgoing=False)
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if data is None or len(data) < size:
+        raise ConnectionResetError("WebSocket closed mid-frame")
+    return data
+
+
+class WebSocketConnection:
+    """Class to exchange WebSocket messages over a pair of binary streams"""
+
+    def __init__(self, rfile, wfile, mask_outgoing):
+        self.rfile = rfile
+        self.wfile = wfile
+        # Clients must mask their frames, servers must not
+        self.mask_outgoing = mask_outgoing
+        self.closed = False
+
+    def _read_frame(self):
+        first, second = _read_exact(self.rfile, 2)
+        fin = bool(first & 0x80)
+        opcode = first & 0x0F
+        masked = bool(second & 0x80)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", _read_exact(self.rfile, 2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", _read_exact(self.rfile, 8))[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise WebSocketError("Frame too large", CLOSE_TOO_LARGE)
+        # Client frames must be masked and server frames must not be (RFC 6455 section 5.1)
+        if masked == self.mask_outgoing:
+            raise WebSocketError("Unmasked client frame" if not masked else "Masked server frame")
+        mask = _read_exact(self.rfile, 4) if masked else None
+        payload = _read_exact(self.rfile, length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return fin, opcode, payload
+
+    def _write_frame(self, opcode, payload):
+        header = bytearray([0x80 | opcode])
+        mask_bit = 0x80 if self.mask_outgoing else 0
+        length = len(payload)
+        if length < 126:
+            header.append(mask_bit | length)
+        elif length < 65536:
+            header.append(mask_bit | 126)
+            header += struct.pack("!H", length)
+        else:
+            header.append(mask_bit | 127)
+            header += struct.pack("!Q", length)
+        if self.mask_outgoing:
+            mask = os.urandom(4)
+            header += mask
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.wfile.write(bytes(header) + payload)
+        self.wfile.flush()
+
+    def receive(self):
+        """Return the next text message, or None once the connection closes"""
+        message = bytearray()
+        message_opcode = None
+        while not self.closed:
+            fin, opcode, payload = self._read_frame()
+            if opcode == OPCODE_CLOSE:
+                self.close()
+                return None
+            if opcode == OPCODE_PING:
+                self._write_frame(OPCODE_PONG, payload)
+                continue
+            if opcode == OPCODE_PONG:
+                continue
+            if opcode == OPCODE_BINARY:
+                raise WebSocketError("Binary messages are not supported", CLOSE_UNSUPPORTED_DATA)
+            if opcode == OPCODE_TEXT and message_opcode is None:
+                message_opcode = opcode
+                message = bytearray(payload)
+            elif opcode == OPCODE_CONTINUATION and message_opcode is not None:
+                message += payload
+                if len(message) > MAX_MESSAGE_SIZE:
+                    raise WebSocketError("Message too large", CLOSE_TOO_LARGE)
+            else:
+                raise WebSocketError(f"Unexpected opcode {opcode}")
+            if fin:
+                try:
+                    return message.decode()
+                except UnicodeDecodeError:
+                    raise WebSocketError("Text message is not valid UTF-8", CLOSE_INVALID_DATA)
+        return None
+
+    def messages(self):
+        """Iterate over text messages until the peer disconnects or breaks the protocol"""
+        try:
+            while True:
+                message = self.receive()
+                if message is None:
+                    return
+                yield message
+        except WebSocketError as e:
+            self.close(e.code)
+        except (ConnectionResetError, BrokenPipeError):
+            self.closed = True
+
+    def send_text(self, text):
+        self._write_frame(OPCODE_TEXT, text.encode())
+
+    def close(self, code=None):
+        if not self.closed:
+            self.closed = True
+            try:
+                self._write_frame(OPCODE_CLOSE, struct.pack("!H", code) if code else b"")
+            except OSError:
+                pass
+
+
+def connect(host, port, path="/ws", timeout=10):
+    """Open a client WebSocket connection (used for benchmarking)"""
+    sock = socket.create_connection((host, port), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    key = base64.b64encode(os.urandom(16)).decode()
+    request = (
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\n"
+        "Sec-WebSocket-Version: 13\r\n\r\n"
+    )
+    sock.sendall(request.encode())
+
+    rfile = sock.makefile("rb")
+    status_line = rfile.readline().decode()
+    headers = {}
+    while True:
+        line = rfile.readline().decode().strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if " 101 " not in status_line or headers.get("sec-websocket-accept") != accept_key(key):
+        sock.close()
+        raise WebSocketError(f"Handshake failed: {status_line.strip()}")
+
+    connection = WebSocketConnection(rfile, sock.makefile("wb"), mask_outgoing=True)
+    connection.sock = sock
+    return connection
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Compact Wire Format for Traffic Junction Configurations
+
+An optional, smaller encoding of the configuration payloads pushed to the Pi.
+It is still a JSON object, so signatures, backups and the duplicate cache
+work unchanged, but the two bulkiest parts are packed:
+
+    route_matrix   each route's 48 lamp values (8 poles x 6 lights) become one
+                   48-bit integer, bit i holding route_config[i]
+    timings        the ~540 integer timing keys (pole timings, per-zone timings
+                   and zone start/end times) become one base64 uint16 array in
+                   the fixed TIMING_KEYS order; NO_VALUE marks an absent key
+
+    {"wireFormat": 1, "routes": [...], "timings": "...", <other keys as-is>}
+
+Values that cannot be packed (a route row that is not 48 lamp values, a timing
+outside 0-65534) are kept as plain JSON keys, so encoding never loses data.
+Unpacked lamp values come back as 0/1 integers.
+
+The body may also be compressed and sent with Content-Encoding: deflate or gzip.
+decode_body() handles both layers; process_json_data() accepts either format.
+
+Usage:
+    python3 wire_format.py --bench
+"""
+
+import base64
+import json
+import struct
+import time
+import zlib
+
+WIRE_FORMAT_VERSION = 1
+POLES = ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]
+ROUTE_LIGHTS = ["red", "yellow", "greenLeft", "greenStraight", "greenRight", "GA"]
+ROUTE_BITS = len(POLES) * len(ROUTE_LIGHTS)
+TIMINGS = ["red", "yel", "grnL", "grnS", "grnR", "ped", "buz"]
+NO_VALUE = 0xFFFF
+MAX_DECODED_SIZE = 4 * 1024 * 1024  # Refuse bodies that inflate beyond this
+
+
+def _timing_keys():
+    keys = ["all_pole_yellow_time"]
+    keys += [f"pole_{pole}_{timing}_time" for pole in POLES for timing in TIMINGS]
+    for zone in range(1, 9):
+        keys += [
+            f"time_zone_{zone}_start_hr",
+            f"time_zone_{zone}_start_min",
+            f"time_zone_{zone}_end_hr",
+            f"time_zone_{zone}_end_min",
+        ]
+        keys += [f"pole_{pole}_{timing}_time_time_zone_{zone}" for pole in POLES for timing in TIMINGS]
+    return keys
+
+
+# The order is part of the format: append new keys, never reorder
+TIMING_KEYS = _timing_keys()
+
+
+def pack_route(route_config):
+    """Pack one route's lamp values into an integer, or return None if it does not fit"""
+    if len(route_config) != ROUTE_BITS:
+        return None
+    value = 0
+    for index, lamp in enumerate(route_config):
+        if lamp not in (0, 1):  # also accepts True/False
+            return None
+        if lamp:
+            value |= 1 << index
+    return value
+
+
+def unpack_route(value):
+    """Expand a packed route into its list of 0/1 lamp values"""
+    return [(value >> index) & 1 for index in range(ROUTE_BITS)]
+
+
+def _packable_timing(value):
+    return type(value) is int and 0 <= value < NO_VALUE
+
+
+def compact(data):
+    """Return the compact form of a configuration dict"""
+    result = {key: value for key, value in data.items() if key != "route_matrix"}
+    result["wireFormat"] = WIRE_FORMAT_VERSION
+
+    if "route_matrix" in data:
+        routes = [pack_route(row) for row in data["route_matrix"]]
+        if None in routes:
+            result["route_matrix"] = data["route_matrix"]
+        else:
+            result["routes"] = routes
+
+    values = []
+    for key in TIMING_KEYS:
+        value = data.get(key)
+        if key in data and _packable_timing(value):
+            values.append(value)
+            del result[key]
+        else:
+            values.append(NO_VALUE)
+    result["timings"] = base64.b64encode(struct.pack(f"<{len(values)}H", *values)).decode()
+    return result
+
+
+def is_compact(data):
+    return isinstance(data, dict) and "wireFormat" in data
+
+
+def expand(data):
+    """Return the plain form of a configuration; plain configurations are returned as-is"""
+    if not is_compact(data):
+        return data
+    if data["wireFormat"] != WIRE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported wire format version: {data['wireFormat']}")
+
+    # Malformed compact fields raise ValueError, which the receivers answer with 400
+    result = {key: value for key, value in data.items() if key not in ("wireFormat", "routes", "timings")}
+    if "routes" in data:
+        routes = data["routes"]
+        if not isinstance(routes, list) or not all(type(value) is int and 0 <= value < 1 << ROUTE_BITS
+                                                   for value in routes):
+            raise ValueError(f"routes must be a list of integers from 0 to {(1 << ROUTE_BITS) - 1}")
+        result["route_matrix"] = [unpack_route(value) for value in routes]
+
+    if "timings" in data:
+        if not isinstance(data["timings"], str):
+            raise ValueError("timings must be a base64 string")
+        packed = base64.b64decode(data["timings"], validate=True)
+        if len(packed) % 2:
+            raise ValueError(f"timings must hold 16-bit values, got {len(packed)} bytes")
+        values = struct.unpack(f"<{len(packed) // 2}H", packed)
+        for key, value in zip(TIMING_KEYS, values):
+            if value != NO_VALUE:
+                result[key] = value
+    return result
+
+
+def decompress(body, content_encoding=None):
+    """Undo a Content-Encoding of deflate (zlib) or gzip"""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return body
+    if encoding not in ("deflate", "gzip"):
+        raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+    # wbits 47 accepts both zlib and gzip headers
+    decompressor = zlib.decompressobj(47)
+    try:
+        data = decompressor.decompress(body, MAX_DECODED_SIZE)
+    except zlib.error as e:
+        raise ValueError(f"Invalid {encoding} body: {e}")
+    if decompressor.unconsumed_tail:
+        raise ValueError("Decoded body is too large")
+    return data
+
+
+def decode_body(body, content_encoding=None):
+    """Parse a request body in either format into a plain configuration dict"""
+    return expand(json.loads(decompress(body, content_encoding).decode()))
+
+
+def encode_body(data, compress=True):
+    """Encode a configuration for sending; returns (body, content_encoding)"""
+    body = json.dumps(compact(data), separators=(",", ":")).encode()
+    if compress:
+        return zlib.compress(body, 9), "deflate"
+    return body, None
+
+
+def sample_config(routes=14):
+    """Build a fully populated configuration for benchmarking"""
+    data = {
+        "manualcontrol_mode": False,
+        "autocontrol_mode": True,
+        "semicontrol_mode": False,
+        "use_time_zone": True,
+        "total_no_of_time_zones": 8,
+        "time_zone_number": 1,
+    }
+    for index, key in enumerate(TIMING_KEYS):
+        data[key] = index % 60 + 1
+    data["route_matrix"] = [[int((route * 7 + bit) % 3 == 0) for bit in range(ROUTE_BITS)]
+                            for route in range(routes)]
+    for zone in range(1, 9):
+        data[f"route_sequence_{zone}"] = list(range(1, routes + 1))
+    return data
+
+
+def benchmark(rounds=500):
+    """Compare payload size and parse time of the JSON and compact formats"""
+    data = sample_config()
+    variants = [
+        ("JSON, indent=2", json.dumps(data, indent=2).encode(), None),
+        ("JSON, no whitespace", json.dumps(data, separators=(",", ":")).encode(), None),
+        ("compact", *encode_body(data, compress=False)),
+        ("compact + deflate", *encode_body(data, compress=True)),
+    ]
+
+    print(f"{'format':<22}{'bytes':>8}{'parse us':>12}")
+    for name, body, encoding in variants:
+        assert decode_body(body, encoding) == data
+        start = time.perf_counter()
+        for _ in range(rounds):
+            decode_body(body, encoding)
+        elapsed = (time.perf_counter() - start) / rounds
+        print(f"{name:<22}{len(body):>8}{elapsed * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark()
+    else:
+        print(__doc__)
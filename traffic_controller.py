@@ -3,16 +3,19 @@
 Traffic Controller for Raspberry Pi
 
 This script controls the GPIO pins based on the configuration received from the web interface.
-It reads the traffic_start_variables.py file and applies the settings to the GPIO pins.
+It reads the ingest service's state journal (or the traffic_start_variables.py file) and
+applies the settings to the GPIO pins.
 """
 
 import os
+import bisect
 import time
 import logging
 import threading
 import importlib
 import sys
 import json
+import socket
 from datetime import datetime
 
 # Try to import RPi.GPIO, but provide a mock if not available (for development)
@@ -55,16 +58,103 @@ except ImportError:
     
     GPIO = MockGPIO()
 
+# Log through a background writer when async_logging.py is deployed alongside
+try:
+    from async_logging import setup_logging
+except ImportError:
+    setup_logging = None
+
+# On-demand profiling (SIGUSR2) when profiling.py is deployed alongside
+try:
+    from profiling import Profiler, install_signal_handler
+except ImportError:
+    Profiler = None
+
+# Read the variables from the ingest service's journal when config_journal.py is deployed alongside
+try:
+    from config_journal import journal_exists, journal_signature, read_state_with_seq
+except ImportError:
+    read_state_with_seq = None
+
+# Detector inputs for semi-actuated control when detectors.py is deployed alongside
+try:
+    from detectors import DetectorInputs, GPIOBackend, MockBackend, mock_mapping
+except ImportError:
+    DetectorInputs = None
+
+# Emergency, manual override and transit preemption when preemption.py is deployed alongside
+try:
+    from preemption import PreemptionQueue
+except ImportError:
+    PreemptionQueue = None
+
+# Real-time scheduling for the control thread when realtime.py is deployed alongside
+try:
+    from realtime import GCScheduler, enable_realtime, set_fifo
+except ImportError:
+    enable_realtime = None
+
 # Configuration
 VARIABLES_FILE = "/home/pi/traffic_junction/traffic_start_variables.py"
+JOURNAL_DIR = "/home/pi/traffic_junction/journal"  # Used instead of VARIABLES_FILE once it exists
+MANUAL_JOURNAL_GRACE = 5.0  # Longest older journal state is held off after a manual change, waiting for its commit (seconds)
 LOG_FILE = "/home/pi/traffic_junction/traffic_controller.log"
+NOTIFY_PORT = 8091  # UDP port the ingest service uses to announce a new configuration
+FRAME_PUBLISH_ADDRESS = ("127.0.0.1", 8092)  # Ingest service status stream for lamp frames
+TICK_INTERVAL = 0.1  # Longest the control loop sleeps between heartbeats (seconds)
+WATCHDOG_CHECK_INTERVAL = 0.1  # How often the watchdog checks the heartbeat (seconds)
+WATCHDOG_DEADLINE = 0.5  # Heartbeat age treated as a stalled control loop (seconds)
+WATCHDOG_FAIL_SAFE_TIME = 3.0  # All-yellow flash before a stalled loop is restarted (seconds)
+WATCHDOG_MAX_RESTARTS = 5  # Restarts allowed per window before staying in fail-safe flash
+WATCHDOG_RESTART_WINDOW = 300  # seconds
+BLINK_INTERVAL = 0.5  # Half of the yellow blink period (seconds)
+CYCLE_EPOCH = 0  # Unix time coordinated junctions anchor their cycles to (see green_wave.py)
+ACTUATED_MIN_GREEN = 5  # Semi mode defaults when the variables have no actuated_* timings (seconds)
+ACTUATED_MAX_GREEN = 40
+ACTUATED_GAP = 3  # A green ends once its detectors have been quiet this long while others wait
+PREEMPT_MIN_YELLOW = 3  # Shortest yellow when a preemption clears poles the plan has no clearance for (seconds)
+PREEMPT_ALL_RED = 2  # Red on the cleared poles before the next green (seconds)
+JITTER_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500]  # Upper bounds of the sleep lateness histogram
+REALTIME_MODE = False  # SCHED_FIFO, CPU pinning, locked memory and scheduled GC (also --realtime, see realtime.py)
+REALTIME_PRIORITY = 50  # SCHED_FIFO priority of the control thread; the watchdog runs one above
+REALTIME_CPU = None  # CPU the control thread is pinned to (None: the last one)
+
+
+def sd_notify(state):
+    """Send a state such as READY=1 or WATCHDOG=1 to systemd (Type=notify services)"""
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+        return True
+    except OSError as e:
+        logging.debug(f"Could not notify systemd: {e}")
+        return False
+
+
+def watchdog_ping_interval():
+    """Half of the systemd WatchdogSec setting, or one second"""
+    try:
+        return int(os.environ["WATCHDOG_USEC"]) / 2e6
+    except (KeyError, ValueError):
+        return 1.0
+
 
-# Setup logging
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+def configure_logging():
+    """Send log records to LOG_FILE without blocking the control loop on the SD card"""
+    if setup_logging:
+        setup_logging(LOG_FILE)
+    else:
+        logging.basicConfig(
+            filename=LOG_FILE,
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s'
+        )
 
 # GPIO pin mapping for each pole and light
 # Format: {pole_name: {light_type: gpio_pin}}
@@ -110,11 +200,6 @@ GPIO_MAPPING = {
         "greenLeft": 3,
         "greenStraight": 2,
         "greenRight": 0
-    },  14,
-        "yellow": 4,
-        "greenLeft": 3,
-        "greenStraight": 2,
-        "greenRight": 0
     },
     "4A": {
         "red": 1,
@@ -132,6 +217,10 @@ GPIO_MAPPING = {
     }
 }
 
+# Detector inputs per pole for semi mode: {pole: {"vehicle": gpio_pin, "pedestrian": gpio_pin}}
+# Left empty, semi mode runs the fixed-time sequence. Use pins the lamps above do not use.
+DETECTOR_MAPPING = {}
+
 class TrafficController:
     """Class to control traffic lights based on configuration"""
     
@@ -140,8 +229,58 @@ class TrafficController:
         self.running = False
         self.current_route = 1
         self.current_time_zone = 1
+        self._logged_time_zone = None
         self.control_thread = None
         
+        # Variables are only reloaded when the file changes or a reload is announced
+        self._variables_mtime = None
+        self._reload_requested = threading.Event()
+        self.notify_thread = None
+        # Correlation ID of the announced reload, and of the change the next lamp frame carries back
+        self._reload_correlation = None
+        self._frame_trace = None
+        # Journal sequence number of the latest manual change applied over UDP; older journal state is not loaded over it
+        self._manual_seq = 0
+        self._manual_deadline = 0.0
+        
+        # Control loop heartbeat, checked by the watchdog thread
+        self.heartbeat = 0
+        self._last_tick = time.monotonic()
+        self.watchdog_thread = None
+        self.fail_safe = False
+        self.fail_safe_latched = False
+        # Bumped by each recovery; a control loop left behind by one may no longer drive the lamps
+        self._generation = 0
+        self._loop_local = threading.local()
+        self.stall_count = 0
+        self.last_stall = None
+        self._restart_times = []
+        self._last_watchdog_ping = 0.0
+        # How late each control loop sleep woke up, counted per JITTER_BUCKETS_MS bucket (last one is above)
+        self.jitter_counts = [0] * (len(JITTER_BUCKETS_MS) + 1)
+        self.profiler = Profiler("traffic_controller") if Profiler else None
+        
+        # Opt-in real-time scheduling (see _enter_realtime) and the route lamp writes compiled per variables
+        self.realtime = REALTIME_MODE
+        self.realtime_status = None
+        self.gc_scheduler = None
+        self._route_cache = (None, {})
+        
+        # Detector inputs (see start_detectors) and the semi mode route being served
+        self.detectors = None
+        self._actuated = None
+        self._actuated_phases = None
+        
+        # Preemption requests (see preemption.py), read through the module clock like the detectors
+        self.preemptions = PreemptionQueue(clock=lambda: time.monotonic()) if PreemptionQueue else None
+        
+        # Last state written to each lamp (0 off, 1 on, 2 blinking), announced on change
+        self.lamp_states = {pole: {light: 0 for light in lights} for pole, lights in GPIO_MAPPING.items()}
+        self._published_frame = None
+        self._frame_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Serializes lamp writes between the control loop and immediate manual commands
+        self._frame_lock = threading.RLock()
+        
         # Initialize GPIO
         if GPIO_AVAILABLE:
             GPIO.setmode(GPIO.BCM)
@@ -155,11 +294,42 @@ class TrafficController:
                 GPIO.output(pin, GPIO.LOW)  # Start with all lights off
         logging.info("GPIO pins initialized")
     
+    def _use_journal(self):
+        return read_state_with_seq is not None and journal_exists(JOURNAL_DIR)
+    
+    def _variables_version(self):
+        """Value that changes whenever the variables source is written"""
+        if self._use_journal():
+            return journal_signature(JOURNAL_DIR)
+        return os.stat(VARIABLES_FILE).st_mtime
+    
     def load_variables(self):
-        """Load variables from the traffic_start_variables.py file"""
+        """Load variables from the journal, or from the traffic_start_variables.py file"""
         try:
+            self._reload_requested.clear()
+            self._variables_mtime = self._variables_version()
+            correlation_id, self._reload_correlation = self._reload_correlation, None
+            
+            if self._use_journal():
+                seq, variables = read_state_with_seq(JOURNAL_DIR)
+                with self._frame_lock:
+                    if seq < self._manual_seq and time.monotonic() < self._manual_deadline:
+                        # Checked again on the next pass, until the group commit covering the manual change is written
+                        logging.debug(f"Journal at sequence {seq} predates manual change {self._manual_seq}; "
+                                      f"keeping the current variables")
+                        self._variables_mtime = None
+                        self._reload_correlation = self._reload_correlation or correlation_id
+                        return True
+                    self.variables = variables
+                logging.info(f"Successfully loaded {len(self.variables)} variables from {JOURNAL_DIR}")
+                if self.variables.get('use_time_zone', False):
+                    self._determine_current_time_zone()
+                self._trace_next_frame(correlation_id, loadedAt=time.time())
+                return True
+            
             # Add the directory containing the file to the Python path
-            sys.path.append(os.path.dirname(VARIABLES_FILE))
+            if os.path.dirname(VARIABLES_FILE) not in sys.path:
+                sys.path.append(os.path.dirname(VARIABLES_FILE))
             
             # Import the module
             module_name = os.path.basename(VARIABLES_FILE).replace('.py', '')
@@ -181,11 +351,79 @@ class TrafficController:
             if self.variables.get('use_time_zone', False):
                 self._determine_current_time_zone()
             
+            self._trace_next_frame(correlation_id, loadedAt=time.time())
             return True
         except Exception as e:
             logging.error(f"Error loading variables from {VARIABLES_FILE}: {e}")
             return False
     
+    def _variables_changed(self):
+        """Check whether the variables file needs to be reloaded"""
+        if self._reload_requested.is_set():
+            return True
+        try:
+            return self._variables_version() != self._variables_mtime
+        except OSError:
+            return False
+    
+    def _start_notify_listener(self):
+        """Listen for reload announcements, manual commands and stats requests"""
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", NOTIFY_PORT))
+        except OSError as e:
+            logging.warning(f"Reload notifications unavailable on port {NOTIFY_PORT}: {e}")
+            return
+        
+        def listen():
+            while True:
+                try:
+                    data, sender = sock.recvfrom(65536)
+                    message = json.loads(data.decode())
+                    if message.get("event") == "reload":
+                        logging.info(f"Reload announced for configuration {message.get('digest', '')[:12]}")
+                        self._reload_correlation = message.get("correlationId")
+                        self._reload_requested.set()
+                    elif message.get("event") == "manual":
+                        applied_at = self.apply_manual_changes(message.get("set", {}), message.get("correlationId"),
+                                                               message.get("seq"))
+                        reply = {"id": message.get("id"), "appliedAt": applied_at}
+                        sock.sendto(json.dumps(reply).encode(), sender)
+                    elif message.get("event") == "stats":
+                        sock.sendto(json.dumps(self.stats()).encode(), sender)
+                    elif message.get("event") == "detector" and self.detectors:
+                        self.detectors.actuate(message.get("pole"), message.get("kind", "vehicle"))
+                    elif message.get("event") == "preempt":
+                        self._request_preemption(message, sock, sender)
+                    elif message.get("event") == "release":
+                        released = bool(self.preemptions) and self.preemptions.release(message.get("id"))
+                        sock.sendto(json.dumps({"id": message.get("id"), "released": released}).encode(), sender)
+                except Exception as e:
+                    logging.error(f"Error reading reload notification: {e}")
+        
+        self.notify_thread = threading.Thread(target=listen, daemon=True)
+        self.notify_thread.start()
+    
+    def _request_preemption(self, message, sock, sender):
+        """Queue a preempt event; the reply goes out once its clearance starts, or now if it is rejected"""
+        def reply(request):
+            sock.sendto(json.dumps({"id": message.get("id"), "clearanceStartedAt": request.clearance_started,
+                                    "latencyMs": round(request.latency_ms, 3)}).encode(), sender)
+        
+        try:
+            if not self.preemptions:
+                raise ValueError("preemption.py is not deployed")
+            if self.variables.get('manualcontrol_mode', False):
+                raise ValueError("the controller is in manual control mode")
+            route = message.get("route")
+            if not isinstance(route, int) or not 0 < route <= len(self.variables.get('route_matrix', [])):
+                raise ValueError(f"Route {route!r} has no row in the route matrix")
+            self.preemptions.request(route, message.get("kind", "emergency"), message.get("hold"),
+                                     message.get("id"), on_clearance=reply)
+        except ValueError as e:
+            logging.warning(f"Rejected preemption {message.get('id')}: {e}")
+            sock.sendto(json.dumps({"id": message.get("id"), "error": str(e)}).encode(), sender)
+    
     def _determine_current_time_zone(self):
         """Determine the current time zone based on the current time"""
         try:
@@ -215,10 +453,33 @@ class TrafficController:
                         self.current_time_zone = zone
                         break
             
-            logging.info(f"Current time zone determined to be {self.current_time_zone}")
+            # Checked on every loop iteration, so only changes are logged
+            if self.current_time_zone != self._logged_time_zone:
+                self._logged_time_zone = self.current_time_zone
+                logging.info(f"Current time zone determined to be {self.current_time_zone}")
         except Exception as e:
             logging.error(f"Error determining current time zone: {e}")
     
+    def start_detectors(self, mock=False):
+        """Read detector inputs for semi mode: DETECTOR_MAPPING on the GPIO, or every pole through a mock backend"""
+        if DetectorInputs is None:
+            logging.warning("detectors.py not deployed, semi mode runs the fixed-time sequence")
+            return
+        if mock:
+            mapping, backend = mock_mapping(), MockBackend()
+        elif DETECTOR_MAPPING and GPIO_AVAILABLE:
+            mapping, backend = DETECTOR_MAPPING, GPIOBackend(GPIO)
+        else:
+            return
+        try:
+            # Read the clock through the module so a virtual clock applies to detections too
+            self.detectors = DetectorInputs(mapping, backend, clock=lambda: time.monotonic())
+            self.detectors.start()
+            logging.info(f"Detector inputs started ({'mock' if mock else 'GPIO'})")
+        except Exception as e:
+            self.detectors = None
+            logging.error(f"Error starting detector inputs: {e}")
+    
     def start_control(self):
         """Start the traffic control process"""
         if self.running:
@@ -226,19 +487,207 @@ class TrafficController:
             return
         
         self.running = True
+        if self.notify_thread is None:
+            self._start_notify_listener()
+        self._start_control_thread()
+        if self.watchdog_thread is None:
+            self.watchdog_thread = threading.Thread(target=self._watchdog_loop)
+            self.watchdog_thread.daemon = True
+            self.watchdog_thread.start()
+        sd_notify("READY=1")
+        logging.info("Traffic control started")
+    
+    def _start_control_thread(self):
+        self._tick()
         self.control_thread = threading.Thread(target=self._control_loop)
         self.control_thread.daemon = True
         self.control_thread.start()
-        logging.info("Traffic control started")
     
     def stop_control(self):
         """Stop the traffic control process"""
         self.running = False
-        if self.control_thread:
-            self.control_thread.join(timeout=2.0)
+        for thread in (self.control_thread, self.watchdog_thread):
+            if thread:
+                thread.join(timeout=2.0)
+        self.watchdog_thread = None
         self._turn_off_all_lights()
         logging.info("Traffic control stopped")
     
+    def _tick(self):
+        """Record that the control loop is alive"""
+        self.heartbeat += 1
+        self._last_tick = time.monotonic()
+        if self.profiler:
+            self.profiler.checkpoint()
+    
+    def _loop_active(self):
+        """Whether the calling thread is the current, running control loop"""
+        return self.running and threading.current_thread() is self.control_thread
+    
+    def _wait(self, seconds, interruptible=True):
+        """
+        Sleep in heartbeat-sized steps; returns False once this loop should stop.
+        An interruptible wait also ends as soon as a preemption is due.
+        """
+        deadline = time.monotonic() + seconds
+        while self._loop_active():
+            self._tick()
+            if interruptible and self._preemption_due():
+                return True
+            now = time.monotonic()
+            remaining = deadline - now
+            if remaining <= 0:
+                return True
+            step = min(TICK_INTERVAL, remaining)
+            if self.gc_scheduler:
+                # Collect garbage in the slack before the deadline rather than when allocations
+                # trigger it; a collection that overruns the step counts as lateness
+                self.gc_scheduler.idle(remaining)
+                if self._sleep(max(now + step - time.monotonic(), 0)):
+                    continue
+            elif self._sleep(step):
+                continue
+            lateness_ms = (time.monotonic() - now - step) * 1000
+            self.jitter_counts[bisect.bisect_left(JITTER_BUCKETS_MS, lateness_ms)] += 1
+        return False
+    
+    def _sleep(self, seconds):
+        """Sleep, waking early when a preemption request arrives; returns whether it was woken"""
+        if not self.preemptions:
+            time.sleep(seconds)
+            return False
+        woken = self.preemptions.wake.wait(seconds)
+        self.preemptions.wake.clear()
+        return woken
+    
+    def stats(self):
+        """Heartbeat and timing counters, answered to {"event": "stats"} on the notify port"""
+        return {
+            "time": time.time(),
+            "heartbeat": self.heartbeat,
+            "jitterBucketsMs": JITTER_BUCKETS_MS,
+            "jitterCounts": list(self.jitter_counts),
+            "stalls": self.stall_count,
+            "failSafe": self.fail_safe,
+            "detectors": self.detectors.stats() if self.detectors else None,
+            "preemption": self.preemptions.stats() if self.preemptions else None,
+            "realtime": self.realtime_status,
+            "gc": self.gc_scheduler.stats() if self.gc_scheduler else None,
+        }
+    
+    def _enter_realtime(self):
+        """Give the calling control thread real-time scheduling, and start scheduled GC once"""
+        if enable_realtime is None:
+            logging.warning("realtime.py not deployed, the control loop runs at normal priority")
+            self.realtime = False
+            return
+        self.realtime_status = enable_realtime(REALTIME_PRIORITY, REALTIME_CPU)
+        if self.gc_scheduler is None:
+            self.gc_scheduler = GCScheduler()
+            self.gc_scheduler.start()
+    
+    def _watchdog_loop(self):
+        """Restart a stalled or crashed control loop, flashing all yellow meanwhile"""
+        if self.realtime and enable_realtime is not None:
+            # Above the control thread, so a spinning loop cannot starve its watchdog
+            set_fifo(REALTIME_PRIORITY + 1)
+        while self.running:
+            time.sleep(WATCHDOG_CHECK_INTERVAL)
+            stall = time.monotonic() - self._last_tick
+            thread_died = self.control_thread is not None and not self.control_thread.is_alive()
+            if self.running and (stall > WATCHDOG_DEADLINE or thread_died):
+                self._recover_from_stall(stall, thread_died)
+            self._watchdog_ping()
+    
+    def _watchdog_ping(self):
+        """Tell systemd the controller is alive, unless it gave up on the control loop"""
+        now = time.monotonic()
+        if not self.fail_safe_latched and now - self._last_watchdog_ping >= watchdog_ping_interval():
+            self._last_watchdog_ping = now
+            sd_notify("WATCHDOG=1")
+    
+    def _recover_from_stall(self, stall, thread_died):
+        """Drive the fail-safe flash, then start a new control loop"""
+        self.stall_count += 1
+        self.last_stall = {"time": time.time(), "stallSeconds": round(stall, 3), "threadDied": thread_died}
+        reason = "stopped" if thread_died else "stalled"
+        logging.error(f"Control loop {reason}, no heartbeat for {stall:.3f}s; flashing all yellow")
+        
+        # The old thread is abandoned; it exits at its next wait if it ever resumes, and
+        # cannot write its lamps over the flash meanwhile (see _may_drive_lamps)
+        with self._frame_lock:
+            self.fail_safe = True
+            self._generation += 1
+            self.control_thread = None
+        self._flash_all_yellow(WATCHDOG_FAIL_SAFE_TIME)
+        
+        now = time.monotonic()
+        self._restart_times = [t for t in self._restart_times if now - t < WATCHDOG_RESTART_WINDOW]
+        if len(self._restart_times) >= WATCHDOG_MAX_RESTARTS:
+            # Without pings systemd restarts the whole process
+            logging.error(f"Control loop failed {len(self._restart_times)} times, staying in fail-safe flash")
+            self.fail_safe_latched = True
+            while self.running:
+                self._flash_all_yellow(1.0)
+            return
+        
+        self._restart_times.append(now)
+        if self.running:
+            self.fail_safe = False
+            self._start_control_thread()
+            logging.info("Control loop restarted")
+    
+    def _flash_all_yellow(self, duration):
+        """Flash every yellow lamp from the watchdog thread for a while"""
+        end = time.monotonic() + duration
+        while self.running and time.monotonic() < end:
+            self._write_blink_frame(int(time.monotonic() / BLINK_INTERVAL) % 2 == 0, "fail_safe")
+            self._watchdog_ping()
+            time.sleep(BLINK_INTERVAL)
+    
+    def _may_drive_lamps(self):
+        """
+        Whether the calling thread may write the lamps: a control loop only if
+        no recovery has replaced it, and during the fail-safe flash only the
+        watchdog. Checked under the frame lock, which recovery takes to switch.
+        """
+        generation = getattr(self._loop_local, 'generation', None)
+        if generation is not None:
+            return generation == self._generation and not self.fail_safe
+        return not self.fail_safe or threading.current_thread() is self.watchdog_thread
+    
+    def _set_light(self, pole, light, on, state=None):
+        """Drive one lamp and record its state for the lamp frame"""
+        if pole in GPIO_MAPPING and light in GPIO_MAPPING[pole]:
+            with self._frame_lock:
+                if not self._may_drive_lamps():
+                    return
+                GPIO.output(GPIO_MAPPING[pole][light], GPIO.HIGH if on else GPIO.LOW)
+                self.lamp_states[pole][light] = int(bool(on)) if state is None else state
+    
+    def _trace_next_frame(self, correlation_id, **stamps):
+        """Have the next lamp frame carry a change's correlation ID (and stamps) back to the ingest service"""
+        if correlation_id:
+            self._frame_trace = {"correlationId": correlation_id, **stamps}
+    
+    def _publish_frame(self, mode, route=None):
+        """Announce the current lamp frame to the status stream when it changes, or when it carries a trace"""
+        if not self._may_drive_lamps():
+            return
+        frame = {"mode": mode, "route": route, "lights": self.lamp_states}
+        encoded = json.dumps(frame, sort_keys=True)
+        if encoded == self._published_frame and self._frame_trace is None:
+            return
+        self._published_frame = encoded
+        try:
+            # Like the time, the trace is left out of the comparison with the last frame
+            trace, self._frame_trace = self._frame_trace, None
+            frame.update(trace or {})
+            frame["time"] = time.time()
+            self._frame_socket.sendto(json.dumps(frame).encode(), FRAME_PUBLISH_ADDRESS)
+        except OSError as e:
+            logging.debug(f"Could not publish lamp frame: {e}")
+    
     def _turn_off_all_lights(self):
         """Turn off all traffic lights"""
         if GPIO_AVAILABLE:
@@ -249,14 +698,22 @@ class TrafficController:
     
     def _control_loop(self):
         """Main control loop for traffic lights"""
+        self._loop_local.generation = self._generation
         try:
-            while self.running:
-                # Reload variables to get the latest settings
-                self.load_variables()
+            if self.realtime:
+                self._enter_realtime()
+            while self._loop_active():
+                self._tick()
+                
+                # Reload variables when the settings have changed
+                if self._variables_changed():
+                    self.load_variables()
                 
                 # Check control mode
                 if self.variables.get('manualcontrol_mode', False):
                     self._handle_manual_control()
+                elif self._preemption_due():
+                    self._handle_preemption()
                 elif self.variables.get('autocontrol_mode', False):
                     self._handle_auto_control()
                 elif self.variables.get('semicontrol_mode', False):
@@ -266,14 +723,42 @@ class TrafficController:
                     self._handle_auto_control()
                 
                 # Sleep briefly to prevent CPU hogging
-                time.sleep(0.1)
+                self._wait(0.1)
         except Exception as e:
+            # The watchdog notices the loop has ended and restarts it
             logging.error(f"Error in control loop: {e}")
-            self.running = False
+    
+    def apply_manual_changes(self, changes, correlation_id=None, seq=None):
+        """
+        Apply manual control variables immediately, without waiting for the
+        control loop or a file reload. seq is the change's journal sequence
+        number, if it has one. Returns the time the lamps were written, or
+        None if the controller is not in manual mode.
+        """
+        with self._frame_lock:
+            self.variables.update(changes)
+            if seq:
+                self._manual_seq = max(self._manual_seq, seq)
+                self._manual_deadline = time.monotonic() + MANUAL_JOURNAL_GRACE
+            if not self.variables.get('manualcontrol_mode', False):
+                return None
+            self._trace_next_frame(correlation_id)
+            self._write_manual_frame()
+            return time.time()
     
     def _handle_manual_control(self):
         """Handle manual control mode"""
         try:
+            self._write_manual_frame()
+            
+            # Sleep to prevent rapid changes
+            self._wait(0.5)
+        except Exception as e:
+            logging.error(f"Error in manual control: {e}")
+    
+    def _write_manual_frame(self):
+        """Set the lights from the manual control variables"""
+        with self._frame_lock:
             # In manual mode, directly set the lights based on manual control variables
             for pole in ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]:
                 for light in ["red", "yel", "grnL", "grnS", "grnR", "yel_blink"]:
@@ -295,24 +780,23 @@ class TrafficController:
                             "grnR": "greenRight"
                         }.get(light)
                         
-                        if gpio_light and pole in GPIO_MAPPING and gpio_light in GPIO_MAPPING[pole]:
-                            pin = GPIO_MAPPING[pole][gpio_light]
-                            GPIO.output(pin, GPIO.HIGH if light_state else GPIO.LOW)
+                        if gpio_light:
+                            self._set_light(pole, gpio_light, light_state)
             
-            # Sleep to prevent rapid changes
-            time.sleep(0.5)
-        except Exception as e:
-            logging.error(f"Error in manual control: {e}")
+            self._publish_frame("manual")
+    
+    def _active_time_zone(self):
+        """The time zone to run now: the current one if time zones are used, else 1"""
+        if self.variables.get('use_time_zone', False):
+            self._determine_current_time_zone()
+            return self.current_time_zone
+        return 1  # Default to time zone 1
     
     def _handle_auto_control(self):
         """Handle automatic control mode"""
         try:
             # Get the current time zone
-            if self.variables.get('use_time_zone', False):
-                self._determine_current_time_zone()
-                time_zone = self.current_time_zone
-            else:
-                time_zone = 1  # Default to time zone 1
+            time_zone = self._active_time_zone()
             
             # Check if blink mode is enabled for this time zone
             blink_mode_var = f"blink_mode_enabled_time_zone_{time_zone}"
@@ -325,6 +809,14 @@ class TrafficController:
             if route_sequence_var in self.variables:
                 route_sequence = self.variables[route_sequence_var]
                 
+                # Coordinated junctions follow the clock instead of counting routes
+                coordinated = self._coordinated_route(route_sequence, time_zone) \
+                    if self.variables.get('coordination_enabled', False) else None
+                if coordinated:
+                    route, duration = coordinated
+                    self._apply_route(route, time_zone, duration)
+                    return
+                
                 # Get the next route in the sequence
                 if not hasattr(self, 'sequence_index') or self.sequence_index >= len(route_sequence):
                     self.sequence_index = 0
@@ -339,96 +831,499 @@ class TrafficController:
         except Exception as e:
             logging.error(f"Error in auto control: {e}")
     
+    def _coordinated_route(self, route_sequence, time_zone):
+        """
+        Return (route, seconds left in it) at this moment of a coordinated cycle,
+        or None if the sequence has no valid route.
+        
+        Every valid route of the sequence gets the zone's route time, and the
+        cycle starts at CYCLE_EPOCH plus the zone's cycle offset, so junctions
+        sharing the epoch hold their offsets to each other however long they run.
+        """
+        route_matrix = self.variables.get('route_matrix', [])
+        timing = self.variables.get(f"pole_1A_red_time_time_zone_{time_zone}", 5)
+        slots = [index for index, route in enumerate(route_sequence) if 0 < route <= len(route_matrix)]
+        if not slots or timing <= 0:
+            return None
+        
+        offset = self.variables.get(f"cycle_offset_time_zone_{time_zone}", 0)
+        position = (time.time() - CYCLE_EPOCH - offset) % (len(slots) * timing)
+        slot = int(position // timing)
+        # Continue from here if coordination is switched off
+        self.sequence_index = slots[slot] + 1
+        return route_sequence[slots[slot]], timing - position % timing
+    
     def _handle_semi_control(self):
-        """Handle semi-automatic control mode"""
-        # Semi-automatic mode is a mix of auto and manual
-        # For now, we'll just use auto control as a base
-        self._handle_auto_control()
+        """
+        Handle semi-actuated control: detector calls skip, hold and end the
+        routes of the sequence. Called every loop tick; without detectors the
+        fixed-time sequence runs instead.
+        """
+        if not self.detectors:
+            self._handle_auto_control()
+            return
+        
+        try:
+            time_zone = self._active_time_zone()
+            if self.variables.get(f"blink_mode_enabled_time_zone_{time_zone}", False):
+                self._actuated = None
+                self._handle_blink_mode(time_zone)
+                return
+            
+            phases = self._compile_actuated_phases(time_zone)
+            if not phases:
+                logging.warning(f"Route sequence for time zone {time_zone} has no valid route")
+                return
+            
+            state = self._actuated
+            if state is None or state["phases"] is not phases:
+                self._start_actuated_phase(time_zone, phases, 0)
+            elif self._actuated_phase_done(state, time_zone):
+                index = self._next_actuated_phase(state)
+                if index is not None:
+                    self.detectors.serve(phases[state["index"]]["greens"])
+                    self._start_actuated_phase(time_zone, phases, index)
+        except Exception as e:
+            logging.error(f"Error in semi control: {e}")
+    
+    def _compile_actuated_phases(self, time_zone):
+        """
+        The zone's sequence as phases: runs of the same route merged, each with
+        the poles it shows green on and how many route times it lasts. Compiled
+        once per variables and time zone.
+        """
+        if self._actuated_phases and self._actuated_phases[0] is self.variables \
+                and self._actuated_phases[1] == time_zone:
+            return self._actuated_phases[2]
+        
+        route_matrix = self.variables.get('route_matrix', [])
+        phases = []
+        for route in self.variables.get(f"route_sequence_{time_zone}", []):
+            if route <= 0 or route > len(route_matrix):
+                continue
+            if phases and phases[-1]["route"] == route:
+                phases[-1]["slots"] += 1
+                continue
+            phases.append({"route": route, "greens": self._route_greens(route), "slots": 1})
+        self._actuated_phases = (self.variables, time_zone, phases)
+        return phases
+    
+    def _start_actuated_phase(self, time_zone, phases, index):
+        phase = phases[index]
+        min_green = self.variables.get('actuated_min_green_time', ACTUATED_MIN_GREEN)
+        # Give waiting pedestrians their crossing time
+        crossing = [self.variables.get(f"pole_{pole}_ped_time_time_zone_{time_zone}", 0)
+                    for pole in phase["greens"] if self.detectors.has_call([pole], "pedestrian")]
+        min_green = max([min_green] + crossing)
+        self._actuated = {"phases": phases, "index": index, "started": time.monotonic(), "min_green": min_green,
+                          "called": None}
+        self.detectors.serve(phase["greens"])
+        self._apply_route(phase["route"], time_zone, duration=0)
+    
+    def _actuated_phase_done(self, state, time_zone):
+        """Whether the phase being served has run its course"""
+        phase = state["phases"][state["index"]]
+        elapsed = time.monotonic() - state["started"]
+        if not phase["greens"]:
+            # Clearance routes keep their fixed time
+            timing = self.variables.get(f"pole_1A_red_time_time_zone_{time_zone}", 5)
+            return elapsed >= phase["slots"] * timing
+        if elapsed < state["min_green"]:
+            return False
+        
+        waiting = [pole for pole in ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"] if pole not in phase["greens"]]
+        if not self.detectors.has_call(waiting):
+            # Nobody else is waiting: rest in green
+            return False
+        # Maximum green counts from the first conflicting call
+        if state["called"] is None:
+            state["called"] = time.monotonic()
+        if time.monotonic() - state["called"] >= self.variables.get('actuated_max_green_time', ACTUATED_MAX_GREEN):
+            return True
+        last = self.detectors.last_actuation(phase["greens"])
+        quiet = elapsed if last is None else time.monotonic() - max(last, state["started"])
+        return quiet >= self.variables.get('actuated_gap_time', ACTUATED_GAP)
+    
+    def _next_actuated_phase(self, state):
+        """
+        The phase to serve next: the clearance after a green, then the next
+        green with a call, skipping greens (and their clearances) nobody is
+        waiting for. With no call anywhere the sequence's first green is served.
+        Returns None to stay in the current phase.
+        """
+        phases = state["phases"]
+        index = state["index"]
+        following = (index + 1) % len(phases)
+        if not phases[following]["greens"]:
+            return following
+        for step in range(len(phases)):
+            candidate = (following + step) % len(phases)
+            if phases[candidate]["greens"] and self.detectors.has_call(phases[candidate]["greens"]):
+                return candidate
+        first = next((candidate for candidate, phase in enumerate(phases) if phase["greens"]), None)
+        return None if first == index else first
+    
+    def _preemption_due(self):
+        """Whether a preemption should take over now: any request, or one outranking the route being held"""
+        if not self.preemptions or self.variables.get('manualcontrol_mode', False):
+            return False
+        active = self.preemptions.active
+        if active is None:
+            return self.preemptions.pending()
+        return active.released or self.preemptions.pending(active.priority)
+    
+    def _handle_preemption(self):
+        """
+        Serve queued preemption requests in priority order (see preemption.py):
+        clear the poles losing green, hold each requested route, then clear
+        towards the route the cycle rejoins at.
+        """
+        try:
+            time_zone = self._active_time_zone()
+            while self._loop_active():
+                request = self.preemptions.pop()
+                if request is None:
+                    break
+                self._clear_to(request.route, time_zone, request)
+                # Released while its clearance ran
+                if request.released or not self._write_route(request.route, "preempt"):
+                    self.preemptions.active = None
+                    continue
+                
+                started = time.monotonic()
+                self._wait(request.hold)
+                self.preemptions.active = None
+                remaining = request.hold - (time.monotonic() - started)
+                if remaining > TICK_INTERVAL and not request.released and self._loop_active():
+                    # A higher-priority request took over; this one resumes after it
+                    self.preemptions.requeue(request, remaining)
+            
+            rejoin = self._rejoin_route(time_zone)
+            if rejoin is not None:
+                self._clear_to(rejoin, time_zone)
+            # Semi mode starts again from the plan's first phase
+            self._actuated = None
+        except Exception as e:
+            self.preemptions.active = None
+            logging.error(f"Error in preemption: {e}")
+    
+    def _route_greens(self, route):
+        """Poles a route of the route matrix shows a green on"""
+        route_matrix = self.variables.get('route_matrix', [])
+        if route <= 0 or route > len(route_matrix):
+            return set()
+        row = route_matrix[route - 1]
+        # Green left, straight and right are lights 2-4 of the pole's six
+        return {pole for index, pole in enumerate(["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"])
+                if any(row[index * 6 + light] for light in (2, 3, 4) if index * 6 + light < len(row))}
+    
+    def _clear_to(self, route, time_zone, request=None):
+        """
+        Run the clearance for the poles that are green (or already clearing on
+        a steady yellow) now but not green in route: the plan's clearance route
+        after the running route if there is one, otherwise yellow then red on
+        just those poles. Poles blinking yellow (blink mode or the fail-safe
+        flash, lamp state 2) go to red with them, and the all-red interval
+        always runs before a route is entered from blink. Not interruptible.
+        """
+        blinking = {pole for pole, lights in self.lamp_states.items() if 2 in lights.values()}
+        lit = {pole for pole, lights in self.lamp_states.items()
+               if any(lights.get(light) == 1 for light in ("yellow", "greenLeft", "greenStraight", "greenRight"))}
+        losing = lit - blinking - self._route_greens(route)
+        if request is not None:
+            self.preemptions.clearance_started(request)
+        if not losing and not blinking:
+            return
+        if blinking:
+            self._clear_poles(losing, blinking)
+            return
+        
+        phases = self._compile_actuated_phases(time_zone)
+        index = next((index for index, phase in enumerate(phases)
+                      if phase["route"] == self.current_route and phase["greens"]), None)
+        following = phases[(index + 1) % len(phases)] if index is not None else None
+        if following is not None and not following["greens"]:
+            timing = self.variables.get(f"pole_1A_red_time_time_zone_{time_zone}", 5)
+            self._write_route(following["route"], "clearance")
+            self._wait(following["slots"] * timing, interruptible=False)
+            return
+        self._clear_poles(losing)
+    
+    def _clear_poles(self, losing, blinking=()):
+        """Yellow then red on the poles losing a steady green or yellow, red at once on blinking ones, then all red"""
+        if losing:
+            for pole in losing:
+                for light in ("greenLeft", "greenStraight", "greenRight"):
+                    self._set_light(pole, light, False)
+                self._set_light(pole, "yellow", True)
+            self._publish_frame("clearance", self.current_route)
+            self._wait(max(self.variables.get('all_pole_yellow_time', 0), PREEMPT_MIN_YELLOW), interruptible=False)
+        for pole in set(losing) | set(blinking):
+            for light in ("yellow", "greenLeft", "greenStraight", "greenRight"):
+                self._set_light(pole, light, False)
+            self._set_light(pole, "red", True)
+        self._publish_frame("clearance", self.current_route)
+        self._wait(PREEMPT_ALL_RED, interruptible=False)
+    
+    def _rejoin_route(self, time_zone):
+        """The route the cycle continues with after a preemption, or None (blink mode, no sequence)"""
+        if self.variables.get(f"blink_mode_enabled_time_zone_{time_zone}", False):
+            return None
+        route_sequence = self.variables.get(f"route_sequence_{time_zone}", [])
+        route_matrix = self.variables.get('route_matrix', [])
+        if self.variables.get('semicontrol_mode', False) and not self.variables.get('autocontrol_mode', False) \
+                and self.detectors:
+            phases = self._compile_actuated_phases(time_zone)
+            return phases[0]["route"] if phases else None
+        if self.variables.get('coordination_enabled', False):
+            coordinated = self._coordinated_route(route_sequence, time_zone)
+            return coordinated[0] if coordinated else None
+        # Free-running auto mode continues with the first green after the interrupted route
+        # (its own clearance has already run)
+        start = getattr(self, 'sequence_index', 0)
+        for step in range(len(route_sequence)):
+            index = (start + step) % len(route_sequence)
+            if 0 < route_sequence[index] <= len(route_matrix) and self._route_greens(route_sequence[index]):
+                self.sequence_index = index
+                return route_sequence[index]
+        return None
     
     def _handle_blink_mode(self, time_zone):
         """Handle blink mode for a time zone"""
         try:
             # In blink mode, all yellow lights blink
             blink_on = int(time.time()) % 2 == 0  # Toggle every second
-            
-            for pole in ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]:
-                # Turn off all other lights
-                for light in ["red", "greenLeft", "greenStraight", "greenRight"]:
-                    if pole in GPIO_MAPPING and light in GPIO_MAPPING[pole]:
-                        pin = GPIO_MAPPING[pole][light]
-                        GPIO.output(pin, GPIO.LOW)
-                
-                # Blink yellow lights
-                if pole in GPIO_MAPPING and "yellow" in GPIO_MAPPING[pole]:
-                    pin = GPIO_MAPPING[pole]["yellow"]
-                    GPIO.output(pin, GPIO.HIGH if blink_on else GPIO.LOW)
+            self._write_blink_frame(blink_on, "blink")
             
             # Sleep for half a second to create the blink effect
-            time.sleep(0.5)
+            self._wait(BLINK_INTERVAL)
         except Exception as e:
             logging.error(f"Error in blink mode: {e}")
     
+    def _write_blink_frame(self, blink_on, mode):
+        """Turn every lamp off except the blinking yellows"""
+        for pole in ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]:
+            # Turn off all other lights
+            for light in ["red", "greenLeft", "greenStraight", "greenRight"]:
+                self._set_light(pole, light, False)
+            
+            # Blink yellow lights
+            self._set_light(pole, "yellow", blink_on, state=2)
+        
+        self._publish_frame(mode)
+    
     def _set_yellow_blink(self, pole):
         """Set a specific pole's yellow light to blink"""
         try:
             # Blink based on current time
             blink_on = int(time.time()) % 2 == 0  # Toggle every second
             
-            if pole in GPIO_MAPPING and "yellow" in GPIO_MAPPING[pole]:
-                pin = GPIO_MAPPING[pole]["yellow"]
-                GPIO.output(pin, GPIO.HIGH if blink_on else GPIO.LOW)
+            self._set_light(pole, "yellow", blink_on, state=2)
         except Exception as e:
             logging.error(f"Error setting yellow blink for pole {pole}: {e}")
     
-    def _apply_route(self, route, time_zone):
-        """Apply a specific route configuration"""
+    def _apply_route(self, route, time_zone, duration=None):
+        """Apply a specific route configuration for duration seconds (default: the zone's route time)"""
         try:
-            # Get the route matrix
-            route_matrix = self.variables.get('route_matrix', [])
-            
-            if route <= 0 or route > len(route_matrix):
-                logging.error(f"Invalid route number: {route}")
+            if not self._write_route(route, "route"):
                 return
             
-            # Get the route configuration (0-indexed)
-            route_config = route_matrix[route - 1]
-            
-            # Apply the configuration to each pole
-            index = 0
-            for pole in ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]:
-                for light in ["red", "yellow", "greenLeft", "greenStraight", "greenRight", "GA"]:
-                    # Skip GA (not used in GPIO mapping)
-                    if light == "GA":
-                        index += 1
-                        continue
-                    
-                    if index < len(route_config):
-                        light_state = route_config[index]
-                        
-                        if pole in GPIO_MAPPING and light in GPIO_MAPPING[pole]:
-                            pin = GPIO_MAPPING[pole][light]
-                            GPIO.output(pin, GPIO.HIGH if light_state else GPIO.LOW)
-                    
-                    index += 1
-            
             # Get the timing for this route and time zone
             timing_var = f"pole_1A_red_time_time_zone_{time_zone}"  # Use any timing as reference
             timing = self.variables.get(timing_var, 5)  # Default to 5 seconds
             
-            # Sleep for the specified time
-            time.sleep(timing)
+            # Sleep for the specified time, keeping the heartbeat going
+            self._wait(timing if duration is None else duration)
         except Exception as e:
             logging.error(f"Error applying route {route}: {e}")
     
+    def _write_route(self, route, mode):
+        """Set the lamps of a route of the route matrix; returns False for an invalid route"""
+        writes = self._route_writes(route)
+        if writes is None:
+            logging.error(f"Invalid route number: {route}")
+            return False
+        
+        # The whole route is written, or none of it if the calling loop has been replaced
+        with self._frame_lock:
+            if not self._may_drive_lamps():
+                return False
+            for pole, light, on in writes:
+                self._set_light(pole, light, on)
+            
+            self.current_route = route
+            self._publish_frame(mode, route)
+        return True
+    
+    def _route_writes(self, route):
+        """
+        The (pole, light, on) lamp writes of a route, or None for an invalid
+        route. Compiled once per variables so a lamp change allocates nothing.
+        """
+        # Keyed by the variables object itself: a reloaded dict may reuse a freed one's id()
+        if self._route_cache[0] is not self.variables:
+            self._route_cache = (self.variables, {})
+        writes = self._route_cache[1].get(route)
+        if writes is not None:
+            return writes
+        
+        # Get the route matrix
+        route_matrix = self.variables.get('route_matrix', [])
+        
+        if route <= 0 or route > len(route_matrix):
+            return None
+        
+        # Get the route configuration (0-indexed)
+        route_config = route_matrix[route - 1]
+        
+        writes = []
+        index = 0
+        for pole in ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "4B"]:
+            for light in ["red", "yellow", "greenLeft", "greenStraight", "greenRight", "GA"]:
+                # Skip GA (not used in GPIO mapping)
+                if light == "GA":
+                    index += 1
+                    continue
+                
+                if index < len(route_config):
+                    writes.append((pole, light, route_config[index]))
+                
+                index += 1
+        
+        self._route_cache[1][route] = writes
+        return writes
+    
     def cleanup(self):
         """Clean up GPIO pins"""
+        if self.detectors:
+            self.detectors.close()
         if GPIO_AVAILABLE:
             GPIO.cleanup()
         logging.info("GPIO cleanup complete")
 
+def measure_watchdog(trials=5):
+    """
+    Stall the control loop on purpose and report how long the watchdog took to
+    notice, compared with the yellow blink period.
+    """
+    import contextlib
+    import io
+    
+    controller = TrafficController()
+    controller.variables = {
+        "autocontrol_mode": True,
+        "route_matrix": [[1, 0, 0, 0, 0, 0] * 8],
+        "route_sequence_1": [1],
+        "pole_1A_red_time_time_zone_1": 1,
+    }
+    controller._variables_changed = lambda: False
+    handle_auto_control = controller._handle_auto_control
+    detections = []
+    
+    # MockGPIO prints every pin change
+    with contextlib.redirect_stdout(io.StringIO()):
+        controller.start_control()
+        for _ in range(trials):
+            time.sleep(1.0)
+            stalls = controller.stall_count
+            # A blocking call that never returns to the loop, like a hung reload
+            controller._handle_auto_control = lambda: time.sleep(WATCHDOG_FAIL_SAFE_TIME + 2)
+            while controller.stall_count == stalls:
+                time.sleep(0.01)
+            detections.append(controller.last_stall["stallSeconds"])
+            controller._handle_auto_control = handle_auto_control
+            while controller.fail_safe:
+                time.sleep(0.05)
+        controller.stop_control()
+    
+    print(f"Stall detected after {min(detections):.3f}-{max(detections):.3f}s without a heartbeat "
+          f"({trials} trials, deadline {WATCHDOG_DEADLINE}s, blink period {2 * BLINK_INTERVAL}s)")
+
+
+def _busy_loop():
+    """Synthetic CPU load for measure_jitter(), run in its own process"""
+    while True:
+        pass
+
+
+def measure_jitter(seconds=20, load_processes=2):
+    """
+    Run the control loop with short routes under a synthetic CPU load (busy
+    processes, and a thread allocating garbage next to a large live heap, as
+    the notify and logging threads do on a busy controller), first at normal
+    priority and then in real-time mode, and print both sleep lateness
+    histograms.
+    """
+    import contextlib
+    import io
+    import multiprocessing
+    
+    # A large heap of long-lived objects makes every automatic full collection slow
+    heap = [{"index": i, "lights": [i, i + 1]} for i in range(300000)]
+    stop = threading.Event()
+    
+    def allocate():
+        while not stop.is_set():
+            garbage = [[] for _ in range(200)]
+            for item in garbage:
+                item.append(garbage)  # Reference cycles, only freed by the collector
+            time.sleep(0.001)
+    
+    results = {}
+    for mode in ("normal", "realtime"):
+        controller = TrafficController()
+        controller.variables = {
+            "autocontrol_mode": True,
+            "route_matrix": [[1, 0, 0, 0, 0, 0] * 8, [0, 0, 1, 0, 0, 0] * 8],
+            "route_sequence_1": [1, 2],
+            "pole_1A_red_time_time_zone_1": 0.25,
+        }
+        controller._variables_changed = lambda: False
+        controller.realtime = mode == "realtime"
+        load = [multiprocessing.Process(target=_busy_loop, daemon=True) for _ in range(load_processes)]
+        allocator = threading.Thread(target=allocate, daemon=True)
+        stop.clear()
+        for process in load:
+            process.start()
+        allocator.start()
+        
+        # MockGPIO prints every pin change
+        with contextlib.redirect_stdout(io.StringIO()):
+            controller.start_control()
+            time.sleep(seconds)
+            controller.stop_control()
+        stop.set()
+        allocator.join()
+        for process in load:
+            process.terminate()
+            process.join()
+        results[mode] = (controller.jitter_counts, controller.stats())
+    
+    labels = [f"<{bound} ms" for bound in JITTER_BUCKETS_MS] + [f">{JITTER_BUCKETS_MS[-1]} ms"]
+    print(f"Sleep lateness over {seconds}s with {load_processes} busy processes and an allocating thread "
+          f"({len(heap)} live objects):")
+    print(f"{'':>10} {'normal':>10} {'realtime':>10}")
+    for index, label in enumerate(labels):
+        print(f"{label:>10} " + " ".join(f"{results[mode][0][index]:>10}" for mode in ("normal", "realtime")))
+    realtime_stats = results["realtime"][1]
+    print(f"Real-time settings: {realtime_stats['realtime']}")
+    print(f"Scheduled GC: {realtime_stats['gc']}")
+
+
 def main():
     """Main function to run the traffic controller"""
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure-watchdog":
+        measure_watchdog()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure-jitter":
+        measure_jitter(float(sys.argv[2]) if len(sys.argv) > 2 else 20)
+        return
+    configure_logging()
     controller = TrafficController()
+    controller.realtime = REALTIME_MODE or "--realtime" in sys.argv[1:]
+    if controller.profiler:
+        install_signal_handler(controller.profiler)
+    controller.start_detectors(mock="--mock-detectors" in sys.argv[1:])
     
     try:
         # Load initial variables